@@ -0,0 +1,218 @@
+"""
+Admission control for /chat
+Two limits protect latency under bursts:
+- a token bucket per client (IP or API key), so one client cannot use up
+  the capacity everyone shares
+- a cap on concurrent LLM-bound requests, with a small wait queue served in
+  priority order (interactive chats before batch items). Once the queue is
+  full a request is turned away at once with a Retry-After hint instead of
+  waiting behind everyone else
+
+Cheap requests (cache hits, questions declined by the topic gate) never take
+an LLM slot, so they are answered straight away however long the queue is
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+# Queue lanes: lower values are served first
+INTERACTIVE = 0
+BATCH = 1
+
+
+class Overloaded(Exception):
+    """A request turned away to keep latency bounded; retry_after is in seconds"""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def retry_after_header(seconds):
+    """Retry-After value: whole seconds, at least 1"""
+    return str(max(1, math.ceil(seconds)))
+
+
+class RateLimiter:
+    """Token buckets of `burst` requests refilled at `rate` per second, one per client
+
+    Stored as the generic cell rate algorithm: per client only the time at
+    which its bucket will be full again (one float), kept in an LRU capped at
+    max_clients. A forgotten client simply starts with a full bucket
+    """
+
+    def __init__(self, rate, burst, max_clients=100000):
+        self.burst = burst
+        self.interval = 1.0 / rate
+        self.capacity = burst * self.interval
+        self.max_clients = max_clients
+        self._full_at = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def take(self, key, cost=1):
+        """Spend cost tokens; returns 0 when allowed, else seconds until they are available"""
+        now = time.monotonic()
+        with self._lock:
+            previous = self._full_at.pop(key, now)
+            full_at = max(previous, now) + cost * self.interval
+            wait = full_at - now - self.capacity
+            if wait > 0:
+                self._full_at[key] = previous
+                self.rejected += 1
+                return wait
+            self._full_at[key] = full_at
+            while len(self._full_at) > self.max_clients:
+                self._full_at.popitem(last=False)
+        return 0.0
+
+    def clients(self):
+        with self._lock:
+            return len(self._full_at)
+
+
+class _Slots:
+    """Slot accounting and the priority wait queue shared by both limiters"""
+
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        # Longest a request waits in the queue before it is turned away
+        self.timeout = timeout
+        self.in_flight = 0
+        # Moving average of how long a slot is held, for Retry-After
+        self.hold_seconds = 1.0
+        self.rejected = {'queue_full': 0, 'queue_timeout': 0}
+        self._waiters = []
+        self._order = itertools.count()
+
+    def _admit(self, lane):
+        """True when a slot is free now; raises Overloaded when the queue is full"""
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return True
+        # Batch items may only fill half the queue, so chats can still get in
+        capacity = self.queue_size if lane == INTERACTIVE else self.queue_size // 2
+        if len(self._waiters) >= capacity:
+            self.rejected['queue_full'] += 1
+            raise Overloaded("Too many requests are waiting for an answer",
+                             self.retry_after(), 'queue_full')
+        return False
+
+    def _enqueue(self, lane, waiter):
+        entry = (lane, next(self._order), waiter)
+        heapq.heappush(self._waiters, entry)
+        return entry
+
+    def _dequeue(self, entry):
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+
+    def _timed_out(self):
+        self.rejected['queue_timeout'] += 1
+        return Overloaded("Timed out waiting for an answer slot", self.retry_after(), 'queue_timeout')
+
+    def _release(self, held):
+        """Hand the slot to the first waiter, or free it; returns that waiter"""
+        self.hold_seconds += 0.2 * (held - self.hold_seconds)
+        if self._waiters:
+            return heapq.heappop(self._waiters)[2]
+        self.in_flight -= 1
+        return None
+
+    def retry_after(self):
+        """Seconds until the queue has likely drained"""
+        return self.hold_seconds * (len(self._waiters) + 1) / self.limit
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "waiting": len(self._waiters),
+                "queue_full": self.rejected['queue_full'],
+                "queue_timeout": self.rejected['queue_timeout']}
+
+
+class ConcurrencyLimiter(_Slots):
+    """At most `limit` LLM-bound requests at once, the rest queued by lane (threads)"""
+
+    def __init__(self, limit, queue_size=0, timeout=10.0):
+        super().__init__(limit, queue_size, timeout)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, lane=INTERACTIVE):
+        """Hold a slot for the body of the with block; raises Overloaded"""
+        self.acquire(lane)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def acquire(self, lane=INTERACTIVE):
+        with self._lock:
+            if self._admit(lane):
+                return
+            granted = threading.Event()
+            entry = self._enqueue(lane, granted)
+        if granted.wait(self.timeout):
+            return
+        with self._lock:
+            # The slot may have been handed over just as the wait timed out
+            if granted.is_set():
+                return
+            self._dequeue(entry)
+            raise self._timed_out()
+
+    def release(self, held=0.0):
+        with self._lock:
+            waiter = self._release(held)
+            if waiter is not None:
+                waiter.set()
+
+    def stats(self):
+        with self._lock:
+            return super().stats()
+
+
+class AsyncConcurrencyLimiter(_Slots):
+    """ConcurrencyLimiter for one event loop"""
+
+    @asynccontextmanager
+    async def slot(self, lane=INTERACTIVE):
+        await self.acquire(lane)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    async def acquire(self, lane=INTERACTIVE):
+        if self._admit(lane):
+            return
+        granted = asyncio.get_running_loop().create_future()
+        entry = self._enqueue(lane, granted)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), self.timeout)
+        except asyncio.TimeoutError:
+            if granted.done():
+                return
+            self._dequeue(entry)
+            raise self._timed_out() from None
+        except asyncio.CancelledError:
+            # A disconnected client gives back a slot it was just handed
+            if granted.done():
+                self.release(self.hold_seconds)
+            else:
+                self._dequeue(entry)
+            raise
+
+    def release(self, held=0.0):
+        waiter = self._release(held)
+        if waiter is not None:
+            waiter.set_result(True)
@@ -1,9 +1,30 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
-import requests
 import os
+import json
+import time
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from embeddings import embed_many, get_embedding
+from chunking import assemble_context, chunk_record
+from admission import BATCH, INTERACTIVE, ConcurrencyLimiter, Overloaded, RateLimiter, retry_after_header
+from context_cache import ContextCache
+from knowledge_base import KnowledgeBase, Refresher, fingerprint, select_pages
+from language import detect_language
+from topic_gate import TopicGate
+from vector_index import VectorIndex, read_manifest
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from llm_client import LLMClient, CircuitBreaker
+from response_cache import ResponseCache, normalize_query
+from session_memory import SessionStore
+from single_flight import SingleFlight
+from tts import AudioCache, SpeechPipeline, load_engine, speech_language, valid_key, valid_voice
+from request_log import Capture, RequestLog, current_capture, note, open_profiler, save_profile
+from metrics import Registry, begin_timings, request_timings, server_timing, timer
 
 # Load environment variables
 load_dotenv()
@@ -21,126 +42,952 @@ DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Supabase client, created on first use: importing the SDK is the slowest
+# part of startup and many requests never reach Supabase (local retrieval,
+# cache hits, off-topic questions)
+_supabase = None
+_supabase_lock = threading.Lock()
+
+def get_supabase():
+    """Return the shared Supabase client, creating it on the first call"""
+    global _supabase
+    if _supabase is None:
+        with _supabase_lock:
+            if _supabase is None:
+                if not (SUPABASE_URL and SUPABASE_KEY):
+                    raise RuntimeError("SUPABASE_URL and SUPABASE_KEY must be set")
+                from supabase import create_client
+                _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
 
 # DeepSeek API endpoints
-DEEPSEEK_CHAT_URL = "https://api.deepseek.com/v1/chat/completions"
-
-def get_embedding(text):
-    """Generate embedding using simple hash-based approach for demo"""
-    import hashlib
-    import struct
-    
-    # Create a deterministic embedding from text
-    hash_obj = hashlib.sha256(text.encode())
-    hash_bytes = hash_obj.digest()
-    
-    # Create 1536-dimensional embedding (matching expected size)
-    embedding = []
-    for i in range(1536):
-        # Use hash bytes cyclically to generate float values
-        byte_idx = i % len(hash_bytes)
-        value = struct.unpack('B', bytes([hash_bytes[byte_idx]]))[0] / 255.0
-        # Add some variation based on position
-        value = (value + (i / 1536)) / 2.0
-        embedding.append(value)
-    
-    return embedding
-
-def search_knowledge_base(query_embedding, top_k=3):
-    """Search Supabase for similar content using vector similarity"""
+DEEPSEEK_CHAT_URL = os.getenv('DEEPSEEK_CHAT_URL', "https://api.deepseek.com/v1/chat/completions")
+
+# Instrumentation: per-stage latency summaries and counters, served on /metrics
+# SERVER_TIMING adds a Server-Timing header with the stage durations to responses
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'false').lower() == 'true'
+metrics = Registry()
+STAGE_SECONDS = metrics.summary('chat_stage_seconds', "Latency of each chat pipeline stage", ['stage'])
+REQUEST_SECONDS = metrics.summary('http_request_duration_seconds',
+                                  "Time until response headers, per endpoint", ['endpoint'])
+REQUESTS = metrics.counter('http_requests_total', "Requests by endpoint and status", ['endpoint', 'status'])
+GATED_OUT = metrics.counter('chat_gated_out_total', "Questions declined by the topic gate")
+UPSTREAM_ERRORS = metrics.counter('upstream_errors_total', "Failed calls to DeepSeek or Supabase",
+                                  ['upstream', 'error'])
+LLM_TOKENS = metrics.counter('llm_tokens_total', "Token usage reported by DeepSeek", ['kind'])
+
+def record_usage(usage):
+    """Count the token usage block of a DeepSeek response"""
+    LLM_TOKENS.inc(usage.get('prompt_tokens', 0), kind='prompt')
+    LLM_TOKENS.inc(usage.get('completion_tokens', 0), kind='completion')
+
+def stage(name):
+    """Time a pipeline stage (and add it to this request's Server-Timing and capture)"""
+    capture = current_capture()
+    block = timer(STAGE_SECONDS, request_timings(), stage=name)
+    return capture.stage(name, block) if capture is not None else block
+
+# DeepSeek client: pooled keep-alive session, timeouts, retries and circuit breaker
+# LLM_POOL_SIZE should match the concurrency of one worker (gunicorn --threads)
+llm_client = LLMClient(
+    DEEPSEEK_CHAT_URL,
+    DEEPSEEK_API_KEY,
+    pool_size=int(os.getenv('LLM_POOL_SIZE', '10')),
+    connect_timeout=float(os.getenv('LLM_CONNECT_TIMEOUT', '3.05')),
+    read_timeout=float(os.getenv('LLM_READ_TIMEOUT', '60')),
+    max_retries=int(os.getenv('LLM_MAX_RETRIES', '2')),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', '5')),
+        reset_timeout=float(os.getenv('LLM_BREAKER_RESET', '30'))
+    ),
+    on_usage=record_usage
+)
+metrics.callback('llm_circuit_open', "1 while the DeepSeek circuit breaker is open or probing",
+                 'gauge', lambda: int(llm_client.breaker.state != 'closed'))
+
+# Retrieval configuration
+# RETRIEVAL_BACKEND: 'supabase' (RPC per query) or 'local' (in-process index)
+# LOCAL_INDEX_SOURCE: where the local index is loaded from, 'json', 'supabase'
+# or 'snapshot' (a prebuilt directory from build_snapshot.py, memory-mapped)
+RETRIEVAL_BACKEND = os.getenv('RETRIEVAL_BACKEND', 'supabase')
+LOCAL_INDEX_SOURCE = os.getenv('LOCAL_INDEX_SOURCE', 'json')
+KNOWLEDGE_BASE_PATH = os.getenv(
+    'KNOWLEDGE_BASE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health_data.json')
+)
+INDEX_SNAPSHOT_PATH = os.getenv(
+    'INDEX_SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index_snapshot')
+)
+MATCH_THRESHOLD = 0.5
+
+# Passages retrieved per query, and the token budget for the assembled context
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '3'))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+
+# Knowledge-base refresh: the in-process indexes are rebuilt by a background
+# thread and swapped in as one snapshot. KB_REFRESH_INTERVAL polls the source
+# for changes (0: only on /admin/reload); KB_BACKGROUND_WARMUP builds the first
+# snapshot in that thread too, so the server starts accepting requests at once.
+# With retrieval through the Supabase RPC that is the default: BM25 then pages
+# through the whole table, and until it is loaded queries use the RPC alone
+KB_REFRESH_INTERVAL = float(os.getenv('KB_REFRESH_INTERVAL', '0'))
+KB_BACKGROUND_WARMUP = os.getenv('KB_BACKGROUND_WARMUP',
+                                 'true' if RETRIEVAL_BACKEND == 'supabase' else 'false').lower() == 'true'
+KB_PAGE_SIZE = int(os.getenv('KB_PAGE_SIZE', '1000'))
+
+def load_local_index():
+    """Load the in-process vector index from a snapshot, Supabase or the JSON file"""
+    if LOCAL_INDEX_SOURCE == 'snapshot':
+        try:
+            index = VectorIndex.from_snapshot(INDEX_SNAPSHOT_PATH)
+            print(f"Loaded local index with {len(index)} passages from {INDEX_SNAPSHOT_PATH}")
+            return index
+        except Exception as e:
+            print(f"Error loading index snapshot, falling back to JSON: {e}")
+    
+    if LOCAL_INDEX_SOURCE == 'supabase':
+        try:
+            index = VectorIndex.from_supabase(get_supabase(), KB_PAGE_SIZE)
+            print(f"Loaded local index with {len(index)} passages from Supabase")
+            return index
+        except Exception as e:
+            print(f"Error loading Supabase snapshot, falling back to JSON: {e}")
+    
+    index = VectorIndex.from_json(KNOWLEDGE_BASE_PATH)
+    print(f"Loaded local index with {len(index)} passages from {KNOWLEDGE_BASE_PATH}")
+    return index
+
+# Hybrid retrieval: an in-process BM25 index over the same passages, fused
+# with the vector ranking by reciprocal rank fusion. The hash embeddings carry
+# no meaning, so by default (weight 0) vector hits only fill slots BM25 leaves
+# empty; raise the weight once a semantic embedding model is in place
+HYBRID_RETRIEVAL = os.getenv('HYBRID_RETRIEVAL', 'true').lower() == 'true'
+HYBRID_VECTOR_WEIGHT = float(os.getenv('HYBRID_VECTOR_WEIGHT', '0'))
+RETRIEVAL_CANDIDATES = int(os.getenv('RETRIEVAL_CANDIDATES', '20'))
+
+# Per-language partitions: a query is searched against passages in its own
+# language only, when that language has at least LANGUAGE_PARTITION_MIN
+# passages (local and BM25 indexes; the Supabase RPC searches everything)
+LANGUAGE_PARTITIONS = os.getenv('LANGUAGE_PARTITIONS', 'true').lower() == 'true'
+
+def passage_source():
+    """Where the lexical index reads its passages from
+
+    With retrieval through the Supabase RPC, BM25 has to rank the same
+    fitness_knowledge rows as the RPC, not the bundled JSON file; a prebuilt
+    snapshot is only used when LOCAL_INDEX_SOURCE asks for it
+    """
+    if RETRIEVAL_BACKEND == 'supabase' and LOCAL_INDEX_SOURCE != 'snapshot':
+        return 'supabase'
+    return LOCAL_INDEX_SOURCE
+
+def load_passages(local_index=None):
+    """Passage rows (without embeddings) for the lexical index, or None when there are none to index"""
+    if local_index is not None:
+        return local_index.passages()
+    source = passage_source()
+    if source == 'snapshot':
+        try:
+            return VectorIndex.from_snapshot(INDEX_SNAPSHOT_PATH).passages()
+        except Exception as e:
+            print(f"Error loading snapshot passages, falling back to JSON: {e}")
+    if source == 'supabase':
+        try:
+            return [row for page in select_pages(get_supabase(), 'id, title, content, parent_id, chunk_index',
+                                                 KB_PAGE_SIZE) for row in page]
+        except Exception as e:
+            if RETRIEVAL_BACKEND == 'supabase':
+                # Ranking the JSON file next to the RPC would answer from other rows than the table
+                print(f"Error loading Supabase passages, retrieving with the RPC only: {e}")
+                return None
+            print(f"Error loading Supabase passages, falling back to JSON: {e}")
+    with open(KNOWLEDGE_BASE_PATH, 'r', encoding='utf-8') as f:
+        return [passage for item in json.load(f) for passage in chunk_record(item)]
+
+def load_lexical_index(local_index=None):
+    """Build the BM25 index used by hybrid retrieval (or open it from the snapshot)"""
+    passages = load_passages(local_index)
+    if passages is None:
+        return None
+    if LOCAL_INDEX_SOURCE == 'snapshot':
+        try:
+            index = BM25Index.from_snapshot(INDEX_SNAPSHOT_PATH, passages)
+            print(f"Loaded BM25 index with {len(index)} passages from {INDEX_SNAPSHOT_PATH}")
+            return index
+        except Exception as e:
+            print(f"Error loading BM25 snapshot, rebuilding it: {e}")
+    # Same passages as the vector index: reuse its language of each row
+    languages = local_index.partitions.codes if passages is getattr(local_index, 'rows', None) else None
+    index = BM25Index(passages, languages=languages)
+    print(f"Loaded BM25 index with {len(index)} passages")
+    return index
+
+def source_version():
+    """Cheap fingerprint of the knowledge-base source, polled before any rebuild
+
+    Follows the same fallbacks as load_local_index(): snapshot manifest,
+    a keyset-paged pass over id/content_hash, or the JSON file's size and mtime.
+    Without KB_REFRESH_INTERVAL nothing compares Supabase fingerprints (the
+    first build and /admin/reload rebuild regardless), so the pass is skipped
+    """
+    if LOCAL_INDEX_SOURCE == 'snapshot':
+        try:
+            return 'snapshot:' + read_manifest(INDEX_SNAPSHOT_PATH)['kb_version']
+        except Exception as e:
+            print(f"Error reading snapshot manifest, falling back to JSON: {e}")
+    if passage_source() == 'supabase' and KB_REFRESH_INTERVAL <= 0:
+        return 'supabase'
+    if passage_source() == 'supabase':
+        try:
+            return 'supabase:' + fingerprint(
+                f"{row['id']}:{row.get('content_hash')}"
+                for page in select_pages(get_supabase(), 'id, content_hash', KB_PAGE_SIZE) for row in page)
+        except Exception as e:
+            print(f"Error fingerprinting Supabase table, falling back to JSON: {e}")
+    stat = os.stat(KNOWLEDGE_BASE_PATH)
+    return 'json:' + fingerprint([stat.st_size, stat.st_mtime_ns])
+
+def build_knowledge_base(version, generation):
+    """Load the in-process indexes into a new snapshot (runs off the request path)"""
+    index = load_local_index() if RETRIEVAL_BACKEND == 'local' else None
+    lexical = load_lexical_index(index) if HYBRID_RETRIEVAL else None
+    return KnowledgeBase(index, lexical, version, generation)
+
+def install_knowledge_base(kb):
+    """Swap in a new snapshot: one assignment, so readers never see half of a reload"""
+    global knowledge_base
+    knowledge_base = kb
+    # Answers built from the old knowledge base are dropped; the context cache
+    # resets itself when it sees the new knowledge_base_version()
+    if kb.generation > 1 and response_cache is not None:
+        response_cache.invalidate()
+    print(f"Knowledge base {kb.version} (generation {kb.generation}) is live")
+
+def knowledge_base_version():
+    """Version tag of the loaded knowledge base (swap count and source fingerprint)"""
+    kb = knowledge_base
+    return (kb.generation, kb.version)
+
+# The live snapshot (empty until the first build). There is nothing to load
+# when retrieval and ranking both happen in Supabase
+knowledge_base = KnowledgeBase()
+refresher = Refresher(source_version, build_knowledge_base, install_knowledge_base,
+                      KB_REFRESH_INTERVAL) if RETRIEVAL_BACKEND == 'local' or HYBRID_RETRIEVAL else None
+
+# Initial snapshot: built now (startup waits for it) or by the refresher thread
+# (requests are served while it loads, and /health reports "warming")
+if refresher is not None:
+    if not KB_BACKGROUND_WARMUP:
+        refresher.refresh()
+    if KB_BACKGROUND_WARMUP or KB_REFRESH_INTERVAL > 0:
+        refresher.start()
+        # A worker forked from a preloaded app does not inherit the thread
+        os.register_at_fork(after_in_child=refresher.restart)
+    metrics.callback('kb_snapshot_age_seconds', "Time since the knowledge-base snapshot was swapped in",
+                     'gauge', lambda: time.time() - knowledge_base.loaded_at)
+    metrics.callback('kb_refresh_failures_total', "Knowledge-base refreshes that failed", 'counter',
+                     lambda: refresher.failures)
+
+# Topic gate: precompiled multilingual keyword matcher; the optional fallback
+# compares query embeddings with the knowledge-base embeddings as topic centroids
+TOPIC_EMBEDDING_FALLBACK = os.getenv('TOPIC_EMBEDDING_FALLBACK', 'false').lower() == 'true'
+TOPIC_CENTROID_THRESHOLD = float(os.getenv('TOPIC_CENTROID_THRESHOLD', '0.8'))
+topic_gate = TopicGate(centroid_threshold=TOPIC_CENTROID_THRESHOLD)
+# Knowledge base whose embeddings the fallback currently compares against
+_topic_source = None
+_topic_lock = threading.Lock()
+
+# Response cache: exact (normalized text + language) and near-duplicate tiers
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+response_cache = ResponseCache(
+    max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(16 * 1024 * 1024))),
+    ttl=float(os.getenv('RESPONSE_CACHE_TTL', '3600')),
+    similarity_threshold=float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0.99'))
+) if RESPONSE_CACHE_ENABLED else None
+
+# Rendered context blocks per document and per top-k result, keyed on
+# document ids and dropped whenever the knowledge-base version changes
+CONTEXT_CACHE_ENABLED = os.getenv('CONTEXT_CACHE_ENABLED', 'true').lower() == 'true'
+context_cache = ContextCache(
+    max_entries=int(os.getenv('CONTEXT_CACHE_ENTRIES', '2048'))
+) if CONTEXT_CACHE_ENABLED else None
+
+# Conversation memory: recent turns per session id, cut to a token budget.
+# Sessions live in this worker's memory, so route a conversation to one
+# worker (a single worker with threads, or sticky sessions)
+SESSION_MEMORY_ENABLED = os.getenv('SESSION_MEMORY_ENABLED', 'true').lower() == 'true'
+session_store = SessionStore(
+    max_sessions=int(os.getenv('SESSION_MAX_SESSIONS', '10000')),
+    max_bytes=int(os.getenv('SESSION_MAX_BYTES', str(32 * 1024 * 1024))),
+    ttl=float(os.getenv('SESSION_TTL', '3600')),
+    max_turns=int(os.getenv('SESSION_MAX_TURNS', '6')),
+    token_budget=int(os.getenv('HISTORY_TOKEN_BUDGET', '600'))
+) if SESSION_MEMORY_ENABLED else None
+
+if response_cache is not None:
+    metrics.callback('response_cache_requests_total', "Response cache lookups by result", 'counter',
+                     lambda: {tier: response_cache.stats()[tier]
+                              for tier in ('hits_exact', 'hits_near', 'misses')},
+                     label='result')
+    metrics.callback('response_cache_bytes', "Approximate size of cached responses", 'gauge',
+                     lambda: response_cache.stats()['bytes'])
+
+if context_cache is not None:
+    metrics.callback('context_cache_requests_total', "Prompt context cache lookups by result", 'counter',
+                     lambda: {result: context_cache.stats()[result]
+                              for result in ('hits', 'block_hits', 'misses')},
+                     label='result')
+
+if session_store is not None:
+    metrics.callback('chat_sessions', "Conversations held in session memory", 'gauge',
+                     lambda: session_store.stats()['sessions'])
+    metrics.callback('chat_session_bytes', "Approximate size of session memory", 'gauge',
+                     lambda: session_store.stats()['bytes'])
+
+# Request coalescing: concurrent identical questions (normalized text +
+# language) share one retrieval and DeepSeek call instead of each making their own
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+flights = SingleFlight(
+    timeout=float(os.getenv('SINGLE_FLIGHT_TIMEOUT', '90'))
+) if SINGLE_FLIGHT_ENABLED else None
+
+if flights is not None:
+    metrics.callback('chat_coalesced_total', "Requests answered by another request's in-flight call",
+                     'counter', lambda: flights.coalesced)
+    metrics.callback('chat_in_flight', "Distinct questions being answered", 'gauge',
+                     lambda: flights.in_flight())
+
+# Server-side speech for /voice: off unless TTS_ENGINE is set (espeak, command
+# or tone), in which case the browser's speechSynthesis is only a fallback
+TTS_ENGINE = os.getenv('TTS_ENGINE', '').lower()
+tts_engine = load_engine(TTS_ENGINE, os.getenv('TTS_COMMAND'))
+speech = SpeechPipeline(
+    tts_engine,
+    AudioCache(os.getenv('TTS_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tts_cache')),
+               max_bytes=int(os.getenv('TTS_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))),
+    workers=int(os.getenv('TTS_WORKERS', '2')),
+    # Sentences waiting for synthesis before /voice answers 503
+    max_queued=int(os.getenv('TTS_MAX_QUEUED', '64'))
+) if tts_engine is not None else None
+# Longest text /voice accepts: a full answer fits, a novel does not
+VOICE_MAX_CHARS = int(os.getenv('VOICE_MAX_CHARS', '5000'))
+
+if speech is not None:
+    metrics.callback('tts_cache_requests_total', "Audio cache lookups by result", 'counter',
+                     lambda: {result: speech.cache.stats()[result] for result in ('hits', 'misses')},
+                     label='result')
+    metrics.callback('tts_cache_bytes', "Size of the on-disk audio cache", 'gauge',
+                     lambda: speech.cache.stats()['bytes'])
+
+# Admission control: a token bucket per client on the chat and voice endpoints, and a
+# cap on concurrent LLM-bound requests with a short priority wait queue.
+# Cache hits and declined questions never wait for an LLM slot. The per-client
+# limit is off by default: behind a hosting proxy (Render, Vercel) every
+# request comes from the proxy's address unless TRUST_PROXY is set
+RATE_LIMIT_PER_MINUTE = float(os.getenv('RATE_LIMIT_PER_MINUTE', '0'))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '10'))
+# Clients sending one of these as X-API-Key get a bucket of their own;
+# everyone else is limited per IP (the X-Forwarded-For client with TRUST_PROXY)
+RATE_LIMIT_API_KEYS = frozenset(key for key in os.getenv('RATE_LIMIT_API_KEYS', '').split(',') if key)
+TRUST_PROXY = os.getenv('TRUST_PROXY', 'false').lower() == 'true'
+LLM_MAX_IN_FLIGHT = int(os.getenv('LLM_MAX_IN_FLIGHT', os.getenv('LLM_POOL_SIZE', '10')))
+LLM_QUEUE_SIZE = int(os.getenv('LLM_QUEUE_SIZE', '20'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '10'))
+# One token per request; /chat/batch is charged one per message in admit_batch()
+RATE_LIMITED_ENDPOINTS = {'chat', 'chat_stream', 'voice'}
+
+rate_limiter = RateLimiter(RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST) \
+    if RATE_LIMIT_PER_MINUTE > 0 else None
+if rate_limiter is not None and not TRUST_PROXY:
+    print("Warning: RATE_LIMIT_PER_MINUTE is set without TRUST_PROXY; behind a reverse proxy "
+          "all clients share the proxy's rate-limit bucket")
+llm_gate = ConcurrencyLimiter(LLM_MAX_IN_FLIGHT, LLM_QUEUE_SIZE, LLM_QUEUE_TIMEOUT) \
+    if LLM_MAX_IN_FLIGHT > 0 else None
+REJECTED = metrics.counter('admission_rejected_total', "Requests turned away by admission control",
+                           ['reason'])
+
+if llm_gate is not None:
+    metrics.callback('llm_slots_in_use', "LLM-bound requests holding an answer slot", 'gauge',
+                     lambda: llm_gate.stats()['in_flight'])
+    metrics.callback('llm_queue_depth', "Requests waiting for an answer slot", 'gauge',
+                     lambda: llm_gate.stats()['waiting'])
+
+# Token for admin-only routes; those routes are disabled when it is unset
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Request capture: with REQUEST_LOG_DIR set, a sampled share of /chat requests
+# (question, language, gate result, retrieved ids, stage timings) is written
+# to rotating gzip JSON Lines files for replay.py. An admin can profile one
+# request per stage by sending X-Profile: cprofile or sample with X-Admin-Token;
+# the output goes to PROFILE_DIR/<X-Profile-Id of the response>
+REQUEST_LOG_DIR = os.getenv('REQUEST_LOG_DIR')
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.001'))
+# Longest a profile stays open; after that it is stopped and the next request may profile
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '120'))
+CAPTURED_ENDPOINTS = {'chat', 'chat_stream'}
+
+request_log = RequestLog(
+    REQUEST_LOG_DIR,
+    sample_rate=float(os.getenv('REQUEST_LOG_SAMPLE_RATE', '0.1')),
+    rotate_bytes=int(os.getenv('REQUEST_LOG_ROTATE_BYTES', str(16 * 1024 * 1024))),
+    backups=int(os.getenv('REQUEST_LOG_BACKUPS', '20'))
+).start() if REQUEST_LOG_DIR else None
+
+if request_log is not None:
+    # A worker forked from a preloaded app does not inherit the writer thread
+    os.register_at_fork(after_in_child=request_log.restart)
+    metrics.callback('request_log_records_total', "Captured request records by result", 'counter',
+                     lambda: request_log.stats(), label='result')
+
+# /chat/batch limits: messages per request and concurrent DeepSeek calls per batch
+BATCH_MAX_MESSAGES = int(os.getenv('BATCH_MAX_MESSAGES', '100'))
+BATCH_LLM_CONCURRENCY = int(os.getenv('BATCH_LLM_CONCURRENCY', '8'))
+
+def reload_knowledge_base(timeout=300):
+    """Rebuild the knowledge-base snapshot now and drop cached answers built from the old one
+
+    With the refresher thread running the rebuild happens there and this
+    call waits for it; requests keep using the old snapshot meanwhile
+    """
+    if refresher is None:
+        return
+    if refresher.running():
+        if not refresher.wait(refresher.notify(force=True), timeout):
+            raise TimeoutError("Knowledge-base rebuild is still running")
+        if refresher.last_error is not None:
+            raise RuntimeError(f"Knowledge-base rebuild failed: {refresher.last_error}")
+    else:
+        refresher.refresh(force=True)
+
+def partition_language(language):
+    """Language to restrict retrieval to, or None to search every passage"""
+    return language if LANGUAGE_PARTITIONS else None
+
+def vector_search(query_embedding, match_count, language=None):
+    """Vector similarity search on the local index or the Supabase RPC"""
+    if RETRIEVAL_BACKEND == 'local':
+        # Nothing to search until the first snapshot is loaded
+        index = knowledge_base.local_index
+        return index.search(query_embedding, MATCH_THRESHOLD, match_count,
+                            partition_language(language)) if index is not None else []
+    
     try:
         # Call Supabase RPC function for vector similarity search
-        result = supabase.rpc(
+        result = get_supabase().rpc(
             'match_fitness_knowledge',
             {
-                'query_embedding': query_embedding,
-                'match_threshold': 0.5,
-                'match_count': top_k
+                'query_embedding': query_embedding.tolist(),
+                'match_threshold': MATCH_THRESHOLD,
+                'match_count': match_count
             }
         ).execute()
         
         return result.data if result.data else []
     except Exception as e:
         print(f"Error searching knowledge base: {e}")
+        UPSTREAM_ERRORS.inc(upstream='supabase', error=type(e).__name__)
         return []
 
-def is_health_fitness_related(query):
+def lexical_search(query, language=None):
+    """BM25 hits, or None when hybrid retrieval is off (or not loaded yet)"""
+    index = knowledge_base.lexical_index
+    if index is None:
+        return None
+    return index.search(query, RETRIEVAL_CANDIDATES, partition_language(language))
+
+def needs_vector_search(lexical_hits, top_k):
+    """Skip the vector search when it could not change the result"""
+    return lexical_hits is None or HYBRID_VECTOR_WEIGHT > 0 or len(lexical_hits) < top_k
+
+def fuse_results(lexical_hits, vector_hits, top_k):
+    """Combine BM25 and vector hits by reciprocal rank fusion"""
+    if lexical_hits is None:
+        return vector_hits[:top_k]
+    return reciprocal_rank_fusion([lexical_hits, vector_hits], top_k,
+                                  weights=[1.0, HYBRID_VECTOR_WEIGHT])
+
+def search_knowledge_base(query, top_k=3, query_embedding=None, language=None):
+    """Search the knowledge base: BM25 and vector similarity, fused by rank"""
+    with stage('retrieve'):
+        lexical_hits = lexical_search(query, language)
+        vector_hits = []
+        if needs_vector_search(lexical_hits, top_k):
+            if query_embedding is None:
+                query_embedding = get_embedding(query)
+            candidates = top_k if lexical_hits is None else RETRIEVAL_CANDIDATES
+            vector_hits = vector_search(query_embedding, candidates, language)
+        hits = fuse_results(lexical_hits, vector_hits, top_k)
+    note(retrieved=[hit.get('id') for hit in hits])
+    return hits
+
+def vector_search_many(query_embeddings, match_count, languages=None):
+    """vector_search() for a batch: one matrix product locally, else one batched RPC"""
+    if RETRIEVAL_BACKEND == 'local':
+        index = knowledge_base.local_index
+        if index is None:
+            return [[] for _ in range(len(query_embeddings))]
+        return index.search_many(query_embeddings, MATCH_THRESHOLD, match_count,
+                                 [partition_language(language) for language in languages]
+                                 if languages else None)
+    
+    hits = [[] for _ in range(len(query_embeddings))]
+    try:
+        result = get_supabase().rpc(
+            'match_fitness_knowledge_batch',
+            {
+                'query_embeddings': np.asarray(query_embeddings).tolist(),
+                'match_threshold': MATCH_THRESHOLD,
+                'match_count': match_count
+            }
+        ).execute()
+        
+        for row in result.data or []:
+            hits[row.pop('query_index')].append(row)
+    except Exception as e:
+        print(f"Error searching knowledge base: {e}")
+        UPSTREAM_ERRORS.inc(upstream='supabase', error=type(e).__name__)
+    return hits
+
+def search_knowledge_base_many(queries, query_embeddings, top_k=3, languages=None):
+    """search_knowledge_base() for a batch of queries, with a single vector search"""
+    languages = languages or [None] * len(queries)
+    with stage('retrieve'):
+        lexical = [lexical_search(query, language) for query, language in zip(queries, languages)]
+        vector = [[] for _ in queries]
+        
+        pending = [i for i, hits in enumerate(lexical) if needs_vector_search(hits, top_k)]
+        if pending:
+            candidates = top_k if knowledge_base.lexical_index is None else RETRIEVAL_CANDIDATES
+            embeddings = np.asarray(query_embeddings)[pending]
+            for i, hits in zip(pending, vector_search_many(embeddings, candidates,
+                                                           [languages[i] for i in pending])):
+                vector[i] = hits
+        
+        return [fuse_results(l, v, top_k) for l, v in zip(lexical, vector)]
+
+def update_topic_centroids():
+    """Point the topic fallback at the live knowledge base's embeddings
+
+    Resolved at gate time, not import: with background warmup the index does
+    not exist yet at import, and a refresh replaces it. Until the first build
+    only keywords are checked; without a local index (Supabase retrieval) the
+    JSON file's embeddings are used, built once
+    """
+    global _topic_source
+    kb = knowledge_base
+    source = kb if RETRIEVAL_BACKEND == 'local' else 'json'
+    if _topic_source == source:
+        return
+    with _topic_lock:
+        if _topic_source == source:
+            return
+        if source == 'json':
+            topic_gate.set_centroids(VectorIndex.from_json(KNOWLEDGE_BASE_PATH).embeddings())
+        elif kb.local_index is not None:
+            topic_gate.set_centroids(kb.local_index.embeddings())
+        else:
+            return
+        _topic_source = source
+
+def classify_topic(query, language=None):
+    """Topic gate result (related, confidence score, matched keywords, method)"""
+    if TOPIC_EMBEDDING_FALLBACK:
+        update_topic_centroids()
+    return topic_gate.classify(query, embed=get_embedding, language=language)
+
+def is_health_fitness_related(query, language=None):
     """Check if query is related to health and fitness"""
-    health_keywords = [
-        # English keywords
-        'health', 'fitness', 'exercise', 'workout', 'nutrition', 'diet',
-        'weight', 'muscle', 'cardio', 'strength', 'yoga', 'meditation',
-        'sleep', 'stress', 'wellness', 'food', 'protein', 'vitamin',
-        'hydration', 'water', 'calories', 'training', 'running', 'gym',
-        'mental', 'physical', 'body', 'energy', 'recovery', 'injury',
-        'posture', 'flexibility', 'stretching', 'core', 'balance',
-        # Hindi keywords (हिंदी)
-        'स्वास्थ्य', 'फिटनेस', 'व्यायाम', 'कसरत', 'पोषण', 'आहार',
-        'वजन', 'मांसपेशी', 'योग', 'ध्यान', 'नींद', 'तनाव',
-        'भोजन', 'प्रोटीन', 'विटामिन', 'पानी', 'कैलोरी', 'प्रशिक्षण',
-        'दौड़', 'जिम', 'मानसिक', 'शारीरिक', 'शरीर', 'ऊर्जा',
-        # Marathi keywords (मराठी)
-        'आरोग्य', 'तंदुरुस्ती', 'व्यायाम', 'कसरत', 'पोषण', 'आहार',
-        'वजन', 'स्नायू', 'योग', 'ध्यान', 'झोप', 'ताण',
-        'अन्न', 'प्रथिने', 'जीवनसत्त्व', 'पाणी', 'कॅलरी', 'प्रशिक्षण',
-        'धावणे', 'जिम', 'मानसिक', 'शारीरिक', 'शरीर', 'ऊर्जा'
-    ]
-    
-    query_lower = query.lower()
-    return any(keyword in query_lower for keyword in health_keywords)
-
-def generate_response(user_query, context):
-    """Generate response using DeepSeek Chat API with RAG context"""
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    with stage('gate'):
+        match = classify_topic(query, language)
+    note(query=query, language=language,
+         gate={"related": match.related, "score": round(match.score, 4), "method": match.method,
+               "matches": match.matches})
+    if not match.related:
+        GATED_OUT.inc()
+    return match.related
+
+OFF_TOPIC_MESSAGE = "I'm trained to talk about health and fitness topics. Could you ask something in that area? I can help with exercise, nutrition, wellness, sleep, stress management, and more!"
+ERROR_MESSAGE = "I apologize, but I'm having trouble generating a response right now. Please try again."
+
+def build_context(similar_docs):
+    """Build the prompt context and source titles from retrieved passages
     
-    # Create system prompt with context
-    system_prompt = """You are a professional health and fitness assistant. 
+    Adjacent passages of the same document are merged and the result is
+    trimmed to CONTEXT_TOKEN_BUDGET
+    """
+    if context_cache is not None:
+        context, sources = context_cache.assemble(similar_docs or [], CONTEXT_TOKEN_BUDGET,
+                                                  knowledge_base_version())
+    else:
+        context, sources = assemble_context(similar_docs or [], CONTEXT_TOKEN_BUDGET)
+    return context or "No specific context available.", sources
+
+# Static part of the system prompt, kept first so every request in a
+# language shares the same prompt prefix (the retrieved context follows it).
+# The query's language is detected up front, so each prompt only needs the
+# one instruction that applies to it
+SYSTEM_PROMPT_BASE = """You are a professional health and fitness assistant. 
 Use the context below to answer the user's question accurately and helpfully.
 If the question is unrelated to health or fitness, politely decline and redirect to health/fitness topics.
 Be conversational, supportive, and provide actionable advice.
+"""
+SYSTEM_PROMPT_PREFIXES = {
+    'en': SYSTEM_PROMPT_BASE + "Respond in the same language as the user's question.\n\nContext:\n",
+    'hi': SYSTEM_PROMPT_BASE + "The user writes in Hindi: respond completely in Hindi (हिंदी).\n\nContext:\n",
+    'mr': SYSTEM_PROMPT_BASE + "The user writes in Marathi: respond completely in Marathi (मराठी).\n\nContext:\n"
+}
 
-IMPORTANT: Always respond in the SAME LANGUAGE as the user's question.
-- If the user asks in Hindi (हिंदी), respond completely in Hindi.
-- If the user asks in Marathi (मराठी), respond completely in Marathi.
-- If the user asks in English, respond in English.
-- Match the user's language exactly in your entire response.
-
-Context:
-{context}
-""".format(context=context)
+def build_chat_payload(user_query, context, stream=False, history=None, language='en'):
+    """Build the DeepSeek chat completion payload with RAG context (and prior turns)"""
+    system_prompt = SYSTEM_PROMPT_PREFIXES.get(language, SYSTEM_PROMPT_PREFIXES['en']) + context + "\n"
     
     payload = {
         "model": "deepseek-chat",
         "messages": [
             {"role": "system", "content": system_prompt},
+            *(history or []),
             {"role": "user", "content": user_query}
         ],
         "temperature": 0.7,
         "max_tokens": 500
     }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def generate_response(user_query, context, history=None, language='en'):
+    """Generate response using DeepSeek Chat API with RAG context"""
+    payload = build_chat_payload(user_query, context, history=history, language=language)
     
     try:
-        response = requests.post(DEEPSEEK_CHAT_URL, json=payload, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        return data['choices'][0]['message']['content']
+        with stage('generate'):
+            return llm_client.complete(payload)
     except Exception as e:
         print(f"Error generating response: {e}")
-        return "I apologize, but I'm having trouble generating a response right now. Please try again."
+        UPSTREAM_ERRORS.inc(upstream='deepseek', error=type(e).__name__)
+        return ERROR_MESSAGE
+
+def stream_response(user_query, context, history=None, language='en'):
+    """Yield response text chunks from a streaming DeepSeek completion"""
+    payload = build_chat_payload(user_query, context, stream=True, history=history, language=language)
+    
+    try:
+        with stage('generate'):
+            yield from llm_client.stream(payload)
+    except Exception as e:
+        print(f"Error streaming response: {e}")
+        UPSTREAM_ERRORS.inc(upstream='deepseek', error=type(e).__name__)
+        yield ERROR_MESSAGE
+
+def open_session(data, headers):
+    """(session id, prior turns) for a request; clients without a valid id get a new one"""
+    if session_store is None:
+        return None, []
+    session_id = data.get('session_id') or headers.get('X-Session-Id')
+    if not session_store.valid_id(session_id):
+        session_id = session_store.new_id()
+        note_session(session_id, [])
+        return session_id, []
+    history = session_store.history(session_id)
+    note_session(session_id, history)
+    return session_id, history
+
+def note_session(session_id, history):
+    """Tag a captured record with its conversation: a hash groups the turns without storing the id"""
+    if current_capture() is not None:
+        note(session=hashlib.sha256(session_id.encode('utf-8')).hexdigest()[:12],
+             history_turns=len(history))
+
+def remember_turn(session_id, user_query, ai_response):
+    """Store a completed turn in the session (failed answers are not worth remembering)"""
+    if session_store is not None and session_id and ERROR_MESSAGE not in ai_response:
+        session_store.record(session_id, user_query, ai_response)
+
+def search_query_for(user_query, related, history):
+    """Text to retrieve with: a follow-up the gate does not recognise ("and how
+    many sets?") is searched together with the previous question"""
+    previous = [message["content"] for message in history if message["role"] == "user"]
+    if related or not previous:
+        return user_query
+    return f"{previous[-1]} {user_query}"
+
+def with_session(result, session_id):
+    """Response body with the session id the client should send back"""
+    return dict(result, session_id=session_id) if session_id else result
+
+def client_key(headers, remote_addr):
+    """Rate-limit bucket of a request: its API key when recognized, else its IP"""
+    api_key = headers.get('X-API-Key')
+    if api_key and api_key in RATE_LIMIT_API_KEYS:
+        return 'key:' + api_key
+    if TRUST_PROXY and headers.get('X-Forwarded-For'):
+        return 'ip:' + headers['X-Forwarded-For'].split(',')[0].strip()
+    return 'ip:' + (remote_addr or 'unknown')
+
+def take_tokens(headers, remote_addr, cost=1):
+    """Overloaded when the client has fewer than cost tokens left, else None"""
+    if rate_limiter is None:
+        return None
+    wait = rate_limiter.take(client_key(headers, remote_addr), cost)
+    if wait:
+        return Overloaded("Too many requests, please slow down", wait, 'rate_limited')
+    return None
+
+def check_rate_limit(endpoint, headers, remote_addr):
+    """Overloaded when the client has no tokens left for a rate-limited endpoint, else None"""
+    if endpoint not in RATE_LIMITED_ENDPOINTS:
+        return None
+    return take_tokens(headers, remote_addr)
+
+def max_batch_messages():
+    """Messages allowed in one batch: a batch larger than the burst could never be admitted"""
+    if rate_limiter is None:
+        return BATCH_MAX_MESSAGES
+    return min(BATCH_MAX_MESSAGES, rate_limiter.burst)
+
+def admit_batch(messages, headers, remote_addr):
+    """Validate a /chat/batch message list and charge its client one token per message
+
+    Returns the (body, status, headers) to answer with instead, or None
+    """
+    if not isinstance(messages, list) or not messages:
+        return {"error": "messages must be a non-empty list"}, 400, {}
+    limit = max_batch_messages()
+    if len(messages) > limit:
+        return {"error": f"At most {limit} messages per batch"}, 413, {}
+    error = take_tokens(headers, remote_addr, len(messages))
+    return rejection(error) if error is not None else None
+
+def rejection(error):
+    """JSON body, status and headers for an Overloaded error: 429 per client, 503 when the queue is full"""
+    REJECTED.inc(reason=error.reason)
+    status = 429 if error.reason == 'rate_limited' else 503
+    return {"error": str(error)}, status, {"Retry-After": retry_after_header(error.retry_after)}
+
+def begin_capture(endpoint, headers):
+    """Capture of this request when it is sampled or an admin asked for a profile, else None"""
+    if endpoint not in CAPTURED_ENDPOINTS:
+        Capture.skip()
+        return None
+    profiler = None
+    mode = headers.get('X-Profile')
+    if mode and ADMIN_TOKEN and headers.get('X-Admin-Token') == ADMIN_TOKEN:
+        profiler = open_profiler(mode.strip().lower(), PROFILE_SAMPLE_INTERVAL, PROFILE_MAX_SECONDS)
+    if profiler is None and (request_log is None or not request_log.sampled()):
+        Capture.skip()
+        return None
+    return Capture.begin(endpoint, profiler)
+
+def end_capture(capture, status):
+    """Write the captured record and the request's profile, if any (once per capture)"""
+    record = capture.finish(status)
+    if record is None:
+        return
+    if capture.profiler is not None:
+        try:
+            save_profile(capture.profiler, os.path.join(PROFILE_DIR, capture.id))
+        except Exception as e:
+            print(f"Error saving request profile: {e}")
+    if request_log is not None:
+        request_log.write(record)
+
+@contextmanager
+def llm_slot(lane=INTERACTIVE):
+    """Hold an answer slot while retrieving and generating; raises Overloaded"""
+    if llm_gate is None:
+        yield
+        return
+    with stage('queue'):
+        llm_gate.acquire(lane)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        llm_gate.release(time.monotonic() - start)
+
+def answer_query(user_query, language, query_embedding, search_query=None, history=None):
+    """Retrieve, generate and (without history) cache the answer to a question"""
+    with llm_slot():
+        similar_docs = search_knowledge_base(search_query or user_query, RETRIEVAL_TOP_K,
+                                             query_embedding, language)
+        
+        with stage('context'):
+            context, sources = build_context(similar_docs)
+        
+        ai_response = generate_response(user_query, context, history, language)
+    
+    result = {
+        "response": ai_response,
+        "sources": sources
+    }
+    if response_cache is not None and not history and ai_response != ERROR_MESSAGE:
+        response_cache.put(user_query, language, result, query_embedding)
+    return result
+
+def answer_stream(user_query, language, query_embedding, search_query=None, history=None):
+    """answer_query() as ("admitted", None) once it holds an answer slot, then
+    ("token", text) items followed by ("done", sources)"""
+    tokens = []
+    with llm_slot():
+        yield "admitted", None
+        similar_docs = search_knowledge_base(search_query or user_query, RETRIEVAL_TOP_K,
+                                             query_embedding, language)
+        with stage('context'):
+            context, sources = build_context(similar_docs)
+        
+        for token in stream_response(user_query, context, history, language):
+            tokens.append(token)
+            yield "token", token
+        yield "done", sources
+    
+    ai_response = "".join(tokens)
+    if response_cache is not None and not history and ERROR_MESSAGE not in ai_response:
+        response_cache.put(user_query, language,
+                           {"response": ai_response, "sources": sources}, query_embedding)
+
+def coalesce_key(user_query, language):
+    return normalize_query(user_query), language
+
+def prepare_batch(messages, language=None):
+    """Validate, gate, dedup and cache-check a batch of messages
+    
+    Returns (results, jobs): results is the ordered output list with invalid,
+    off-topic and cached items already filled in; each job is one distinct
+    question (normalized text + language) still to be answered, with its
+    embedding and the result positions it fills
+    """
+    results = [None] * len(messages)
+    jobs = {}
+    for position, item in enumerate(messages):
+        text, requested = (item.get('message'), item.get('language', language)) \
+            if isinstance(item, dict) else (item, language)
+        if not isinstance(text, str) or not text.strip():
+            results[position] = {"error": "Message is required"}
+            continue
+        
+        text = text.strip()
+        item_language = detect_language(text, requested)
+        if not is_health_fitness_related(text, item_language):
+            results[position] = {"response": OFF_TOPIC_MESSAGE}
+            continue
+        
+        job = jobs.setdefault((normalize_query(text), item_language),
+                              {"query": text, "language": item_language, "positions": []})
+        job["positions"].append(position)
+    
+    jobs = list(jobs.values())
+    pending = []
+    # One vectorized call embeds every distinct question
+    with stage('embed'):
+        embeddings = embed_many(job["query"] for job in jobs)
+    for job, embedding in zip(jobs, embeddings):
+        job["embedding"] = embedding
+        cached = response_cache.get(job["query"], job["language"], embedding) \
+            if response_cache is not None else None
+        if cached is not None:
+            for position in job["positions"]:
+                results[position] = cached
+        else:
+            pending.append(job)
+    
+    return results, pending
+
+def attach_context(jobs, batch_hits):
+    """Build each job's prompt context and sources from its retrieval hits"""
+    for job, similar_docs in zip(jobs, batch_hits):
+        job["context"], job["sources"] = build_context(similar_docs)
+
+def finish_batch_job(results, job, ai_response):
+    """Fill every position of a job with its answer, or a per-item error"""
+    if ai_response is None:
+        value = {"error": ERROR_MESSAGE}
+    else:
+        value = {"response": ai_response, "sources": job["sources"]}
+        if response_cache is not None:
+            response_cache.put(job["query"], job["language"], value, job["embedding"])
+    
+    for position in job["positions"]:
+        results[position] = value
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Event"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    capture = begin_capture(request.endpoint, request.headers)
+    # Stage timings go to the Server-Timing header and the capture alike
+    begin_timings(capture.timings if capture is not None else None)
+
+@app.before_request
+def admit_request():
+    """Per-client rate limit on the chat and voice endpoints"""
+    error = check_rate_limit(request.endpoint, request.headers, request.remote_addr)
+    if error is not None:
+        body, status, headers = rejection(error)
+        return jsonify(body), status, headers
+
+@app.after_request
+def record_request(response):
+    """Request latency/status metrics and the optional Server-Timing header"""
+    endpoint = request.endpoint or 'unknown'
+    start = g.get('request_start')
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    timings = request_timings()
+    if SERVER_TIMING and timings:
+        response.headers['Server-Timing'] = server_timing(timings)
+    capture = current_capture()
+    if capture is not None:
+        if capture.profiler is not None:
+            response.headers['X-Profile-Id'] = capture.id
+        if not capture.deferred:
+            end_capture(capture, response.status_code)
+    return response
+
+@app.teardown_request
+def release_capture(error=None):
+    """Finish a capture the response never reached, so a profile is not left running"""
+    capture = current_capture()
+    if capture is not None and not capture.deferred:
+        end_capture(capture, 500)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def health_status():
+    """/health body and status code: 503 while local retrieval waits for its first knowledge-base snapshot"""
+    body = {"status": "healthy", "message": "Health & Fitness AI Assistant is running"}
+    if refresher is None:
+        return body, 200
+    body["knowledge_base"] = dict(knowledge_base.info(), **refresher.stats())
+    if not knowledge_base.ready:
+        body["status"] = "warming"
+        # The RPC answers without the in-process indexes; only local retrieval needs them
+        if RETRIEVAL_BACKEND == 'local':
+            return body, 503
+    return body, 200
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "message": "Health & Fitness AI Assistant is running"})
+    body, status = health_status()
+    return jsonify(body), status
 
 @app.route('/chat', methods=['POST'])
 def chat():
     """Main chat endpoint with RAG pipeline"""
+    # Clients asking for an event stream get the streaming variant
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return chat_stream()
+    
     try:
         data = request.json
         user_query = data.get('message', '').strip()
@@ -148,52 +995,249 @@ def chat():
         if not user_query:
             return jsonify({"error": "Message is required"}), 400
         
-        # Check if query is health/fitness related
-        if not is_health_fitness_related(user_query):
-            return jsonify({
-                "response": "I'm trained to talk about health and fitness topics. Could you ask something in that area? I can help with exercise, nutrition, wellness, sleep, stress management, and more!"
-            })
+        # Earlier turns of this conversation, if the client sent a session id
+        session_id, history = open_session(data, request.headers)
         
-        # Generate embedding for user query
-        query_embedding = get_embedding(user_query)
+        # Detected once; picks the keyword table, knowledge-base partition, prompt and cache key
+        language = detect_language(user_query, data.get('language'))
         
-        if not query_embedding:
-            return jsonify({"error": "Failed to process query"}), 500
+        # Check if query is health/fitness related (or a follow-up in a conversation)
+        related = is_health_fitness_related(user_query, language)
+        if not related and not history:
+            return jsonify(with_session({
+                "response": OFF_TOPIC_MESSAGE
+            }, session_id))
+        search_query = search_query_for(user_query, related, history)
         
-        # Search knowledge base
-        similar_docs = search_knowledge_base(query_embedding, top_k=3)
+        # Generate embedding for user query
+        with stage('embed'):
+            query_embedding = get_embedding(search_query)
         
-        # Build context from retrieved documents
-        context = "\n\n".join([
-            f"Title: {doc['title']}\nContent: {doc['content']}"
-            for doc in similar_docs
-        ]) if similar_docs else "No specific context available."
+        # Serve repeated questions from the response cache (answers that
+        # depend on earlier turns are neither served from nor stored in it)
+        if response_cache is not None and not history:
+            with stage('cache'):
+                cached = response_cache.get(user_query, language, query_embedding)
+            note(cache_hit=cached is not None)
+            if cached is not None:
+                remember_turn(session_id, user_query, cached["response"])
+                return jsonify(with_session(cached, session_id))
         
-        # Generate response using DeepSeek
-        ai_response = generate_response(user_query, context)
+        # Search the knowledge base and generate the answer; identical questions
+        # arriving while one is being answered wait for it instead
+        if flights is not None and not history:
+            # 'coalesce' is a follower's wait; the leader's retrieve/context/generate are timed as usual
+            result, shared = flights.do(coalesce_key(user_query, language),
+                                        lambda: answer_query(user_query, language, query_embedding),
+                                        wait=lambda: stage('coalesce'))
+            note(coalesced=shared)
+        else:
+            result = answer_query(user_query, language, query_embedding, search_query, history)
+        remember_turn(session_id, user_query, result["response"])
         
-        return jsonify({
-            "response": ai_response,
-            "sources": [doc['title'] for doc in similar_docs]
-        })
+        return jsonify(with_session(result, session_id))
         
+    except Overloaded as e:
+        body, status, headers = rejection(e)
+        return jsonify(body), status, headers
+    except TimeoutError:
+        return jsonify({"error": "Timed out waiting for the answer"}), 504
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming chat endpoint: forwards DeepSeek tokens as Server-Sent Events"""
+    try:
+        data = request.json
+        user_query = data.get('message', '').strip()
+        
+        if not user_query:
+            return jsonify({"error": "Message is required"}), 400
+        
+        session_id, history = open_session(data, request.headers)
+        language = detect_language(user_query, data.get('language'))
+        cached = None
+        related = is_health_fitness_related(user_query, language)
+        if not related and not history:
+            cached = {"response": OFF_TOPIC_MESSAGE, "sources": []}
+        else:
+            search_query = search_query_for(user_query, related, history)
+            with stage('embed'):
+                query_embedding = get_embedding(search_query)
+            if response_cache is not None and not history:
+                with stage('cache'):
+                    cached = response_cache.get(user_query, language, query_embedding)
+                note(cache_hit=cached is not None)
+                if cached is not None:
+                    remember_turn(session_id, user_query, cached['response'])
+        
+        if cached is None:
+            # Concurrent identical questions share one generated stream
+            if flights is not None and not history:
+                events = flights.stream(coalesce_key(user_query, language),
+                                        lambda: answer_stream(user_query, language, query_embedding))
+            else:
+                events = answer_stream(user_query, language, query_embedding, search_query, history)
+            # Wait for an answer slot before the 200 goes out, so overload is still a 503
+            next(events)
+        
+    except Overloaded as e:
+        body, status, headers = rejection(e)
+        return jsonify(body), status, headers
+    except TimeoutError:
+        return jsonify({"error": "Timed out waiting for the answer"}), 504
+    except Exception as e:
+        print(f"Error in chat stream endpoint: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+    
+    def generate():
+        # Each "token" event carries a text delta; "done" carries the sources
+        if cached is not None:
+            yield sse_event({"token": cached['response']}, event="token")
+            yield sse_event(with_session({"sources": cached.get('sources', [])}, session_id),
+                            event="done")
+            return
+        
+        tokens = []
+        try:
+            for kind, value in events:
+                if kind == "token":
+                    tokens.append(value)
+                    yield sse_event({"token": value}, event="token")
+                elif kind == "done":
+                    yield sse_event(with_session({"sources": value}, session_id), event="done")
+        except TimeoutError:
+            tokens.append(ERROR_MESSAGE)
+            yield sse_event({"token": ERROR_MESSAGE}, event="token")
+            yield sse_event(with_session({"sources": []}, session_id), event="done")
+        remember_turn(session_id, user_query, "".join(tokens))
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+    capture = current_capture()
+    if capture is not None:
+        # Finished when the server closes the body: after the last event, or
+        # on a disconnect, even one before the body was iterated at all
+        capture.deferred = True
+        response.call_on_close(lambda: end_capture(capture, 200))
+    return response
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """Answer a list of messages in one request; results keep the input order"""
+    try:
+        data = request.json
+        messages = data.get('messages')
+        
+        refused = admit_batch(messages, request.headers, request.remote_addr)
+        if refused is not None:
+            body, status, headers = refused
+            return jsonify(body), status, headers
+        
+        results, jobs = prepare_batch(messages, data.get('language'))
+        if jobs:
+            # Retrieval for every distinct question in one search
+            attach_context(jobs, search_knowledge_base_many(
+                [job["query"] for job in jobs], [job["embedding"] for job in jobs], RETRIEVAL_TOP_K,
+                [job["language"] for job in jobs]
+            ))
+            
+            def answer(job):
+                try:
+                    payload = build_chat_payload(job["query"], job["context"], language=job["language"])
+                    # Batch items queue behind interactive chats
+                    with llm_slot(BATCH), timer(STAGE_SECONDS, stage='generate'):
+                        return llm_client.complete(payload)
+                except Overloaded as e:
+                    REJECTED.inc(reason=e.reason)
+                    return None
+                except Exception as e:
+                    print(f"Error generating batch response: {e}")
+                    UPSTREAM_ERRORS.inc(upstream='deepseek', error=type(e).__name__)
+                    return None
+            
+            # Bounded fan-out of the DeepSeek calls
+            with stage('generate_batch'), \
+                    ThreadPoolExecutor(max_workers=min(BATCH_LLM_CONCURRENCY, len(jobs))) as executor:
+                for job, ai_response in zip(jobs, executor.map(answer, jobs)):
+                    finish_batch_job(results, job, ai_response)
+        
+        return jsonify({"results": results})
+        
+    except Exception as e:
+        print(f"Error in chat batch endpoint: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """Reload the knowledge base and invalidate cached responses"""
+    if not ADMIN_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({"error": "Forbidden"}), 403
+    
+    try:
+        reload_knowledge_base()
+        return jsonify({"status": "reloaded", "knowledge_base": knowledge_base.info()})
+    except Exception as e:
+        print(f"Error reloading knowledge base: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
 @app.route('/voice', methods=['POST'])
 def voice():
-    """Optional endpoint for voice-specific processing"""
+    """Speech for a response: per-sentence audio URLs, or one WAV stream with Accept: audio/wav"""
     try:
         data = request.json
         text = data.get('text', '')
+        if len(text) > VOICE_MAX_CHARS:
+            return jsonify({"error": f"Text is limited to {VOICE_MAX_CHARS} characters"}), 413
+        
+        # Without a TTS engine the browser speaks the text itself
+        if speech is None or not text.strip():
+            return jsonify({"text": text})
+        
+        voice_name = data.get('voice')
+        if voice_name is not None and not valid_voice(voice_name):
+            return jsonify({"error": "Invalid voice"}), 400
+        language = speech_language(text, data.get('language'))
+        chunks = speech.chunks(text, language, voice_name)
+        
+        if request.accept_mimetypes.best == 'audio/wav':
+            # Playback starts with the first sentence while the rest is synthesized
+            return Response(speech.stream(chunks), mimetype='audio/wav',
+                            headers={"Cache-Control": "no-cache"})
         
-        # For now, just return the text (browser will handle TTS)
-        return jsonify({"text": text})
+        speech.prefetch(chunks)
+        return jsonify({
+            "text": text,
+            "language": language,
+            "chunks": [{"text": sentence, "url": f"/voice/audio/{key}.wav"}
+                       for sentence, key, _ in chunks]
+        })
         
+    except Overloaded as e:
+        body, status, headers = rejection(e)
+        return jsonify(body), status, headers
     except Exception as e:
         print(f"Error in voice endpoint: {e}")
         return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/voice/audio/<key>.wav', methods=['GET'])
+def voice_audio(key):
+    """Audio for one sentence; cache files never change, so they are served with range support"""
+    if speech is None or not valid_key(key):
+        return jsonify({"error": "Not found"}), 404
+    try:
+        with stage('tts'):
+            path = speech.audio_path(key)
+    except Exception as e:
+        print(f"Error synthesizing speech: {e}")
+        return jsonify({"error": "Speech synthesis failed"}), 502
+    if path is None:
+        return jsonify({"error": "Not found"}), 404
+    return send_file(path, mimetype='audio/wav', conditional=True, etag=key, max_age=31536000)
 if __name__ == '__main__':
     # Check if environment variables are set
     if not all([DEEPSEEK_API_KEY, SUPABASE_URL, SUPABASE_KEY]):
@@ -0,0 +1,601 @@
+"""
+Async (ASGI) serving mode for the Health & Fitness AI Assistant
+Same /health, /chat, /chat/stream and /voice contracts as app.py, but
+retrieval and generation are awaited on non-blocking HTTP clients, so one
+process can hold hundreds of concurrent chats while DeepSeek is generating
+
+Run with:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+import numpy as np
+from quart import Quart, Response, g, jsonify, request, send_file
+from quart_cors import cors
+
+from admission import BATCH, INTERACTIVE, AsyncConcurrencyLimiter, Overloaded
+from embeddings import get_embedding
+from language import detect_language
+from llm_client import AsyncClientPool, AsyncLLMClient, CircuitBreaker
+from metrics import begin_timings, request_timings, server_timing, timer
+from request_log import current_capture, note
+from single_flight import AsyncSingleFlight
+from tts import speech_language, valid_key, valid_voice
+
+# The RAG pipeline pieces (gate, prompt, caches, local index) are shared with app.py
+import app as pipeline
+
+app = Quart(__name__)
+# Same CORS policy as the Flask app
+app = cors(app, allow_origin=[
+    re.compile(r"https://.*\.github\.io"),    # Allow all GitHub Pages
+    re.compile(r"http://localhost(:\d+)?"),    # Allow local development
+    re.compile(r"http://127\.0\.0\.1(:\d+)?")  # Allow local development
+])
+
+# Concurrent upstream connections held by this process
+ASYNC_POOL_SIZE = int(os.getenv('ASYNC_POOL_SIZE', '200'))
+
+llm_client = None
+supabase_http = None
+
+# Request coalescing on this event loop; the /metrics callbacks registered
+# by app.py read pipeline.flights, so they report this one
+flights = AsyncSingleFlight(pipeline.flights.timeout) if pipeline.flights is not None else None
+pipeline.flights = flights
+
+# Answer slots on this event loop (same limits as app.py); the /metrics
+# callbacks read pipeline.llm_gate
+llm_gate = AsyncConcurrencyLimiter(pipeline.LLM_MAX_IN_FLIGHT, pipeline.LLM_QUEUE_SIZE,
+                                   pipeline.LLM_QUEUE_TIMEOUT) if pipeline.llm_gate is not None else None
+pipeline.llm_gate = llm_gate
+
+
+# Stages timed here and in the shared pipeline land in the same request timings
+stage = pipeline.stage
+
+
+class CapturedBody:
+    """Stream body that finishes its request's capture when Quart closes it
+
+    Unlike a finally in the generator, this also runs for a body that was
+    never iterated (the client left before the first event)
+    """
+
+    def __init__(self, body, capture):
+        self.body = body
+        self.capture = capture
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.body.__anext__()
+
+    async def aclose(self):
+        try:
+            await self.body.aclose()
+        finally:
+            pipeline.end_capture(self.capture, 200)
+
+
+@app.before_serving
+async def open_clients():
+    """Create the async clients on the serving event loop"""
+    global llm_client, supabase_http
+    llm_client = AsyncLLMClient(
+        pipeline.DEEPSEEK_CHAT_URL,
+        pipeline.DEEPSEEK_API_KEY,
+        pool_size=ASYNC_POOL_SIZE,
+        connect_timeout=pipeline.llm_client.timeout[0],
+        read_timeout=pipeline.llm_client.timeout[1],
+        max_retries=pipeline.llm_client.max_retries,
+        breaker=CircuitBreaker(
+            failure_threshold=pipeline.llm_client.breaker.failure_threshold,
+            reset_timeout=pipeline.llm_client.breaker.reset_timeout
+        ),
+        on_usage=pipeline.record_usage
+    )
+    # PostgREST endpoint behind supabase.rpc() (local retrieval runs without Supabase settings)
+    supabase_http = AsyncClientPool(
+        ASYNC_POOL_SIZE,
+        base_url=f"{pipeline.SUPABASE_URL}/rest/v1",
+        headers={
+            "apikey": pipeline.SUPABASE_KEY,
+            "Authorization": f"Bearer {pipeline.SUPABASE_KEY}",
+            "Content-Type": "application/json"
+        },
+        timeout=httpx.Timeout(10.0, connect=3.05)
+    ) if pipeline.SUPABASE_URL and pipeline.SUPABASE_KEY else None
+
+
+@app.after_serving
+async def close_clients():
+    await llm_client.aclose()
+    if supabase_http is not None:
+        await supabase_http.aclose()
+
+
+async def vector_search(query_embedding, match_count, language=None):
+    """Vector similarity search without blocking the event loop"""
+    if pipeline.RETRIEVAL_BACKEND == 'local':
+        # In-process search takes microseconds, no need to leave the loop
+        return pipeline.vector_search(query_embedding, match_count, language)
+
+    try:
+        response = await supabase_http.next_client().post('/rpc/match_fitness_knowledge', json={
+            'query_embedding': np.asarray(query_embedding).tolist(),
+            'match_threshold': pipeline.MATCH_THRESHOLD,
+            'match_count': match_count
+        })
+        response.raise_for_status()
+        return response.json() or []
+    except Exception as e:
+        print(f"Error searching knowledge base: {e}")
+        pipeline.UPSTREAM_ERRORS.inc(upstream='supabase', error=type(e).__name__)
+        return []
+
+
+async def search_knowledge_base(query, top_k=3, query_embedding=None, language=None):
+    """Hybrid BM25 + vector search, same ranking as app.search_knowledge_base"""
+    with stage('retrieve'):
+        lexical_hits = pipeline.lexical_search(query, language)
+        vector_hits = []
+        if pipeline.needs_vector_search(lexical_hits, top_k):
+            if query_embedding is None:
+                query_embedding = get_embedding(query)
+            candidates = top_k if lexical_hits is None else pipeline.RETRIEVAL_CANDIDATES
+            vector_hits = await vector_search(query_embedding, candidates, language)
+        hits = pipeline.fuse_results(lexical_hits, vector_hits, top_k)
+    note(retrieved=[hit.get('id') for hit in hits])
+    return hits
+
+
+async def vector_search_many(query_embeddings, match_count, languages=None):
+    """Batched vector search: one matrix product locally, else one batched RPC"""
+    if pipeline.RETRIEVAL_BACKEND == 'local':
+        return pipeline.vector_search_many(query_embeddings, match_count, languages)
+
+    hits = [[] for _ in range(len(query_embeddings))]
+    try:
+        client = supabase_http.next_client()
+        response = await client.post('/rpc/match_fitness_knowledge_batch', json={
+            'query_embeddings': np.asarray(query_embeddings).tolist(),
+            'match_threshold': pipeline.MATCH_THRESHOLD,
+            'match_count': match_count
+        })
+        response.raise_for_status()
+        for row in response.json() or []:
+            hits[row.pop('query_index')].append(row)
+    except Exception as e:
+        print(f"Error searching knowledge base: {e}")
+        pipeline.UPSTREAM_ERRORS.inc(upstream='supabase', error=type(e).__name__)
+    return hits
+
+
+async def search_knowledge_base_many(queries, query_embeddings, top_k=3, languages=None):
+    """Same ranking as app.search_knowledge_base_many"""
+    languages = languages or [None] * len(queries)
+    with stage('retrieve'):
+        lexical = [pipeline.lexical_search(query, language)
+                   for query, language in zip(queries, languages)]
+        vector = [[] for _ in queries]
+
+        pending = [i for i, hits in enumerate(lexical)
+                   if pipeline.needs_vector_search(hits, top_k)]
+        if pending:
+            candidates = (top_k if pipeline.knowledge_base.lexical_index is None
+                          else pipeline.RETRIEVAL_CANDIDATES)
+            embeddings = np.asarray(query_embeddings)[pending]
+            pending_languages = [languages[i] for i in pending]
+            for i, hits in zip(pending, await vector_search_many(embeddings, candidates,
+                                                                 pending_languages)):
+                vector[i] = hits
+
+        return [pipeline.fuse_results(l, v, top_k) for l, v in zip(lexical, vector)]
+
+
+async def generate_response(user_query, context, history=None, language='en'):
+    """Generate response using DeepSeek Chat API with RAG context"""
+    payload = pipeline.build_chat_payload(user_query, context, history=history, language=language)
+
+    try:
+        with stage('generate'):
+            return await llm_client.complete(payload)
+    except Exception as e:
+        print(f"Error generating response: {e}")
+        pipeline.UPSTREAM_ERRORS.inc(upstream='deepseek', error=type(e).__name__)
+        return pipeline.ERROR_MESSAGE
+
+
+async def stream_response(user_query, context, history=None, language='en'):
+    """Yield response text chunks from a streaming DeepSeek completion"""
+    payload = pipeline.build_chat_payload(user_query, context, stream=True, history=history,
+                                          language=language)
+
+    try:
+        with stage('generate'):
+            async for token in llm_client.stream(payload):
+                yield token
+    except Exception as e:
+        print(f"Error streaming response: {e}")
+        pipeline.UPSTREAM_ERRORS.inc(upstream='deepseek', error=type(e).__name__)
+        yield pipeline.ERROR_MESSAGE
+
+
+@asynccontextmanager
+async def llm_slot(lane=INTERACTIVE):
+    """Hold an answer slot while retrieving and generating; raises Overloaded"""
+    if llm_gate is None:
+        yield
+        return
+    with stage('queue'):
+        await llm_gate.acquire(lane)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        llm_gate.release(time.monotonic() - start)
+
+
+async def answer_query(user_query, language, query_embedding, search_query=None, history=None):
+    """Retrieve, generate and (without history) cache the answer to a question"""
+    async with llm_slot():
+        similar_docs = await search_knowledge_base(search_query or user_query,
+                                                   pipeline.RETRIEVAL_TOP_K, query_embedding, language)
+        with stage('context'):
+            context, sources = pipeline.build_context(similar_docs)
+        ai_response = await generate_response(user_query, context, history, language)
+
+    result = {
+        "response": ai_response,
+        "sources": sources
+    }
+    cache = pipeline.response_cache
+    if cache is not None and not history and ai_response != pipeline.ERROR_MESSAGE:
+        cache.put(user_query, language, result, query_embedding)
+    return result
+
+
+async def answer_stream(user_query, language, query_embedding, search_query=None, history=None):
+    """Same events as app.answer_stream: ("admitted", None), ("token", text)..., ("done", sources)"""
+    tokens = []
+    async with llm_slot():
+        yield "admitted", None
+        similar_docs = await search_knowledge_base(search_query or user_query,
+                                                   pipeline.RETRIEVAL_TOP_K, query_embedding, language)
+        with stage('context'):
+            context, sources = pipeline.build_context(similar_docs)
+
+        async for token in stream_response(user_query, context, history, language):
+            tokens.append(token)
+            yield "token", token
+        yield "done", sources
+
+    ai_response = "".join(tokens)
+    cache = pipeline.response_cache
+    if cache is not None and not history and pipeline.ERROR_MESSAGE not in ai_response:
+        cache.put(user_query, language, {"response": ai_response, "sources": sources}, query_embedding)
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_start = time.perf_counter()
+    capture = pipeline.begin_capture(request.endpoint, request.headers)
+    begin_timings(capture.timings if capture is not None else None)
+
+
+@app.before_request
+async def admit_request():
+    """Per-client rate limit on the chat and voice endpoints"""
+    error = pipeline.check_rate_limit(request.endpoint, request.headers, request.remote_addr)
+    if error is not None:
+        body, status, headers = pipeline.rejection(error)
+        return jsonify(body), status, headers
+
+
+@app.after_request
+async def record_request(response):
+    """Request latency/status metrics and the optional Server-Timing header"""
+    endpoint = request.endpoint or 'unknown'
+    start = g.get('request_start')
+    if start is not None:
+        pipeline.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    pipeline.REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    timings = request_timings()
+    if pipeline.SERVER_TIMING and timings:
+        response.headers['Server-Timing'] = server_timing(timings)
+    capture = current_capture()
+    if capture is not None:
+        if capture.profiler is not None:
+            response.headers['X-Profile-Id'] = capture.id
+        if not capture.deferred:
+            pipeline.end_capture(capture, response.status_code)
+    return response
+
+
+@app.teardown_request
+async def release_capture(error=None):
+    """Finish a capture the response never reached, so a profile is not left running"""
+    capture = current_capture()
+    if capture is not None and not capture.deferred:
+        pipeline.end_capture(capture, 500)
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    return Response(pipeline.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    """Health check endpoint"""
+    body, status = pipeline.health_status()
+    return jsonify(body), status
+
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    """Main chat endpoint with RAG pipeline"""
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return await chat_stream()
+
+    try:
+        data = await request.get_json()
+        user_query = data.get('message', '').strip()
+
+        if not user_query:
+            return jsonify({"error": "Message is required"}), 400
+
+        session_id, history = pipeline.open_session(data, request.headers)
+        language = detect_language(user_query, data.get('language'))
+        related = pipeline.is_health_fitness_related(user_query, language)
+        if not related and not history:
+            return jsonify(pipeline.with_session({"response": pipeline.OFF_TOPIC_MESSAGE},
+                                                 session_id))
+        search_query = pipeline.search_query_for(user_query, related, history)
+
+        with stage('embed'):
+            query_embedding = get_embedding(search_query)
+
+        cache = pipeline.response_cache if not history else None
+        if cache is not None:
+            with stage('cache'):
+                cached = cache.get(user_query, language, query_embedding)
+            note(cache_hit=cached is not None)
+            if cached is not None:
+                pipeline.remember_turn(session_id, user_query, cached["response"])
+                return jsonify(pipeline.with_session(cached, session_id))
+
+        if flights is not None and not history:
+            # 'coalesce' is a follower's wait; the leader's retrieve/context/generate are timed as usual
+            result, shared = await flights.do(pipeline.coalesce_key(user_query, language),
+                                              lambda: answer_query(user_query, language, query_embedding),
+                                              wait=lambda: stage('coalesce'))
+            note(coalesced=shared)
+        else:
+            result = await answer_query(user_query, language, query_embedding, search_query, history)
+        pipeline.remember_turn(session_id, user_query, result["response"])
+
+        return jsonify(pipeline.with_session(result, session_id))
+
+    except Overloaded as e:
+        body, status, headers = pipeline.rejection(e)
+        return jsonify(body), status, headers
+    except TimeoutError:
+        return jsonify({"error": "Timed out waiting for the answer"}), 504
+    except Exception as e:
+        print(f"Error in chat endpoint: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/chat/stream', methods=['POST'])
+async def chat_stream():
+    """Streaming chat endpoint: forwards DeepSeek tokens as Server-Sent Events"""
+    try:
+        data = await request.get_json()
+        user_query = data.get('message', '').strip()
+
+        if not user_query:
+            return jsonify({"error": "Message is required"}), 400
+
+        session_id, history = pipeline.open_session(data, request.headers)
+        # Answers that depend on earlier turns bypass the response cache
+        cache = pipeline.response_cache if not history else None
+        cached = query_embedding = None
+        language = detect_language(user_query, data.get('language'))
+        related = pipeline.is_health_fitness_related(user_query, language)
+        if not related and not history:
+            cached = {"response": pipeline.OFF_TOPIC_MESSAGE, "sources": []}
+        else:
+            search_query = pipeline.search_query_for(user_query, related, history)
+            with stage('embed'):
+                query_embedding = get_embedding(search_query)
+            if cache is not None:
+                with stage('cache'):
+                    cached = cache.get(user_query, language, query_embedding)
+                note(cache_hit=cached is not None)
+                if cached is not None:
+                    pipeline.remember_turn(session_id, user_query, cached['response'])
+
+        if cached is None:
+            # Concurrent identical questions share one generated stream
+            if flights is not None and not history:
+                events = flights.stream(pipeline.coalesce_key(user_query, language),
+                                        lambda: answer_stream(user_query, language, query_embedding))
+            else:
+                events = answer_stream(user_query, language, query_embedding, search_query, history)
+            # Wait for an answer slot before the 200 goes out, so overload is still a 503
+            await events.__anext__()
+
+    except Overloaded as e:
+        body, status, headers = pipeline.rejection(e)
+        return jsonify(body), status, headers
+    except TimeoutError:
+        return jsonify({"error": "Timed out waiting for the answer"}), 504
+    except Exception as e:
+        print(f"Error in chat stream endpoint: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+    async def generate():
+        if cached is not None:
+            yield pipeline.sse_event({"token": cached['response']}, event="token")
+            yield pipeline.sse_event(pipeline.with_session({"sources": cached.get('sources', [])},
+                                                           session_id), event="done")
+            return
+
+        tokens = []
+        try:
+            async for kind, value in events:
+                if kind == "token":
+                    tokens.append(value)
+                    yield pipeline.sse_event({"token": value}, event="token")
+                elif kind == "done":
+                    yield pipeline.sse_event(pipeline.with_session({"sources": value}, session_id),
+                                             event="done")
+        except TimeoutError:
+            tokens.append(pipeline.ERROR_MESSAGE)
+            yield pipeline.sse_event({"token": pipeline.ERROR_MESSAGE}, event="token")
+            yield pipeline.sse_event(pipeline.with_session({"sources": []}, session_id), event="done")
+        pipeline.remember_turn(session_id, user_query, "".join(tokens))
+
+    capture = current_capture()
+    if capture is not None:
+        capture.deferred = True
+    body = generate() if capture is None else CapturedBody(generate(), capture)
+    return Response(body, mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
+@app.route('/chat/batch', methods=['POST'])
+async def chat_batch():
+    """Answer a list of messages in one request; results keep the input order"""
+    try:
+        data = await request.get_json()
+        messages = data.get('messages')
+
+        refused = pipeline.admit_batch(messages, request.headers, request.remote_addr)
+        if refused is not None:
+            body, status, headers = refused
+            return jsonify(body), status, headers
+
+        results, jobs = pipeline.prepare_batch(messages, data.get('language'))
+        if jobs:
+            pipeline.attach_context(jobs, await search_knowledge_base_many(
+                [job["query"] for job in jobs], [job["embedding"] for job in jobs],
+                pipeline.RETRIEVAL_TOP_K, [job["language"] for job in jobs]
+            ))
+
+            semaphore = asyncio.Semaphore(pipeline.BATCH_LLM_CONCURRENCY)
+
+            async def answer(job):
+                async with semaphore:
+                    try:
+                        payload = pipeline.build_chat_payload(job["query"], job["context"],
+                                                              language=job["language"])
+                        # Batch items queue behind interactive chats
+                        async with llm_slot(BATCH):
+                            with timer(pipeline.STAGE_SECONDS, stage='generate'):
+                                return await llm_client.complete(payload)
+                    except Overloaded as e:
+                        pipeline.REJECTED.inc(reason=e.reason)
+                        return None
+                    except Exception as e:
+                        print(f"Error generating batch response: {e}")
+                        pipeline.UPSTREAM_ERRORS.inc(upstream='deepseek', error=type(e).__name__)
+                        return None
+
+            with stage('generate_batch'):
+                answers = await asyncio.gather(*(answer(job) for job in jobs))
+            for job, ai_response in zip(jobs, answers):
+                pipeline.finish_batch_job(results, job, ai_response)
+
+        return jsonify({"results": results})
+
+    except Exception as e:
+        print(f"Error in chat batch endpoint: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/admin/reload', methods=['POST'])
+async def admin_reload():
+    """Reload the knowledge base and invalidate cached responses"""
+    if not pipeline.ADMIN_TOKEN or request.headers.get('X-Admin-Token') != pipeline.ADMIN_TOKEN:
+        return jsonify({"error": "Forbidden"}), 403
+
+    try:
+        # The rebuild (or the wait for the refresher thread) blocks, so it runs off the event loop
+        await asyncio.to_thread(pipeline.reload_knowledge_base)
+        return jsonify({"status": "reloaded", "knowledge_base": pipeline.knowledge_base.info()})
+    except Exception as e:
+        print(f"Error reloading knowledge base: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/voice', methods=['POST'])
+async def voice():
+    """Speech for a response: per-sentence audio URLs, or one WAV stream with Accept: audio/wav"""
+    try:
+        data = await request.get_json()
+        text = data.get('text', '')
+        if len(text) > pipeline.VOICE_MAX_CHARS:
+            return jsonify({"error": f"Text is limited to {pipeline.VOICE_MAX_CHARS} characters"}), 413
+
+        # Without a TTS engine the browser speaks the text itself
+        speech = pipeline.speech
+        if speech is None or not text.strip():
+            return jsonify({"text": text})
+
+        voice_name = data.get('voice')
+        if voice_name is not None and not valid_voice(voice_name):
+            return jsonify({"error": "Invalid voice"}), 400
+        language = speech_language(text, data.get('language'))
+        chunks = speech.chunks(text, language, voice_name)
+
+        if request.accept_mimetypes.best == 'audio/wav':
+            # Synthesis runs on the TTS worker threads; each sentence is sent once it is ready
+            return Response(speech.astream(chunks), mimetype='audio/wav',
+                            headers={"Cache-Control": "no-cache"})
+
+        speech.prefetch(chunks)
+        return jsonify({
+            "text": text,
+            "language": language,
+            "chunks": [{"text": sentence, "url": f"/voice/audio/{key}.wav"}
+                       for sentence, key, _ in chunks]
+        })
+
+    except Overloaded as e:
+        body, status, headers = pipeline.rejection(e)
+        return jsonify(body), status, headers
+    except Exception as e:
+        print(f"Error in voice endpoint: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/voice/audio/<key>.wav', methods=['GET'])
+async def voice_audio(key):
+    """Audio for one sentence; cache files never change, so they are served with range support"""
+    speech = pipeline.speech
+    if speech is None or not valid_key(key):
+        return jsonify({"error": "Not found"}), 404
+    try:
+        with stage('tts'):
+            path = await asyncio.to_thread(speech.audio_path, key)
+    except Exception as e:
+        print(f"Error synthesizing speech: {e}")
+        return jsonify({"error": "Speech synthesis failed"}), 502
+    if path is None:
+        return jsonify({"error": "Not found"}), 404
+    response = await send_file(path, mimetype='audio/wav', conditional=True, cache_timeout=31536000)
+    response.set_etag(key)
+    return response
@@ -0,0 +1,123 @@
+"""
+Cold-start benchmark for the Flask app
+Starts a fresh interpreter per run (as a serverless cold start does) and
+measures how long `import app` takes and how long the first /chat request
+takes after it, against local stand-ins for DeepSeek and Supabase, for
+each knowledge-base loading mode
+
+Usage:
+    python build_snapshot.py && python bench_cold_start.py --runs 5
+    python bench_cold_start.py --importtime     # slowest imports of app.py
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from mock_deepseek import start_mock_server
+from mock_supabase import start_mock_supabase
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Environment overrides per scenario
+SCENARIOS = {
+    'supabase': {'RETRIEVAL_BACKEND': 'supabase'},
+    'local-json': {'RETRIEVAL_BACKEND': 'local', 'LOCAL_INDEX_SOURCE': 'json'},
+    'local-snapshot': {'RETRIEVAL_BACKEND': 'local', 'LOCAL_INDEX_SOURCE': 'snapshot'},
+}
+
+# Runs inside the fresh interpreter; prints one JSON line of timings
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().post('/chat', json={'message': %r})
+done = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({'import': imported - start, 'first_request': done - imported}))
+"""
+
+QUESTION = "How much water should I drink every day?"
+
+
+def run_once(env):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', PROBE % QUESTION], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - start
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings['process'] = total
+    return timings
+
+
+def slowest_imports(env, limit=10):
+    """(cumulative seconds, module) for the top-level imports of app.py"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=BACKEND_DIR,
+                            env=env, capture_output=True, text=True, check=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        fields = line.split('|')
+        if not line.startswith('import time:') or len(fields) != 3 or 'cumulative' in line:
+            continue
+        # Nesting is shown by indentation: ' app', then '   flask' for its direct imports
+        name = fields[2]
+        if name.startswith('   ') and not name.startswith('     '):
+            imports.append((int(fields[1]) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and first-request latency of app.py")
+    parser.add_argument('--runs', type=int, default=5, help="fresh processes per scenario")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--importtime', action='store_true', help="also list the slowest imports")
+    parser.add_argument('--output', help="write results to this JSON file")
+    args = parser.parse_args()
+
+    llm = start_mock_server()
+    db = start_mock_supabase()
+    base_env = dict(os.environ,
+                    DEEPSEEK_CHAT_URL=f"http://127.0.0.1:{llm.server_address[1]}/v1/chat/completions",
+                    DEEPSEEK_API_KEY='cold-start',
+                    SUPABASE_URL=f"http://127.0.0.1:{db.server_address[1]}",
+                    SUPABASE_KEY='cold.start.placeholder',
+                    RESPONSE_CACHE_ENABLED='false')
+
+    print("=" * 60)
+    print(f"🧊 Cold start: {args.runs} fresh processes per scenario (medians)")
+    print("=" * 60)
+
+    results = {}
+    snapshot = os.getenv('INDEX_SNAPSHOT_PATH', os.path.join(BACKEND_DIR, 'index_snapshot'))
+    for name in args.scenarios.split(','):
+        if SCENARIOS[name].get('LOCAL_INDEX_SOURCE') == 'snapshot' and not os.path.isdir(snapshot):
+            print(f"{name:>15}: skipped, run build_snapshot.py first")
+            continue
+        env = dict(base_env, **SCENARIOS[name])
+        runs = [run_once(env) for _ in range(args.runs)]
+        results[name] = {key: round(statistics.median(run[key] for run in runs) * 1000, 1)
+                         for key in ('import', 'first_request', 'process')}
+        print(f"{name:>15}: import {results[name]['import']:7.1f} ms   "
+              f"first request {results[name]['first_request']:7.1f} ms   "
+              f"process total {results[name]['process']:7.1f} ms")
+
+        if args.importtime:
+            for seconds, module in slowest_imports(env):
+                print(f"{'':>17}{seconds * 1000:7.1f} ms  {module}")
+
+    llm.shutdown()
+    db.shutdown()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Microbenchmark for the embedding engine
+Compares the original per-element get_embedding loop with the NumPy engine
+in embeddings.py (single query, cached query and batched records)
+"""
+
+import hashlib
+import struct
+import sys
+import timeit
+
+import numpy as np
+
+from embeddings import EMBEDDING_DIM, embed_many, get_embedding
+
+SAMPLE_QUERY = "How much water should I drink every day?"
+BATCH_SIZE = 1000
+
+
+def legacy_get_embedding(text):
+    """Original list-of-floats implementation, kept here as the baseline"""
+    hash_obj = hashlib.sha256(text.encode())
+    hash_bytes = hash_obj.digest()
+
+    embedding = []
+    for i in range(EMBEDDING_DIM):
+        byte_idx = i % len(hash_bytes)
+        value = struct.unpack('B', bytes([hash_bytes[byte_idx]]))[0] / 255.0
+        value = (value + (i / EMBEDDING_DIM)) / 2.0
+        embedding.append(value)
+
+    return embedding
+
+
+def time_per_call(func, number):
+    """Best-of-5 average seconds per call"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main():
+    """Run the benchmark and print per-query latency before and after"""
+    print("=" * 60)
+    print("⏱️  Embedding Engine Microbenchmark")
+    print("=" * 60)
+
+    # Sanity check: the vectorized engine must match the original values
+    expected = np.array(legacy_get_embedding(SAMPLE_QUERY), dtype=np.float32)
+    assert np.array_equal(embed_many([SAMPLE_QUERY])[0], expected)
+
+    texts = [f"{SAMPLE_QUERY} #{i}" for i in range(BATCH_SIZE)]
+
+    legacy = time_per_call(lambda: legacy_get_embedding(SAMPLE_QUERY), 200)
+    vectorized = time_per_call(lambda: embed_many([SAMPLE_QUERY]), 2000)
+    cached = time_per_call(lambda: get_embedding(SAMPLE_QUERY), 20000)
+    legacy_batch = time_per_call(lambda: [legacy_get_embedding(t) for t in texts], 1)
+    batched = time_per_call(lambda: embed_many(texts), 5)
+
+    print(f"Per-query latency (legacy loop):     {legacy * 1e6:10.1f} µs")
+    print(f"Per-query latency (NumPy):           {vectorized * 1e6:10.1f} µs"
+          f"  ({legacy / vectorized:.0f}x faster)")
+    print(f"Per-query latency (cached):          {cached * 1e6:10.1f} µs"
+          f"  ({legacy / cached:.0f}x faster)")
+    print(f"{BATCH_SIZE} records (legacy loop):         {legacy_batch * 1e3:10.1f} ms")
+    print(f"{BATCH_SIZE} records (embed_many):          {batched * 1e3:10.1f} ms"
+          f"  ({legacy_batch / batched:.0f}x faster)")
+
+    legacy_vector = legacy_get_embedding(SAMPLE_QUERY)
+    legacy_bytes = sys.getsizeof(legacy_vector) + sum(sys.getsizeof(v) for v in legacy_vector)
+    print(f"Memory per vector: {legacy_bytes // 1024} KB of Python floats"
+          f" -> {EMBEDDING_DIM * 4 // 1024} KB float32")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark for the topic gate
+Runs the original keyword scan and the compiled TopicGate over a labelled
+English / Hindi / Marathi query corpus and reports accuracy, false
+positives/negatives and per-query latency
+
+What the compiled gate gains is accuracy (whole-word matches, inflected
+Devanagari forms); per query it costs about the same as the substring
+scan, and the latency columns are there to show it is no slower
+"""
+
+import timeit
+
+from topic_gate import TopicGate
+
+# (query, is health/fitness related)
+CORPUS = [
+    # English
+    ("How much water should I drink every day?", True),
+    ("What is a good beginner workout?", True),
+    ("Best workouts for building core strength", True),
+    ("How many calories does running burn?", True),
+    ("Can you suggest stretches for lower back pain?", True),
+    ("How do I recover from a sports injury?", True),
+    ("Is yoga good for stress?", True),
+    ("What's the final score of yesterday's match?", False),
+    ("Recommend a good movie for tonight", False),
+    ("How do I reset my router password?", False),
+    ("What is the capital of France?", False),
+    ("Explain the foreword of this book", False),
+    ("Write a poem about the ocean", False),
+    ("How do I improve my credit score?", False),
+    # Hindi
+    ("मुझे रोज कितना पानी पीना चाहिए?", True),
+    ("वज़न कम करने के लिए क्या खाएं?", True),
+    ("व्यायाम के क्या फायदे हैं?", True),
+    ("अच्छी नींद के लिए क्या करें?", True),
+    ("तनाव कैसे कम करें?", True),
+    ("मांसपेशियों को मजबूत कैसे बनाएं?", True),
+    ("यह मेरी जिम्मेदारी है", False),
+    ("आज मौसम कैसा है?", False),
+    ("भारत की राजधानी क्या है?", False),
+    ("मुझे एक कहानी सुनाओ", False),
+    # Marathi
+    ("व्यायामाने काय फायदे होतात?", True),
+    ("दररोज किती पाणी प्यावे?", True),
+    ("पाण्याची किती गरज आहे?", True),
+    ("चांगली झोप कशी घ्यावी?", True),
+    ("ताण कमी करण्यासाठी काय करावे?", True),
+    ("स्नायूंची ताकद कशी वाढवावी?", True),
+    ("आज हवामान कसे आहे?", False),
+    ("महाराष्ट्राची राजधानी कोणती?", False),
+    ("मला एक गोष्ट सांगा", False),
+]
+
+
+def legacy_is_health_fitness_related(query):
+    """Original implementation: keyword list rebuilt per call, substring scan"""
+    health_keywords = [
+        'health', 'fitness', 'exercise', 'workout', 'nutrition', 'diet',
+        'weight', 'muscle', 'cardio', 'strength', 'yoga', 'meditation',
+        'sleep', 'stress', 'wellness', 'food', 'protein', 'vitamin',
+        'hydration', 'water', 'calories', 'training', 'running', 'gym',
+        'mental', 'physical', 'body', 'energy', 'recovery', 'injury',
+        'posture', 'flexibility', 'stretching', 'core', 'balance',
+        'स्वास्थ्य', 'फिटनेस', 'व्यायाम', 'कसरत', 'पोषण', 'आहार',
+        'वजन', 'मांसपेशी', 'योग', 'ध्यान', 'नींद', 'तनाव',
+        'भोजन', 'प्रोटीन', 'विटामिन', 'पानी', 'कैलोरी', 'प्रशिक्षण',
+        'दौड़', 'जिम', 'मानसिक', 'शारीरिक', 'शरीर', 'ऊर्जा',
+        'आरोग्य', 'तंदुरुस्ती', 'व्यायाम', 'कसरत', 'पोषण', 'आहार',
+        'वजन', 'स्नायू', 'योग', 'ध्यान', 'झोप', 'ताण',
+        'अन्न', 'प्रथिने', 'जीवनसत्त्व', 'पाणी', 'कॅलरी', 'प्रशिक्षण',
+        'धावणे', 'जिम', 'मानसिक', 'शारीरिक', 'शरीर', 'ऊर्जा'
+    ]
+    query_lower = query.lower()
+    return any(keyword in query_lower for keyword in health_keywords)
+
+
+def evaluate(name, classify):
+    """Print accuracy and the misclassified queries for one gate"""
+    false_positives = [q for q, label in CORPUS if classify(q) and not label]
+    false_negatives = [q for q, label in CORPUS if not classify(q) and label]
+    correct = len(CORPUS) - len(false_positives) - len(false_negatives)
+
+    seconds = min(timeit.repeat(lambda: [classify(q) for q, _ in CORPUS],
+                                number=200, repeat=5)) / (200 * len(CORPUS))
+
+    print(f"{name}: accuracy {correct}/{len(CORPUS)}, {seconds * 1e6:.1f} µs/query")
+    for query in false_positives:
+        print(f"    false positive: {query}")
+    for query in false_negatives:
+        print(f"    false negative: {query}")
+    return seconds
+
+
+def main():
+    """Compare the legacy scan with the compiled gate (accuracy first, then relative cost)"""
+    print("=" * 60)
+    print("⏱️  Topic Gate Benchmark")
+    print("=" * 60)
+
+    gate = TopicGate()
+    legacy = evaluate("Legacy substring scan", legacy_is_health_fitness_related)
+    compiled = evaluate("Compiled TopicGate   ", lambda q: gate.classify(q).related)
+    print(f"Compiled gate cost: {compiled / legacy:.2f}x the legacy scan per query")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
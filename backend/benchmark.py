@@ -0,0 +1,247 @@
+"""
+End-to-end benchmark for the RAG pipeline
+Starts the Flask app (gunicorn, as in production) against local stand-ins
+for DeepSeek (mock_deepseek.py) and Supabase RPC (mock_supabase.py) with
+configurable latency and failure injection, drives /chat at fixed
+concurrency levels and reports requests/sec, latency percentiles, error
+rates and a per-stage breakdown taken from the Server-Timing header
+
+Results are written as JSON; pass a previous file to --compare to see
+whether a change made the pipeline faster or slower
+
+Usage:
+    python benchmark.py --levels 1,8,32 --requests 300 --output bench.json
+    python benchmark.py --output after.json --compare bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
+
+from llm_client import AsyncClientPool
+from load_test import BACKEND_DIR, QUESTIONS, wait_until_healthy
+from mock_deepseek import start_mock_server
+from mock_supabase import start_mock_supabase
+
+PERCENTILES = (50, 90, 95, 99)
+
+# app.ERROR_MESSAGE: /chat answers 200 with this text when DeepSeek fails
+# (importing app here would initialise its clients and indexes)
+LLM_FALLBACK = "I apologize, but I'm having trouble generating a response right now."
+
+
+def parse_server_timing(header):
+    """{stage: seconds} from a Server-Timing header value"""
+    timings = {}
+    for entry in filter(None, (part.strip() for part in (header or '').split(','))):
+        name, _, params = entry.partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                timings[name] = float(value) / 1000
+    return timings
+
+
+def summarize(values):
+    """Percentiles, mean and max in milliseconds"""
+    if not values:
+        return None
+    values = np.asarray(values) * 1000
+    summary = {f'p{p}': round(float(v), 3) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+    summary['mean'] = round(float(values.mean()), 3)
+    summary['max'] = round(float(values.max()), 3)
+    return summary
+
+
+async def drive(url, concurrency, total, offset=0):
+    """Send `total` /chat requests with `concurrency` in flight
+
+    Returns (latencies, error kinds, per-stage timings)
+    """
+    latencies = []
+    errors = Counter()
+    stages = defaultdict(list)
+    counter = iter(range(offset, offset + total))
+
+    pool = AsyncClientPool(min(concurrency, 50), base_url=url, timeout=120.0)
+    try:
+        async def worker():
+            client = pool.next_client()
+            for i in counter:
+                # A unique suffix keeps the response cache out of the picture
+                message = f"{QUESTIONS[i % len(QUESTIONS)]} ({i})"
+                start = time.perf_counter()
+                try:
+                    response = await client.post('/chat', json={'message': message})
+                except httpx.HTTPError as e:
+                    errors[type(e).__name__] += 1
+                    latencies.append(time.perf_counter() - start)
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+                if response.status_code != 200:
+                    errors[f'http_{response.status_code}'] += 1
+                elif response.json().get('response', '').startswith(LLM_FALLBACK):
+                    errors['llm_fallback'] += 1
+                for name, seconds in parse_server_timing(response.headers.get('Server-Timing')).items():
+                    stages[name].append(seconds)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        await pool.aclose()
+
+    return latencies, errors, stages
+
+
+def run_level(url, concurrency, total, offset, upstreams):
+    before = {name: server.request_count for name, server in upstreams.items()}
+    start = time.perf_counter()
+    latencies, errors, stages = asyncio.run(drive(url, concurrency, total, offset))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 2),
+        'latency_ms': summarize(latencies),
+        'error_rate': round(sum(errors.values()) / max(len(latencies), 1), 4),
+        'errors': dict(errors),
+        'stages_ms': {name: summarize(values) for name, values in stages.items()},
+        # Upstream calls per request (retries and cache hits move these)
+        'upstream_calls': {name: round((server.request_count - before[name]) / max(len(latencies), 1), 3)
+                           for name, server in upstreams.items()}
+    }
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_file):
+    """Print rps and latency changes against an earlier result file"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {level['concurrency']: level for level in baseline['levels']}
+
+    print(f"\nCompared with {baseline_file} ({baseline.get('revision') or 'unknown revision'}):")
+    for level in results['levels']:
+        old = previous.get(level['concurrency'])
+        if old is None or not old['latency_ms'] or not level['latency_ms']:
+            print(f"  c={level['concurrency']:<4} not in the baseline")
+            continue
+        rps_change = (level['rps'] - old['rps']) / old['rps'] * 100
+        p95_change = ((level['latency_ms']['p95'] - old['latency_ms']['p95'])
+                      / old['latency_ms']['p95'] * 100)
+        print(f"  c={level['concurrency']:<4} rps {old['rps']:8.1f} -> {level['rps']:8.1f} "
+              f"({rps_change:+.1f}%)   p95 {old['latency_ms']['p95']:8.1f} -> "
+              f"{level['latency_ms']['p95']:8.1f} ms ({p95_change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end /chat benchmark with local stand-ins")
+    parser.add_argument('--levels', default='1,8,32', help="comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=200, help="requests per level")
+    parser.add_argument('--warmup', type=int, default=20, help="requests sent before measuring")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument('--threads', type=int, default=16, help="threads per gunicorn worker")
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="stand-in LLM seconds per call")
+    parser.add_argument('--llm-fail-rate', type=float, default=0.0)
+    parser.add_argument('--db-latency', type=float, default=0.01, help="stand-in RPC seconds per call")
+    parser.add_argument('--db-fail-rate', type=float, default=0.0)
+    parser.add_argument('--retrieval', choices=['supabase', 'local'], default='supabase',
+                        help="RETRIEVAL_BACKEND for the app")
+    parser.add_argument('--cache', action='store_true', help="leave the response cache enabled")
+    parser.add_argument('--seed', type=int, default=0, help="failure injection seed")
+    parser.add_argument('--port', type=int, default=5200)
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="earlier JSON result to compare against")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(',')]
+
+    random.seed(args.seed)
+
+    llm = start_mock_server(latency=args.llm_latency, fail_rate=args.llm_fail_rate)
+    db = start_mock_supabase(latency=args.db_latency, fail_rate=args.db_fail_rate)
+    upstreams = {'deepseek': llm, 'supabase': db}
+
+    env = dict(os.environ,
+               DEEPSEEK_CHAT_URL=f"http://127.0.0.1:{llm.server_address[1]}/v1/chat/completions",
+               DEEPSEEK_API_KEY='benchmark',
+               SUPABASE_URL=f"http://127.0.0.1:{db.server_address[1]}",
+               SUPABASE_KEY='benchmark.key.placeholder',
+               RETRIEVAL_BACKEND=args.retrieval,
+               RESPONSE_CACHE_ENABLED='true' if args.cache else 'false',
+               SERVER_TIMING='true')
+    # Every request comes from one client; measure the server, not the rate limit
+    env.setdefault('RATE_LIMIT_PER_MINUTE', '0')
+    command = [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '--threads', str(args.threads),
+               '-b', f'127.0.0.1:{args.port}', '--log-level', 'warning', 'app:app']
+
+    print("=" * 60)
+    print(f"📊 Benchmark: levels {levels}, {args.requests} requests each, "
+          f"LLM {args.llm_latency}s, RPC {args.db_latency}s")
+    print("=" * 60)
+
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+    try:
+        url = f"http://127.0.0.1:{args.port}"
+        wait_until_healthy(url)
+        if args.warmup:
+            asyncio.run(drive(url, min(levels), args.warmup, offset=10 ** 6))
+
+        results = {
+            'revision': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'compare', 'port')},
+            'levels': []
+        }
+        offset = 0
+        for concurrency in levels:
+            level = run_level(url, concurrency, args.requests, offset, upstreams)
+            offset += args.requests
+            results['levels'].append(level)
+
+            latency = level['latency_ms'] or {}
+            print(f"c={concurrency:<4} {level['rps']:8.1f} req/s   p50 {latency.get('p50', 0):8.1f} ms   "
+                  f"p95 {latency.get('p95', 0):8.1f} ms   p99 {latency.get('p99', 0):8.1f} ms   "
+                  f"errors {level['error_rate']:.1%}")
+            stages = '   '.join(f"{name} {summary['p50']:.2f}"
+                               for name, summary in level['stages_ms'].items())
+            print(f"       stage p50 (ms): {stages}")
+    finally:
+        server.terminate()
+        server.wait()
+        llm.shutdown()
+        db.shutdown()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
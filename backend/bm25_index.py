@@ -0,0 +1,222 @@
+"""
+In-memory BM25 index over knowledge-base passages
+Tokenizes English, Hindi and Marathi text, keeps one postings array per
+term with the BM25 weight precomputed, and fuses lexical and vector
+rankings with reciprocal rank fusion
+
+The postings can be saved next to a vector index snapshot and reopened
+memory-mapped, which skips tokenizing the whole knowledge base at startup
+"""
+
+import json
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from language import Partitions, language_codes
+from vector_index import (SNAPSHOT_LANGUAGES, open_snapshot, publish_manifest, read_manifest,
+                          snapshot_file, write_snapshot_file)
+
+SNAPSHOT_TERMS = 'bm25_terms.json'
+SNAPSHOT_DOCS = 'bm25_docs.npy'
+SNAPSHOT_WEIGHTS = 'bm25_weights.npy'
+# Bumped whenever tokenize() changes, so postings built by an older one are rebuilt
+TOKENIZER_VERSION = 2
+
+# Devanagari vowel signs and viramas are not \w, so include the whole block
+_TOKEN = re.compile(r'[\w\u0900-\u097f]+')
+
+STOPWORDS = {
+    # English
+    'a', 'an', 'and', 'are', 'can', 'do', 'does', 'for', 'how', 'i', 'in', 'is',
+    'it', 'me', 'my', 'of', 'on', 'or', 'should', 'the', 'to', 'what', 'when',
+    'which', 'why', 'with', 'you', 'your',
+    # Hindi
+    'और', 'का', 'कि', 'की', 'के', 'को', 'क्या', 'है', 'हैं', 'में', 'मुझे', 'से', 'पर', 'कैसे', 'कितना',
+    # Marathi
+    'आहे', 'आणि', 'काय', 'कसे', 'किती', 'मला', 'हे', 'ते', 'च्या'
+}
+
+# Light suffix stripping, longest first; enough to conflate plurals and the
+# case endings Hindi and Marathi attach to nouns (पाण्याची, पाण्याला -> पाण्य).
+# "es" is a suffix only after a sibilant (stretches, not muscles)
+_LATIN_SUFFIXES = ('ing', 'ed', 's')
+_SIBILANT_PLURALS = ('ches', 'shes', 'xes', 'zes')
+_DEVANAGARI_SUFFIXES = sorted([
+    'ासाठी', 'साठी', 'ामुळे', 'मुळे', 'ाच्या', 'च्या', 'ाचा', 'ाची', 'ाचे', 'ाने', 'ाला', 'ात',
+    'चा', 'ची', 'चे', 'ने', 'ला', 'ों', 'ें', 'ाएं', 'ियों', 'ियां'
+], key=len, reverse=True)
+
+
+def _stem(token):
+    if '\u0900' <= token[0] <= '\u097f':
+        for suffix in _DEVANAGARI_SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= 2:
+                return token[:-len(suffix)]
+        return token
+    if token.endswith(_SIBILANT_PLURALS) and len(token) >= 5:
+        return token[:-2]
+    for suffix in _LATIN_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    """NFC-normalized, casefolded, stemmed tokens without stopwords"""
+    text = unicodedata.normalize('NFC', text).casefold()
+    return [_stem(token) for token in _TOKEN.findall(text) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """BM25 over passage rows (dicts with title and content)
+
+    Title tokens are counted title_weight times so a match in the title
+    outranks one buried in a long passage. languages: language code per
+    passage (language.language_codes), detected when not given
+    """
+
+    def __init__(self, passages, k1=1.5, b=0.75, title_weight=2, languages=None):
+        self.passages = list(passages)
+        self.partitions = Partitions(languages if languages is not None
+                                     else language_codes(self.passages))
+
+        term_freqs = []
+        lengths = np.zeros(len(self.passages), dtype=np.float32)
+        for i, passage in enumerate(self.passages):
+            counts = Counter(tokenize(passage.get('content', '')))
+            for token in tokenize(passage.get('title', '')):
+                counts[token] += title_weight
+            term_freqs.append(counts)
+            lengths[i] = sum(counts.values())
+
+        average_length = float(lengths.mean()) if len(self.passages) else 0.0
+        postings = defaultdict(list)
+        for i, counts in enumerate(term_freqs):
+            for token, tf in counts.items():
+                postings[token].append((i, tf))
+
+        # term -> (passage indexes, precomputed idf * saturated tf)
+        n = len(self.passages)
+        self.postings = {}
+        for token, entries in postings.items():
+            docs = np.array([i for i, _ in entries], dtype=np.int32)
+            tf = np.array([tf for _, tf in entries], dtype=np.float32)
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = k1 * (1 - b + b * lengths[docs] / (average_length or 1.0))
+            self.postings[token] = (docs, (idf * tf * (k1 + 1) / (tf + norm)).astype(np.float32))
+
+    def __len__(self):
+        return len(self.passages)
+
+    @classmethod
+    def from_snapshot(cls, path, passages):
+        """Open postings written by save_snapshot() next to the snapshot's passages
+
+        passages (e.g. VectorIndex.passages() of the same snapshot) is kept as
+        given, so a memory-mapped PassageTable stays unparsed
+        """
+        return open_snapshot(path, lambda manifest: cls._open_snapshot(path, manifest, passages))
+
+    @classmethod
+    def _open_snapshot(cls, path, manifest, passages):
+        with open(snapshot_file(path, manifest, SNAPSHOT_TERMS), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        # A PassageTable knows its snapshot, which may predate the manifest just read
+        version = getattr(passages, 'version', None) or manifest.get('kb_version')
+        if meta['passages'] != len(passages) or meta.get('kb_version') != version:
+            raise ValueError("BM25 snapshot was built for a different set of passages")
+        if meta.get('tokenizer', 1) != TOKENIZER_VERSION:
+            raise ValueError("BM25 snapshot was built by another tokenizer version")
+        docs = np.load(snapshot_file(path, manifest, SNAPSHOT_DOCS), mmap_mode='r')
+        weights = np.load(snapshot_file(path, manifest, SNAPSHOT_WEIGHTS), mmap_mode='r')
+
+        index = cls.__new__(cls)
+        index.passages = passages
+        index.partitions = Partitions(np.load(snapshot_file(path, manifest, SNAPSHOT_LANGUAGES),
+                                              mmap_mode='r'))
+        # Each term's postings are a view into the mapped arrays
+        offsets = meta['offsets']
+        index.postings = {
+            term: (docs[offsets[i]:offsets[i + 1]], weights[offsets[i]:offsets[i + 1]])
+            for i, term in enumerate(meta['terms'])
+        }
+        return index
+
+    def save_snapshot(self, path):
+        """Write the postings as two flat arrays plus a term -> offset table
+
+        Call after the vector snapshot in the same directory: the postings
+        are tagged with its content version and published by adding them to
+        its manifest
+        """
+        manifest = read_manifest(path)
+        terms = list(self.postings)
+        offsets = np.cumsum([0] + [len(self.postings[term][0]) for term in terms]).tolist()
+        empty = (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32))
+        docs, weights = (np.concatenate([self.postings[term][i] for term in terms] or [empty[i]])
+                         for i in (0, 1))
+        files = {
+            SNAPSHOT_DOCS: write_snapshot_file(path, SNAPSHOT_DOCS, lambda f: np.save(f, docs)),
+            SNAPSHOT_WEIGHTS: write_snapshot_file(path, SNAPSHOT_WEIGHTS, lambda f: np.save(f, weights)),
+            SNAPSHOT_TERMS: write_snapshot_file(path, SNAPSHOT_TERMS, lambda f: f.write(json.dumps(
+                {'passages': len(self.passages), 'kb_version': manifest['kb_version'],
+                 'tokenizer': TOKENIZER_VERSION, 'terms': terms, 'offsets': offsets},
+                ensure_ascii=False).encode()))
+        }
+        publish_manifest(path, dict(manifest, files=dict(manifest['files'], **files)))
+
+    def search(self, query, match_count=3, language=None):
+        """Return up to match_count passages with a positive BM25 score, best first
+
+        With a language, only passages in that language's partition are ranked
+        """
+        scores = np.zeros(len(self.passages), dtype=np.float32)
+        matched = False
+        for token in tokenize(query):
+            entry = self.postings.get(token)
+            if entry is not None:
+                scores[entry[0]] += entry[1]
+                matched = True
+        if not matched or match_count <= 0:
+            return []
+
+        rows = self.partitions.rows(language)
+        if rows is not None:
+            scores = scores[rows]
+        k = min(match_count, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = top[scores[top] > 0]
+        return [dict(self.passages[i if rows is None else int(rows[i])], bm25=float(scores[i]))
+                for i in top]
+
+
+def passage_key(doc):
+    """Identity of a passage across sources whose row ids may differ"""
+    return (doc['title'], doc.get('chunk_index') or 0)
+
+
+def reciprocal_rank_fusion(rankings, top_k=3, k=60, weights=None):
+    """Fuse ranked lists of passages: score = sum of weight / (k + rank)
+
+    RRF only uses ranks, so BM25 and cosine scores need no calibration.
+    The fused score is returned as 'score'; the first list a passage
+    appears in provides its other fields
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc in enumerate(ranking, 1):
+            key = passage_key(doc)
+            if key not in fused:
+                fused[key] = dict(doc, score=0.0)
+            else:
+                fused[key].update((field, value) for field, value in doc.items()
+                                  if field not in fused[key])
+            fused[key]['score'] += weight / (k + rank)
+
+    return sorted(fused.values(), key=lambda doc: -doc['score'])[:top_k]
@@ -0,0 +1,53 @@
+"""
+Build the knowledge-base index snapshot loaded with LOCAL_INDEX_SOURCE=snapshot
+Chunks, embeds and BM25-indexes the knowledge base once, ahead of
+deployment, so a cold start only memory-maps the result instead of
+re-embedding and re-tokenizing every passage
+
+Usage:
+    python build_snapshot.py                      # from health_data.json
+    python build_snapshot.py --dtype int8         # quantized, 4x smaller vectors
+    python build_snapshot.py --source supabase    # from the fitness_knowledge table
+"""
+
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from bm25_index import BM25Index
+from data_loader import iter_records, write_snapshot
+from vector_index import SNAPSHOT_DTYPES, VectorIndex
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the memory-mapped index snapshot")
+    parser.add_argument('--source', choices=['json', 'supabase'], default='json')
+    parser.add_argument('--file', default=os.path.join(BACKEND_DIR, 'health_data.json'),
+                        help="knowledge base JSON/JSONL file (with --source json)")
+    parser.add_argument('--output', default=os.getenv('INDEX_SNAPSHOT_PATH',
+                                                      os.path.join(BACKEND_DIR, 'index_snapshot')))
+    parser.add_argument('--dtype', choices=SNAPSHOT_DTYPES, default='float32')
+    args = parser.parse_args()
+
+    if args.source == 'json':
+        # Streams the file, so memory stays bounded for large knowledge bases
+        write_snapshot(iter_records(args.file), args.output, args.dtype)
+        return
+
+    start = time.perf_counter()
+    load_dotenv()
+    from supabase import create_client
+    client = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'))
+    # Table ids are kept, so results match the match_fitness_knowledge RPC
+    VectorIndex.from_supabase(client).save_snapshot(args.output, args.dtype)
+    index = VectorIndex.from_snapshot(args.output)
+    BM25Index(index.passages()).save_snapshot(args.output)
+    print(f"✅ Wrote {len(index)} passages to {args.output} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Passage chunking and context assembly for the RAG pipeline
+At ingestion time long documents are split into sentence-aligned passages
+with overlap; at query time adjacent passage hits are merged back together
+and the assembled context is trimmed to a fixed token budget
+"""
+
+import hashlib
+import os
+import re
+
+# Passage size and overlap in estimated tokens; read here so the data loader
+# and the local index always split documents the same way
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '200'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '40'))
+
+# Sentence ends: . ! ? and the Devanagari danda, followed by whitespace
+_SENTENCE_END = re.compile(r'(?<=[.!?।॥])\s+')
+_DEVANAGARI = re.compile(r'[ऀ-ॿ]')
+
+
+def estimate_tokens(text):
+    """Rough token count: ~4 characters per token, ~2 for Devanagari"""
+    devanagari = len(_DEVANAGARI.findall(text))
+    return max(1, (len(text) - devanagari) // 4 + devanagari // 2) if text else 0
+
+
+def split_sentences(text):
+    """Split text into sentences, keeping their punctuation"""
+    return [s for s in _SENTENCE_END.split(text.strip()) if s]
+
+
+def _split_long_sentence(sentence, max_tokens):
+    """Break a sentence longer than max_tokens on word boundaries"""
+    pieces, current = [], []
+    for word in sentence.split():
+        if current and estimate_tokens(' '.join(current + [word])) > max_tokens:
+            pieces.append(' '.join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(' '.join(current))
+    return pieces
+
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Pack sentences into passages of at most max_tokens
+
+    Each passage after the first starts with the trailing sentences of the
+    previous one (up to overlap_tokens) so context is not cut mid-thought
+    """
+    sentences = []
+    for sentence in split_sentences(text):
+        if estimate_tokens(sentence) > max_tokens:
+            sentences.extend(_split_long_sentence(sentence, max_tokens))
+        else:
+            sentences.append(sentence)
+
+    chunks = []
+    current = []
+    for sentence in sentences:
+        if current and estimate_tokens(' '.join(current + [sentence])) > max_tokens:
+            chunks.append(' '.join(current))
+
+            # Carry the tail of this passage into the next one
+            overlap = []
+            for previous in reversed(current):
+                if estimate_tokens(' '.join([previous] + overlap + [sentence])) > max_tokens \
+                        or estimate_tokens(' '.join([previous] + overlap)) > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+            current = overlap
+        current.append(sentence)
+
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+def parent_id_for(record):
+    """Stable document id shared by all passages of one source record
+
+    Derived from the record's own id when it has one, else from its title and
+    content: two records sharing a title must not merge into one document
+    """
+    if record.get('id') is not None:
+        key = f"id:{record['id']}"
+    else:
+        key = f"{record.get('title', '')}\0{record.get('content', '')}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def chunk_record(record, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split a title/content record into passage records"""
+    title = record.get('title', '')
+    passages = chunk_text(record.get('content', ''), max_tokens, overlap_tokens) or ['']
+    parent_id = parent_id_for(record)
+    return [
+        {'title': title, 'content': passage, 'parent_id': parent_id, 'chunk_index': idx}
+        for idx, passage in enumerate(passages)
+    ]
+
+
+def _merge_passages(first, second):
+    """Join two adjacent passages, dropping the sentences they overlap on"""
+    sentences = split_sentences(second)
+    for count in range(len(sentences) - 1, 0, -1):
+        prefix = ' '.join(sentences[:count])
+        if first.endswith(prefix):
+            return first + ' ' + ' '.join(sentences[count:])
+    return first + ' ' + second
+
+
+def group_passages(docs):
+    """Passage hits grouped per document, best-matching document first
+
+    Returns [(key, title, {chunk_index: content})]
+    """
+    # Group hits by parent document (rows without chunk metadata stand alone)
+    groups = {}
+    for doc in docs:
+        key = doc.get('parent_id') or doc.get('id') or doc['title']
+        group = groups.setdefault(key, [key, doc['title'], {}, 0.0])
+        group[2][doc.get('chunk_index') or 0] = doc['content']
+        # Fused retrieval score when present, else the cosine similarity
+        group[3] = max(group[3], doc.get('score', doc.get('similarity')) or 0.0)
+    return [tuple(group[:3]) for group in sorted(groups.values(), key=lambda g: -g[3])]
+
+
+def render_block(title, chunks):
+    """Context block for one document's hits, adjacent passages merged
+
+    Returns (title, block, estimated tokens)
+    """
+    indexes = sorted(chunks)
+    spans = [chunks[indexes[0]]]
+    for previous, index in zip(indexes, indexes[1:]):
+        if index == previous + 1:
+            spans[-1] = _merge_passages(spans[-1], chunks[index])
+        else:
+            spans.append(chunks[index])
+    block = f"Title: {title}\nContent: {' ... '.join(spans)}"
+    return title, block, estimate_tokens(block)
+
+
+def fit_blocks(blocks, token_budget):
+    """Join rendered blocks in order until token_budget is used up
+
+    Returns (context, titles) where titles are the documents actually used
+    """
+    parts, titles = [], []
+    remaining = token_budget
+    for title, block, cost in blocks:
+        if cost > remaining:
+            # Trim the last block at a word boundary to use the rest of the budget
+            if remaining < 32:
+                break
+            block = ' '.join(_split_long_sentence(block, remaining)[:1])
+            cost = remaining
+        parts.append(block)
+        titles.append(title)
+        remaining -= cost
+
+    return "\n\n".join(parts), titles
+
+
+def assemble_context(docs, token_budget):
+    """Merge adjacent passage hits per document and fit them into token_budget
+
+    Returns (context, titles) where titles are the documents actually used
+    """
+    blocks = [render_block(title, chunks) for _, title, chunks in group_passages(docs)]
+    return fit_blocks(blocks, token_budget)
@@ -0,0 +1,91 @@
+"""
+Cache of rendered prompt context for /chat
+Popular documents are retrieved over and over, and re-rendering their
+passages (merging overlaps, counting tokens) on every request is wasted
+work. Rendered blocks are cached per document and per set of passage hits,
+and the assembled context is cached per top-k result, keyed on document ids
+and tagged with the knowledge-base version: when the version changes the
+whole cache is dropped. Identical top-k results also yield a byte-identical
+system prompt, which upstream prompt (prefix) caching can reuse
+"""
+
+import threading
+from collections import OrderedDict
+
+from chunking import fit_blocks, group_passages, render_block
+
+
+class ContextCache:
+    """Thread-safe LRU cache of context blocks and assembled contexts"""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        # (document key, chunk indexes) -> (title, block, tokens)
+        self._blocks = OrderedDict()
+        # (token budget, ((document key, chunk indexes), ...)) -> (context, titles)
+        self._contexts = OrderedDict()
+        self.version = None
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.block_hits = 0
+        self.misses = 0
+
+    def assemble(self, docs, token_budget, version):
+        """chunking.assemble_context() through the cache"""
+        groups = group_passages(docs)
+        ids = tuple((key, tuple(sorted(chunks))) for key, _, chunks in groups)
+        key = (token_budget, ids)
+
+        with self._lock:
+            if version != self.version:
+                self._reset(version)
+            value = self._get(self._contexts, key)
+            if value is not None:
+                self.hits += 1
+                return value[0], list(value[1])
+            self.misses += 1
+            blocks = [self._get(self._blocks, block_key) for block_key in ids]
+            self.block_hits += sum(block is not None for block in blocks)
+
+        # Render outside the lock; a concurrent miss may render the same block twice
+        for i, (_, title, chunks) in enumerate(groups):
+            if blocks[i] is None:
+                blocks[i] = render_block(title, chunks)
+        context, titles = fit_blocks(blocks, token_budget)
+
+        with self._lock:
+            # Results built from an older knowledge base are not kept
+            if version == self.version:
+                for block_key, block in zip(ids, blocks):
+                    self._put(self._blocks, block_key, block)
+                self._put(self._contexts, key, (context, tuple(titles)))
+        return context, titles
+
+    def invalidate(self):
+        with self._lock:
+            self._reset(self.version)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "block_hits": self.block_hits, "misses": self.misses,
+                    "contexts": len(self._contexts), "blocks": len(self._blocks),
+                    "version": self.version}
+
+    def _reset(self, version):
+        self._blocks.clear()
+        self._contexts.clear()
+        self.version = version
+
+    @staticmethod
+    def _get(entries, key):
+        value = entries.get(key)
+        if value is not None:
+            entries.move_to_end(key)
+        return value
+
+    def _put(self, entries, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
@@ -1,13 +1,22 @@
 """
 Data Loader Script for Health & Fitness Knowledge Base
 Loads health data from JSON file, generates embeddings, and stores in Supabase
+(or, with --snapshot, in a memory-mapped embedding store for local retrieval)
 """
 
+import argparse
+import hashlib
 import json
 import requests
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from embeddings import embed_many
+from chunking import chunk_record
+from bm25_index import BM25Index
+from knowledge_base import select_pages
+from vector_index import SNAPSHOT_DTYPES, SnapshotWriter, VectorIndex
 import time
 
 # Load environment variables
@@ -17,30 +26,21 @@ DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Bulk ingestion settings
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '500'))   # rows per request
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '4'))            # concurrent uploads
+MAX_UPLOAD_ATTEMPTS = 8
 
-def get_embedding(text):
-    """Generate embedding using simple hash-based approach for demo"""
-    import hashlib
-    import struct
-    
-    # Create a deterministic embedding from text
-    # This is a simplified approach - in production, use a proper embedding model
-    hash_obj = hashlib.sha256(text.encode())
-    hash_bytes = hash_obj.digest()
-    
-    # Create 1536-dimensional embedding (matching expected size)
-    embedding = []
-    for i in range(1536):
-        # Use hash bytes cyclically to generate float values
-        byte_idx = i % len(hash_bytes)
-        value = struct.unpack('B', bytes([hash_bytes[byte_idx]]))[0] / 255.0
-        # Add some variation based on position
-        value = (value + (i / 1536)) / 2.0
-        embedding.append(value)
-    
-    return embedding
+# Supabase client, created on first use (--snapshot never needs it)
+_supabase = None
+
+def get_supabase():
+    """Return the shared Supabase client, creating it on the first call"""
+    global _supabase
+    if _supabase is None:
+        from supabase import create_client
+        _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
 
 def create_table():
     """Create the fitness_knowledge table with pgvector extension"""
@@ -56,9 +56,19 @@ CREATE TABLE IF NOT EXISTS fitness_knowledge (
     id BIGSERIAL PRIMARY KEY,
     title TEXT NOT NULL,
     content TEXT NOT NULL,
+    content_hash TEXT,
+    parent_id TEXT,
+    chunk_index INT NOT NULL DEFAULT 0,
     embedding vector(1536)
 );
 
+-- Fingerprint used by incremental sync (python data_loader.py --sync)
+ALTER TABLE fitness_knowledge ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- Passage metadata for chunked documents
+ALTER TABLE fitness_knowledge ADD COLUMN IF NOT EXISTS parent_id TEXT;
+ALTER TABLE fitness_knowledge ADD COLUMN IF NOT EXISTS chunk_index INT NOT NULL DEFAULT 0;
+
 -- Create index for faster similarity search
 CREATE INDEX IF NOT EXISTS fitness_knowledge_embedding_idx 
 ON fitness_knowledge 
@@ -66,6 +76,7 @@ USING ivfflat (embedding vector_cosine_ops)
 WITH (lists = 100);
 
 -- Create function for similarity search
+DROP FUNCTION IF EXISTS match_fitness_knowledge(vector, float, int);
 CREATE OR REPLACE FUNCTION match_fitness_knowledge(
     query_embedding vector(1536),
     match_threshold float,
@@ -75,6 +86,8 @@ RETURNS TABLE (
     id bigint,
     title text,
     content text,
+    parent_id text,
+    chunk_index int,
     similarity float
 )
 LANGUAGE sql STABLE
@@ -83,93 +96,462 @@ AS $$
         fitness_knowledge.id,
         fitness_knowledge.title,
         fitness_knowledge.content,
+        fitness_knowledge.parent_id,
+        fitness_knowledge.chunk_index,
         1 - (fitness_knowledge.embedding <=> query_embedding) AS similarity
     FROM fitness_knowledge
     WHERE 1 - (fitness_knowledge.embedding <=> query_embedding) > match_threshold
     ORDER BY fitness_knowledge.embedding <=> query_embedding
     LIMIT match_count;
 $$;
+
+-- Batched similarity search (one call per /chat/batch request)
+CREATE OR REPLACE FUNCTION match_fitness_knowledge_batch(
+    query_embeddings jsonb,
+    match_threshold float DEFAULT 0.5,
+    match_count int DEFAULT 3
+)
+RETURNS TABLE (
+    query_index int,
+    id bigint,
+    title text,
+    content text,
+    parent_id text,
+    chunk_index int,
+    similarity float
+)
+LANGUAGE sql STABLE
+AS $$
+    WITH queries AS (
+        SELECT (q.idx - 1)::int AS query_index, (q.embedding::text)::vector(1536) AS embedding
+        FROM jsonb_array_elements(query_embeddings) WITH ORDINALITY AS q(embedding, idx)
+    )
+    SELECT queries.query_index, matches.*
+    FROM queries
+    CROSS JOIN LATERAL (
+        SELECT
+            fitness_knowledge.id,
+            fitness_knowledge.title,
+            fitness_knowledge.content,
+            fitness_knowledge.parent_id,
+            fitness_knowledge.chunk_index,
+            1 - (fitness_knowledge.embedding <=> queries.embedding) AS similarity
+        FROM fitness_knowledge
+        WHERE 1 - (fitness_knowledge.embedding <=> queries.embedding) > match_threshold
+        ORDER BY fitness_knowledge.embedding <=> queries.embedding
+        LIMIT match_count
+    ) AS matches
+    ORDER BY queries.query_index, matches.similarity DESC;
+$$;
 """
     
     print(sql_commands)
     print("\n" + "="*60)
     input("\nPress Enter after running the SQL commands in Supabase...")
 
-def load_data_from_json(file_path='health_data.json'):
-    """Load health data from JSON file"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        print(f"✅ Loaded {len(data)} records from {file_path}")
-        return data
-    except Exception as e:
-        print(f"❌ Error loading data: {e}")
-        return []
-
-def insert_data_with_embeddings(data):
-    """Generate embeddings and insert data into Supabase"""
-    print(f"\n🚀 Starting to process {len(data)} records...")
-    
-    success_count = 0
-    fail_count = 0
+def _iter_json_array(f, chunk_size):
+    """Incrementally decode the elements of a top-level JSON array"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    started = False
+    eof = False
     
-    for idx, item in enumerate(data, 1):
-        title = item.get('title', '')
-        content = item.get('content', '')
+    while True:
+        # Skip whitespace, the opening bracket and separators between elements
+        while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ','
+                                     or (not started and buffer[pos] == '[')):
+            started = started or buffer[pos] == '['
+            pos += 1
         
-        print(f"\n[{idx}/{len(data)}] Processing: {title}")
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
         
-        # Combine title and content for embedding
-        text_for_embedding = f"{title}\n{content}"
+        if pos < len(buffer):
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                # Only accept a value once its separator is buffered; a number
+                # at the buffer edge ("12" of "12.5") may still be incomplete
+                sep = end
+                while sep < len(buffer) and buffer[sep].isspace():
+                    sep += 1
+                if sep < len(buffer) and buffer[sep] in ',]':
+                    yield item
+                    pos = end
+                    continue
+            except json.JSONDecodeError:
+                pass
         
-        # Generate embedding
-        print("  ⏳ Generating embedding...")
-        embedding = get_embedding(text_for_embedding)
+        if eof:
+            raise ValueError(f"Malformed or truncated JSON array near character {pos}")
         
-        if not embedding:
-            print(f"  ❌ Failed to generate embedding")
-            fail_count += 1
+        # Need more data: drop what was consumed and read the next chunk
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+def iter_records(file_path='health_data.json', chunk_size=1 << 20):
+    """Stream records from a JSON array or JSONL file without loading it whole"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        if file_path.endswith(('.jsonl', '.ndjson')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from _iter_json_array(f, chunk_size)
+
+class AdaptiveRateLimiter:
+    """Shared pacing for upload workers, driven by actual 429 responses"""
+    
+    def __init__(self, min_delay=0.0, max_delay=30.0):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min_delay
+        self.throttled = 0
+        self._lock = threading.Lock()
+    
+    def wait(self):
+        """Sleep for the current delay before sending a request"""
+        with self._lock:
+            delay = self.delay
+        if delay > 0:
+            time.sleep(delay)
+    
+    def on_throttled(self, retry_after=None):
+        """Back off: honor Retry-After, otherwise double the delay"""
+        with self._lock:
+            self.throttled += 1
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = max(self.delay * 2, 0.5)
+            self.delay = min(self.max_delay, max(self.delay, delay))
+    
+    def on_success(self):
+        """Speed back up gradually after successful requests"""
+        with self._lock:
+            self.delay = max(self.min_delay, self.delay / 2 if self.delay > 0.01 else 0.0)
+
+_thread_local = threading.local()
+
+def _rest_session():
+    """Per-thread keep-alive session for the PostgREST API behind Supabase"""
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update({
+            "apikey": SUPABASE_KEY,
+            "Authorization": f"Bearer {SUPABASE_KEY}",
+            "Content-Type": "application/json",
+            "Prefer": "return=minimal"
+        })
+        _thread_local.session = session
+    return session
+
+def _rest_request(method, limiter, params=None, rows=None, prefer="return=minimal"):
+    """Send one PostgREST request on fitness_knowledge, retrying when throttled"""
+    url = f"{SUPABASE_URL}/rest/v1/fitness_knowledge"
+    
+    for attempt in range(MAX_UPLOAD_ATTEMPTS):
+        limiter.wait()
+        response = _rest_session().request(method, url, params=params, json=rows,
+                                           headers={"Prefer": prefer}, timeout=(3.05, 120))
+        
+        if response.status_code in (429, 503):
+            limiter.on_throttled(response.headers.get('Retry-After'))
             continue
         
-        # Insert into Supabase
-        try:
-            print("  ⏳ Inserting into Supabase...")
-            result = supabase.table('fitness_knowledge').insert({
-                'title': title,
-                'content': content,
-                'embedding': embedding
-            }).execute()
+        response.raise_for_status()
+        limiter.on_success()
+        return response
+    
+    raise RuntimeError(f"Still throttled after {MAX_UPLOAD_ATTEMPTS} attempts")
+
+def upload_chunk(rows, limiter, stale_ids=()):
+    """Write one chunk of rows: insert new rows, upsert rows that keep an id
+
+    PostgREST bulk writes need every row to have the same columns, so rows
+    with and without an id go in separate requests. stale_ids are passages
+    of updated documents that the new version no longer has
+    """
+    new_rows = [row for row in rows if 'id' not in row]
+    existing_rows = [row for row in rows if 'id' in row]
+    if new_rows:
+        _rest_request('POST', limiter, rows=new_rows)
+    if existing_rows:
+        _rest_request('POST', limiter, rows=existing_rows,
+                      prefer="resolution=merge-duplicates,return=minimal")
+    if stale_ids:
+        delete_rows(stale_ids, limiter)
+    return len(rows)
+
+def delete_rows(ids, limiter):
+    """Delete rows by id in a single request"""
+    _rest_request('DELETE', limiter, params={'id': f"in.({','.join(map(str, ids))})"})
+    return len(ids)
+
+def fetch_existing_hashes(page_size=1000):
+    """Page through id/title/content_hash with keyset pagination on id"""
+    limiter = AdaptiveRateLimiter()
+    rows = []
+    last_id = 0
+    
+    while True:
+        response = _rest_request('GET', limiter, params={
+            'select': 'id,title,content_hash,chunk_index',
+            'id': f'gt.{last_id}',
+            'order': 'id.asc',
+            'limit': str(page_size)
+        }, prefer="count=none")
+        page = response.json()
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        last_id = page[-1]['id']
+
+def iter_batches(records, batch_size):
+    """Group an iterable of records into lists of batch_size"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def record_hash(title, content):
+    """Stable fingerprint of a record's title and content"""
+    return hashlib.sha256(f"{title}\n{content}".encode()).hexdigest()
+
+def build_rows(batch):
+    """Split a batch of records into passages, embed them in one call and build the table rows
+    
+    Returns (rows, stale_ids): passages of an updated record reuse its
+    existing row ids in order, and ids left over when the new version has
+    fewer passages are returned for deletion
+    """
+    rows, stale_ids, embeddings = embed_rows(batch)
+    for row, embedding in zip(rows, embeddings):
+        row['embedding'] = embedding.tolist()
+    return rows, stale_ids
+
+def embed_rows(batch):
+    """build_rows() with the embeddings kept as one (n, 1536) float32 matrix
+    
+    Returns (rows without 'embedding', stale_ids, embeddings)
+    """
+    rows = []
+    stale_ids = []
+    for item in batch:
+        # Every passage carries the hash of the whole record for --sync
+        content_hash = record_hash(item.get('title', ''), item.get('content', ''))
+        row_ids = item.get('row_ids', [])
+        passages = chunk_record(item)
+        for passage, row_id in zip(passages, row_ids):
+            passage['id'] = row_id
+        stale_ids.extend(row_ids[len(passages):])
+        rows.extend(dict(passage, content_hash=content_hash) for passage in passages)
+    
+    embeddings = embed_many(f"{row['title']}\n{row['content']}" for row in rows)
+    return rows, stale_ids, embeddings
+
+def upload_records(records, limiter, batch_size=INGEST_BATCH_SIZE, workers=INGEST_WORKERS):
+    """Embed records batch by batch and upload the chunks from a bounded worker pool
+    
+    Counts are in table rows (passages), not source records
+    """
+    success_count = 0
+    fail_count = 0
+    start = time.perf_counter()
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        
+        def collect(done):
+            nonlocal success_count, fail_count
+            for future in done:
+                size = pending.pop(future)
+                try:
+                    success_count += future.result()
+                except Exception as e:
+                    print(f"  ❌ Error uploading chunk of {size} rows: {e}")
+                    fail_count += size
             
-            print(f"  ✅ Successfully inserted")
-            success_count += 1
+            total = success_count + fail_count
+            elapsed = time.perf_counter() - start
+            print(f"  ⏳ {total} rows processed ({total / elapsed:.0f} rows/s)")
+        
+        for batch in iter_batches(records, batch_size):
+            # Bound the number of embedded-but-unsent chunks held in memory
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
             
-        except Exception as e:
-            print(f"  ❌ Error inserting: {e}")
-            fail_count += 1
+            rows, stale_ids = build_rows(batch)
+            pending[executor.submit(upload_chunk, rows, limiter, stale_ids)] = len(rows)
         
-        # Rate limiting - wait a bit between requests
-        if idx < len(data):
-            time.sleep(0.5)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    
+    return success_count, fail_count
+
+def insert_data_with_embeddings(data, batch_size=INGEST_BATCH_SIZE, workers=INGEST_WORKERS):
+    """Generate embeddings in batches and upload them in parallel chunks"""
+    print(f"\n🚀 Starting bulk ingestion ({batch_size} rows per request, {workers} workers)...")
+    
+    limiter = AdaptiveRateLimiter()
+    start = time.perf_counter()
+    success_count, fail_count = upload_records(data, limiter, batch_size, workers)
+    elapsed = time.perf_counter() - start
+    total = success_count + fail_count
     
     print("\n" + "="*60)
     print(f"📊 Summary:")
     print(f"  ✅ Successfully inserted: {success_count}")
     print(f"  ❌ Failed: {fail_count}")
-    print(f"  📈 Total: {len(data)}")
+    print(f"  📈 Total: {total}")
+    print(f"  ⏱️  Elapsed: {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s)")
+    print(f"  🚦 Throttled responses (429/503): {limiter.throttled}")
+    print("="*60)
+
+def plan_sync(records, existing):
+    """Diff source records against stored passage rows, keyed by title
+    
+    Only titles and hashes are kept, so records can be a one-pass stream
+    """
+    # Last occurrence wins if the source repeats a title
+    source = {}
+    for item in records:
+        title = item.get('title', '')
+        source[title] = record_hash(title, item.get('content', ''))
+    
+    # title -> {chunk_index: row}, in id order
+    stored = {}
+    duplicates = []
+    for row in existing:
+        passages = stored.setdefault(row['title'], {})
+        chunk_index = row.get('chunk_index') or 0
+        if chunk_index in passages:
+            # Earlier full reloads left duplicate rows behind; keep the first
+            duplicates.append(row['id'])
+        else:
+            passages[chunk_index] = row
+    
+    new, changed = {}, {}
+    unchanged = 0
+    for title, content_hash in source.items():
+        passages = stored.get(title)
+        if passages is None:
+            new[title] = content_hash
+        elif any(row.get('content_hash') != content_hash for row in passages.values()):
+            row_ids = [passages[idx]['id'] for idx in sorted(passages)]
+            changed[title] = (row_ids, content_hash)
+        else:
+            unchanged += 1
+    
+    removed = [row['id'] for title, passages in stored.items() if title not in source
+               for row in passages.values()]
+    
+    return {
+        'new': new,
+        'changed': changed,
+        'removed': removed + duplicates,
+        'unchanged': unchanged,
+        'duplicates': len(duplicates)
+    }
+
+def _select_records(records, wanted):
+    """Yield the planned version of each wanted title from a record stream"""
+    remaining = dict(wanted)
+    for item in records:
+        title = item.get('title', '')
+        planned = remaining.get(title)
+        if planned is None:
+            continue
+        row_ids, content_hash = planned if isinstance(planned, tuple) else (None, planned)
+        if record_hash(title, item.get('content', '')) != content_hash:
+            continue
+        del remaining[title]
+        yield item if row_ids is None else dict(item, row_ids=row_ids)
+
+def sync_data(file_path='health_data.json', batch_size=INGEST_BATCH_SIZE,
+              workers=INGEST_WORKERS, dry_run=False):
+    """Incremental sync: only embed/write new or changed records and delete removed ones"""
+    print("\n🔄 Comparing source records with Supabase...")
+    plan = plan_sync(iter_records(file_path), fetch_existing_hashes())
+    
+    print("\n" + "="*60)
+    print(f"📋 Sync plan:")
+    print(f"  ➕ New: {len(plan['new'])}")
+    print(f"  ✏️  Changed: {len(plan['changed'])}")
+    print(f"  ➖ Removed: {len(plan['removed'])} (including {plan['duplicates']} duplicates)")
+    print(f"  ✔️  Unchanged: {plan['unchanged']}")
     print("="*60)
+    
+    if dry_run:
+        return plan
+    
+    limiter = AdaptiveRateLimiter()
+    failed = 0
+    
+    # Second pass over the file streams only the records that need writing.
+    # Updated records rewrite their passages in place, by id
+    if plan['new']:
+        records = _select_records(iter_records(file_path), plan['new'])
+        failed += upload_records(records, limiter, batch_size, workers)[1]
+    if plan['changed']:
+        records = _select_records(iter_records(file_path), plan['changed'])
+        failed += upload_records(records, limiter, batch_size, workers)[1]
+    
+    for ids in iter_batches(plan['removed'], batch_size):
+        try:
+            delete_rows(ids, limiter)
+        except Exception as e:
+            print(f"  ❌ Error deleting {len(ids)} rows: {e}")
+            failed += len(ids)
+    
+    print(f"{'✅' if not failed else '⚠️ '} Sync complete ({failed} failed)")
+    return plan
+
+def write_snapshot(records, path, dtype='float32', batch_size=INGEST_BATCH_SIZE):
+    """Chunk and embed records into a memory-mapped snapshot directory
+    
+    Passages are numbered 1..n in file order (there are no table ids);
+    the BM25 postings for hybrid retrieval are written alongside
+    """
+    start = time.perf_counter()
+    with SnapshotWriter(path, dtype) as writer:
+        for batch in iter_batches(records, batch_size):
+            rows, _, embeddings = embed_rows(batch)
+            writer.add(rows, embeddings)
+    
+    index = VectorIndex.from_snapshot(path)
+    BM25Index(index.passages()).save_snapshot(path)
+    size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    print(f"✅ Wrote {len(index)} {dtype} passages to {path} "
+          f"({size / 1e6:.1f} MB) in {time.perf_counter() - start:.2f}s")
+    return index
 
 def verify_data():
     """Verify that data was inserted correctly"""
     try:
         print("\n🔍 Verifying data in Supabase...")
-        result = supabase.table('fitness_knowledge').select('id, title').execute()
+        # Page through the table instead of pulling it in one response
+        total = 0
+        sample = []
+        for page in select_pages(get_supabase(), 'id, title'):
+            total += len(page)
+            sample.extend(page[:5 - len(sample)])
         
-        if result.data:
-            print(f"✅ Found {len(result.data)} records in database:")
-            for record in result.data[:5]:  # Show first 5
+        if total:
+            print(f"✅ Found {total} records in database:")
+            for record in sample:  # Show first 5
                 print(f"  - {record['title']}")
-            if len(result.data) > 5:
-                print(f"  ... and {len(result.data) - 5} more")
+            if total > 5:
+                print(f"  ... and {total - 5} more")
         else:
             print("⚠️  No records found in database")
             
@@ -178,10 +560,26 @@ def verify_data():
 
 def main():
     """Main function to orchestrate data loading"""
+    parser = argparse.ArgumentParser(description="Load the fitness knowledge base into Supabase")
+    parser.add_argument('--sync', action='store_true',
+                        help="incremental sync: only write new/changed records and delete removed ones")
+    parser.add_argument('--dry-run', action='store_true', help="with --sync, only print the diff")
+    parser.add_argument('--file', default='health_data.json',
+                        help="source file: a JSON array or JSONL (one record per line)")
+    parser.add_argument('--snapshot', metavar='DIR',
+                        help="write a memory-mapped embedding store to DIR instead of Supabase")
+    parser.add_argument('--snapshot-dtype', choices=SNAPSHOT_DTYPES, default='float32',
+                        help="int8 stores 4x smaller vectors with one scale per row")
+    args = parser.parse_args()
+    
     print("="*60)
     print("🏋️  Health & Fitness Knowledge Base Loader")
     print("="*60)
     
+    if args.snapshot:
+        write_snapshot(iter_records(args.file), args.snapshot, args.snapshot_dtype)
+        return
+    
     # Check environment variables
     if not all([DEEPSEEK_API_KEY, SUPABASE_URL, SUPABASE_KEY]):
         print("\n❌ ERROR: Missing required environment variables!")
@@ -193,18 +591,26 @@ def main():
     
     print("\n✅ Environment variables loaded")
     
+    if args.sync:
+        sync_data(args.file, dry_run=args.dry_run)
+        return
+    
     # Step 1: Create table (manual SQL execution)
     create_table()
     
-    # Step 2: Load data from JSON
-    data = load_data_from_json('health_data.json')
+    # Step 2: Check the source file (records are streamed, not loaded at once)
+    try:
+        has_data = next(iter_records(args.file), None) is not None
+    except Exception as e:
+        print(f"❌ Error reading {args.file}: {e}")
+        return
     
-    if not data:
+    if not has_data:
         print("❌ No data to process. Exiting.")
         return
     
     # Step 3: Confirm before proceeding
-    print(f"\n⚠️  About to process {len(data)} records.")
+    print(f"\n⚠️  About to process records from {args.file}.")
     print("This will generate embeddings and insert data into Supabase.")
     confirm = input("Continue? (yes/no): ").strip().lower()
     
@@ -213,7 +619,7 @@ def main():
         return
     
     # Step 4: Insert data with embeddings
-    insert_data_with_embeddings(data)
+    insert_data_with_embeddings(iter_records(args.file))
     
     # Step 5: Verify insertion
     verify_data()
@@ -0,0 +1,53 @@
+"""
+Embedding engine shared by the Flask app and the data loader
+Builds the deterministic hash-based embeddings with NumPy in one batched
+operation instead of a per-element Python loop
+"""
+
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+
+# Dimension expected by the fitness_knowledge.embedding vector(1536) column
+EMBEDDING_DIM = 1536
+
+# Number of recent query embeddings kept by get_embedding()
+EMBEDDING_CACHE_SIZE = 1024
+
+_DIGEST_SIZE = hashlib.sha256().digest_size
+_REPEATS = -(-EMBEDDING_DIM // _DIGEST_SIZE)
+
+# The position term (i / 1536) is the same for every vector, so build it once
+_POSITIONS = np.arange(EMBEDDING_DIM, dtype=np.float64) / EMBEDDING_DIM
+
+
+def embed_many(texts):
+    """Generate embeddings for a list of texts as one (n, 1536) float32 matrix"""
+    texts = list(texts)
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+    # One SHA-256 digest per text, laid out as an (n, 32) byte matrix
+    digests = np.frombuffer(
+        b"".join(hashlib.sha256(text.encode()).digest() for text in texts),
+        dtype=np.uint8
+    ).reshape(len(texts), _DIGEST_SIZE)
+
+    # Use hash bytes cyclically across all 1536 positions
+    values = np.tile(digests, (1, _REPEATS))[:, :EMBEDDING_DIM] / 255.0
+
+    # Add some variation based on position
+    values += _POSITIONS
+    values /= 2.0
+
+    return values.astype(np.float32)
+
+
+@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def get_embedding(text):
+    """Generate a single float32 embedding, cached for repeated queries"""
+    embedding = embed_many([text])[0]
+    # Cached arrays are shared between callers, so keep them read-only
+    embedding.flags.writeable = False
+    return embedding
@@ -0,0 +1,195 @@
+"""
+Knowledge-base snapshots and their background refresher
+Everything /chat derives from fitness_knowledge (vector index, BM25 index)
+is held in one immutable KnowledgeBase object. A refresher thread builds the
+next one off the request path, on an interval or when notified, and swaps it
+in with a single assignment: a request keeps using the snapshot it started
+with and never waits for a reload.
+
+The source is polled with a cheap fingerprint first (file stat, snapshot
+manifest or one keyset-paged pass over id/content_hash), so a refresh that
+finds nothing new costs no rebuild and keeps the caches warm
+"""
+
+import hashlib
+import threading
+import time
+
+# Rows per request when paging through fitness_knowledge
+PAGE_SIZE = 1000
+
+
+def select_pages(client, columns, page_size=PAGE_SIZE, table='fitness_knowledge'):
+    """Yield pages of rows ordered by id, with keyset pagination (id > last id seen)
+
+    Unlike one unpaged select, no single response holds the whole table, and
+    unlike offset paging each page is an index range scan
+    """
+    if 'id' not in [column.strip() for column in columns.split(',')]:
+        columns = 'id, ' + columns
+    last_id = None
+    while True:
+        query = client.table(table).select(columns)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        page = query.order('id').limit(page_size).execute().data or []
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last_id = page[-1]['id']
+
+
+def fingerprint(parts):
+    """Short stable version string for an iterable of strings"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+class KnowledgeBase:
+    """One loaded version of the knowledge base; never modified after it is built"""
+
+    __slots__ = ('local_index', 'lexical_index', 'version', 'generation', 'loaded_at', 'build_seconds')
+
+    def __init__(self, local_index=None, lexical_index=None, version=None, generation=0,
+                 build_seconds=0.0):
+        self.local_index = local_index
+        self.lexical_index = lexical_index
+        # Source fingerprint the snapshot was built from
+        self.version = version
+        # Snapshots swapped in so far by this process
+        self.generation = generation
+        self.loaded_at = time.time()
+        self.build_seconds = build_seconds
+
+    @property
+    def ready(self):
+        return self.version is not None
+
+    def passages(self):
+        index = self.local_index if self.local_index is not None else self.lexical_index
+        return len(index) if index is not None else 0
+
+    def info(self):
+        """Version and age, for /health"""
+        return {
+            "version": self.version,
+            "generation": self.generation,
+            "age_seconds": round(time.time() - self.loaded_at, 1) if self.ready else None,
+            "build_seconds": round(self.build_seconds, 3),
+            "passages": self.passages()
+        }
+
+
+class Refresher:
+    """Background thread that rebuilds the knowledge base when its source changes
+
+    check() returns the source's current fingerprint; build(version,
+    generation) returns a new KnowledgeBase; swap(kb) installs it. A notify()
+    (e.g. from /admin/reload) wakes the thread at once, and with force also
+    rebuilds when the fingerprint has not changed
+    """
+
+    def __init__(self, check, build, swap, interval=0.0):
+        self.check = check
+        self.build = build
+        self.swap = swap
+        # Seconds between fingerprint polls; 0 only refreshes when notified
+        self.interval = interval
+        self.current = None
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_check = None
+
+        self._wake = threading.Event()
+        self._force = False
+        self._done = threading.Condition()
+        self._started = 0
+        self._completed = 0
+        self._build_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the thread (again, e.g. in a forked worker)
+
+        Without a snapshot yet, its first pass builds one (background warm-up)
+        """
+        self._thread = threading.Thread(target=self._run, name='kb-refresher', daemon=True)
+        self._thread.start()
+        return self
+
+    def restart(self):
+        """start() in a forked child (e.g. gunicorn --preload): threads and locks are not inherited"""
+        self._wake = threading.Event()
+        self._done = threading.Condition()
+        self._build_lock = threading.Lock()
+        return self.start()
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def notify(self, force=False):
+        """Ask for a refresh now; returns a ticket for wait()"""
+        with self._done:
+            # A pass already running may have checked the source before this call
+            ticket = self._started + 1
+            self._force = self._force or force
+        self._wake.set()
+        return ticket
+
+    def wait(self, ticket, timeout=None):
+        """Wait until the pass serving a notify() ticket has finished"""
+        with self._done:
+            return self._done.wait_for(lambda: self._completed >= ticket, timeout)
+
+    def refresh(self, force=False):
+        """Rebuild and swap when the source changed; returns True when a new snapshot was installed"""
+        with self._build_lock:
+            version = self.check()
+            self.last_check = time.time()
+            if not force and self.current is not None and version == self.current.version:
+                return False
+            generation = self.current.generation + 1 if self.current is not None else 1
+            start = time.perf_counter()
+            kb = self.build(version, generation)
+            kb.build_seconds = time.perf_counter() - start
+            self.current = kb
+            self.swap(kb)
+            self.refreshes += 1
+            return True
+
+    def stats(self):
+        return {"refreshes": self.refreshes, "failures": self.failures,
+                "last_error": self.last_error, "interval": self.interval,
+                "last_check_age_seconds": round(time.time() - self.last_check, 1)
+                if self.last_check is not None else None}
+
+    def _run(self):
+        if self.current is not None:
+            self._sleep()
+        while True:
+            with self._done:
+                force, self._force = self._force, False
+                self._started += 1
+                ticket = self._started
+            try:
+                self.refresh(force)
+                self.last_error = None
+            except Exception as e:
+                # Keep serving the last good snapshot and try again next time
+                print(f"Error refreshing knowledge base: {e}")
+                self.failures += 1
+                self.last_error = type(e).__name__
+            with self._done:
+                self._completed = ticket
+                self._done.notify_all()
+            self._sleep()
+
+    def _sleep(self):
+        # Woken early by notify(); without an interval only notify() wakes it
+        self._wake.wait(self.interval or None)
+        self._wake.clear()
@@ -0,0 +1,109 @@
+"""
+Language detection for queries and knowledge-base passages
+English, Hindi and Marathi are told apart by script first (Latin vs
+Devanagari) and then, for Devanagari, by counting function words and case
+endings that only one of the two languages uses. It is a handful of set
+lookups, so /chat runs it once per request and passes the result down to
+the topic gate, retrieval, the prompt and the cache keys
+"""
+
+import os
+import re
+
+import numpy as np
+
+SUPPORTED_LANGUAGES = ('en', 'hi', 'mr')
+DEFAULT_LANGUAGE = 'en'
+
+# Language partitions with fewer passages are not searched on their own:
+# they would miss relevant passages written in the other languages. Read
+# here so the vector and BM25 indexes always agree
+PARTITION_MIN_ROWS = int(os.getenv('LANGUAGE_PARTITION_MIN', '50'))
+
+_WORD = re.compile(r'[\wऀ-ॿ]+')
+_DEVANAGARI = re.compile(r'[ऀ-ॿ]')
+_LATIN = re.compile(r'[A-Za-z]')
+
+# Words (after NFC) that mark one of the two Devanagari languages; shared
+# words such as व्यायाम, योग or दिन are left out
+_HINDI_WORDS = frozenset([
+    'है', 'हैं', 'था', 'थी', 'थे', 'क्या', 'कैसे', 'कैसा', 'कितना', 'कितनी', 'कितने',
+    'मुझे', 'मेरा', 'मेरी', 'मेरे', 'और', 'के', 'की', 'का', 'को', 'में', 'से', 'पर',
+    'लिए', 'चाहिए', 'नहीं', 'होता', 'होती', 'करना', 'करें', 'कौन', 'यह', 'वह', 'हम',
+    'आप', 'अपने', 'बहुत', 'सकता', 'सकते', 'सकती', 'पानी', 'सेहत', 'वज़न', 'नींद',
+    'तनाव', 'भोजन', 'दौड़', 'मांसपेशियों', 'रहा', 'रही', 'रहे', 'जाता', 'जाती', 'किसी',
+])
+_MARATHI_WORDS = frozenset([
+    'आहे', 'आहेत', 'होता', 'काय', 'कसे', 'कसा', 'कशी', 'किती', 'मला', 'माझे', 'माझी',
+    'माझा', 'आणि', 'मध्ये', 'साठी', 'पाहिजे', 'नाही', 'करावे', 'करा', 'कोण', 'हे', 'ते',
+    'आम्ही', 'तुम्ही', 'खूप', 'शकतो', 'शकते', 'दिवस', 'पाणी', 'आरोग्य', 'स्नायू', 'झोप',
+    'ताण', 'अन्न', 'प्रथिने', 'धावणे', 'किंवा', 'आपल्या', 'कोणते', 'कोणता', 'कसं', 'असते',
+])
+# Marathi attaches case endings to the noun (व्यायामाचे, पाण्याची, झोपेसाठी)
+_MARATHI_SUFFIXES = ('च्या', 'साठी', 'मध्ये', 'मुळे', 'ाचे', 'ाची', 'ाचा', 'ाला', 'ांना')
+
+# A word listed for both languages ('होता') counts for neither
+_SHARED = _HINDI_WORDS & _MARATHI_WORDS
+_HINDI_WORDS = _HINDI_WORDS - _SHARED
+_MARATHI_WORDS = _MARATHI_WORDS - _SHARED
+
+
+def normalize_language(requested):
+    """Supported two-letter code for a client hint such as 'hi-IN', else None"""
+    if not isinstance(requested, str):
+        return None
+    language = requested.split('-')[0].split('_')[0].lower()
+    return language if language in SUPPORTED_LANGUAGES else None
+
+
+def detect_language(text, requested=None):
+    """'en', 'hi' or 'mr' for text; a supported client hint wins"""
+    language = normalize_language(requested)
+    if language is not None:
+        return language
+
+    devanagari = len(_DEVANAGARI.findall(text))
+    if not devanagari or devanagari < len(_LATIN.findall(text)):
+        return DEFAULT_LANGUAGE
+
+    hindi = marathi = 0
+    for word in _WORD.findall(text):
+        if word in _HINDI_WORDS:
+            hindi += 1
+        elif word in _MARATHI_WORDS or word.endswith(_MARATHI_SUFFIXES):
+            marathi += 1
+    # Hindi is the more common of the two, so it wins a tie
+    return 'mr' if marathi > hindi else 'hi'
+
+
+def language_codes(rows):
+    """uint8 code (index into SUPPORTED_LANGUAGES) per passage row
+
+    Rows may carry a 'language'; the rest are detected from their text
+    """
+    codes = np.empty(len(rows), dtype=np.uint8)
+    for i, row in enumerate(rows):
+        language = normalize_language(row.get('language')) or detect_language(
+            f"{row.get('title', '')} {row.get('content', '')}")
+        codes[i] = SUPPORTED_LANGUAGES.index(language)
+    return codes
+
+
+class Partitions:
+    """Row indexes per language over one set of passages, built on first use"""
+
+    def __init__(self, codes, min_rows=PARTITION_MIN_ROWS):
+        self.codes = codes
+        self.min_rows = min_rows
+        self._rows = {}
+
+    def rows(self, language):
+        """Sorted row indexes of the language's passages, or None to search every row"""
+        if self.codes is None or language not in SUPPORTED_LANGUAGES:
+            return None
+        if language not in self._rows:
+            rows = np.flatnonzero(self.codes == SUPPORTED_LANGUAGES.index(language))
+            # A partition covering every row filters nothing
+            self._rows[language] = (rows if self.min_rows <= len(rows) < len(self.codes)
+                                    else None)
+        return self._rows[language]
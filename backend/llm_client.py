@@ -0,0 +1,327 @@
+"""
+DeepSeek HTTP client layer
+Reuses one pooled keep-alive session, applies connect/read timeouts, retries
+429/5xx responses with jittered backoff and trips a circuit breaker when the
+upstream is degraded so callers can fail fast
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Status codes worth retrying: rate limiting and transient upstream failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# httpcore scans every pooled connection on each request, so one large async
+# pool costs O(connections) CPU per request; split it into small shards
+ASYNC_SHARD_SIZE = 25
+
+
+def backoff_delay(attempt, base, cap, retry_after=None):
+    """Full-jitter exponential backoff, honoring Retry-After when present"""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), cap))
+        except ValueError:
+            pass
+    return delay
+
+
+def stream_payload(payload):
+    """Streaming variant of a payload; asks for a final chunk with token usage"""
+    return dict(payload, stream=True, stream_options={"include_usage": True})
+
+
+def stream_delta(data, on_usage=None):
+    """Content of one stream chunk; the final chunk carries usage and no choices"""
+    if on_usage and data.get('usage'):
+        on_usage(data['usage'])
+    choices = data.get('choices') or []
+    return choices[0].get('delta', {}).get('content') if choices else None
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the circuit is open"""
+
+
+class UpstreamError(Exception):
+    """Raised when the upstream keeps failing after all retries"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a half-open probe"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow_request(self):
+        """True if a call may go upstream (only one probe while half-open)"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """End a call that says nothing about the upstream (e.g. it was cancelled)
+
+        A half-open probe that ends this way lets the next request probe again
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+
+class LLMClient:
+    """Chat completion client for an OpenAI-compatible endpoint such as DeepSeek"""
+
+    def __init__(self, url, api_key, pool_size=10, connect_timeout=3.05,
+                 read_timeout=60.0, max_retries=2, backoff_base=0.25,
+                 backoff_cap=4.0, breaker=None, on_usage=None):
+        self.url = url
+        self.api_key = api_key
+        # Called with the response's "usage" block (token counts) when present
+        self.on_usage = on_usage
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker()
+
+        # Retries are handled here so they also feed the circuit breaker
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def _post(self, payload, stream=False):
+        """POST with retries; returns a successful response or raises"""
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("DeepSeek circuit breaker is open")
+
+        # Every exit reports an outcome, or a half-open probe would never end
+        try:
+            response = self._post_with_retries(payload, stream)
+        except requests.HTTPError:
+            # Other 4xx errors are caller mistakes, not upstream degradation
+            self.breaker.record_success()
+            raise
+        except (requests.RequestException, UpstreamError):
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return response
+
+    def _post_with_retries(self, payload, stream):
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.session.post(self.url, json=payload,
+                                             timeout=self.timeout, stream=stream)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+
+                retry_after = response.headers.get('Retry-After')
+                last_error = UpstreamError(f"DeepSeek returned HTTP {response.status_code}")
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+
+            if attempt < self.max_retries:
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap, retry_after))
+
+        raise last_error
+
+    def complete(self, payload):
+        """Return the message content of a non-streaming completion"""
+        response = self._post(payload)
+        data = response.json()
+        if self.on_usage and data.get('usage'):
+            self.on_usage(data['usage'])
+        return data['choices'][0]['message']['content']
+
+    def stream(self, payload):
+        """Yield content deltas of a streaming completion"""
+        with self._post(stream_payload(payload), stream=True) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                # OpenAI-style "data: {...}" lines, terminated by "data: [DONE]"
+                if not line or not line.startswith('data:'):
+                    continue
+                chunk = line[len('data:'):].strip()
+                if chunk == '[DONE]':
+                    break
+                content = stream_delta(json.loads(chunk), self.on_usage)
+                if content:
+                    yield content
+
+
+class AsyncClientPool:
+    """Round-robin set of small httpx.AsyncClient pools with pool_size connections in total"""
+
+    def __init__(self, pool_size, **kwargs):
+        # httpx is only needed by the async serving mode; importing it lazily
+        # keeps it off the Flask app's cold start
+        import httpx
+
+        shards = max(1, -(-pool_size // ASYNC_SHARD_SIZE))
+        per_shard = max(1, -(-pool_size // shards))
+        limits = httpx.Limits(max_connections=per_shard, max_keepalive_connections=per_shard)
+        self.clients = [httpx.AsyncClient(limits=limits, **kwargs) for _ in range(shards)]
+        self._next = itertools.cycle(self.clients)
+
+    def next_client(self):
+        return next(self._next)
+
+    async def aclose(self):
+        for client in self.clients:
+            await client.aclose()
+
+
+class AsyncLLMClient:
+    """Non-blocking variant of LLMClient for the ASGI app (httpx.AsyncClient)"""
+
+    def __init__(self, url, api_key, pool_size=100, connect_timeout=3.05,
+                 read_timeout=60.0, max_retries=2, backoff_base=0.25,
+                 backoff_cap=4.0, breaker=None, on_usage=None):
+        import httpx
+
+        self.url = url
+        self.on_usage = on_usage
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker()
+        self._transport_error = httpx.TransportError
+        self._http_error = httpx.HTTPError
+        self._status_error = httpx.HTTPStatusError
+        self.pool = AsyncClientPool(
+            pool_size,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            },
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+
+    async def _send(self, payload, stream=False):
+        """POST with retries; returns a successful (possibly unread) response or raises"""
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("DeepSeek circuit breaker is open")
+
+        # Every exit reports an outcome, or a half-open probe would never end;
+        # a cancelled request (client gone) says nothing about the upstream
+        try:
+            response = await self._send_with_retries(payload, stream)
+        except self._status_error:
+            # Other 4xx errors are caller mistakes, not upstream degradation
+            self.breaker.record_success()
+            raise
+        except (self._http_error, UpstreamError):
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return response
+
+    async def _send_with_retries(self, payload, stream):
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                client = self.pool.next_client()
+                request = client.build_request('POST', self.url, json=payload)
+                response = await client.send(request, stream=stream)
+                if response.status_code not in RETRY_STATUSES:
+                    if response.is_error:
+                        await response.aclose()
+                        response.raise_for_status()
+                    return response
+
+                retry_after = response.headers.get('Retry-After')
+                last_error = UpstreamError(f"DeepSeek returned HTTP {response.status_code}")
+                await response.aclose()
+            except self._transport_error as e:
+                last_error = e
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap,
+                                                  retry_after))
+
+        raise last_error
+
+    async def complete(self, payload):
+        """Return the message content of a non-streaming completion"""
+        response = await self._send(payload)
+        data = response.json()
+        if self.on_usage and data.get('usage'):
+            self.on_usage(data['usage'])
+        return data['choices'][0]['message']['content']
+
+    async def stream(self, payload):
+        """Yield content deltas of a streaming completion"""
+        response = await self._send(stream_payload(payload), stream=True)
+        try:
+            async for line in response.aiter_lines():
+                if not line or not line.startswith('data:'):
+                    continue
+                chunk = line[len('data:'):].strip()
+                if chunk == '[DONE]':
+                    break
+                content = stream_delta(json.loads(chunk), self.on_usage)
+                if content:
+                    yield content
+        finally:
+            await response.aclose()
+
+    async def aclose(self):
+        await self.pool.aclose()
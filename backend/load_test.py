@@ -0,0 +1,151 @@
+"""
+Load test: sync Flask (gunicorn) vs async ASGI (uvicorn) serving modes
+Both servers talk to a local stand-in LLM (mock_deepseek.py) with a fixed
+generation latency and use the in-process index, so the only difference is
+how many chats a process can keep in flight while waiting on the LLM
+
+Usage:
+    python load_test.py --concurrency 200 --requests 1000 --llm-latency 1.0
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from llm_client import AsyncClientPool
+from mock_deepseek import start_mock_server
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+QUESTIONS = [
+    "How much water should I drink every day?",
+    "How much protein do I need per day?",
+    "What is a good beginner workout?",
+    "मुझे रोज कितना पानी पीना चाहिए?",
+    "व्यायाम केल्याने काय फायदे होतात?",
+]
+
+
+def server_command(mode, port, workers):
+    if mode == 'flask':
+        return [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+                '--log-level', 'warning', 'app:app']
+    return [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', '127.0.0.1',
+            '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+
+
+def wait_until_healthy(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = httpx.get(f"{url}/health", timeout=1.0)
+            # With the Supabase RPC the app serves while BM25 is still "warming"
+            if response.status_code == 200 and response.json()['status'] == 'healthy':
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not become healthy")
+
+
+async def drive(url, concurrency, total):
+    """Send `total` /chat requests with `concurrency` in flight; return latencies and errors"""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    pool = AsyncClientPool(concurrency, base_url=url, timeout=120.0)
+    try:
+        async def worker():
+            nonlocal errors
+            client = pool.next_client()
+            for i in counter:
+                # A unique suffix keeps the response cache out of the picture
+                message = f"{QUESTIONS[i % len(QUESTIONS)]} ({i})"
+                start = time.perf_counter()
+                try:
+                    response = await client.post('/chat', json={'message': message})
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        await pool.aclose()
+
+    return latencies, errors
+
+
+def run_mode(mode, args, llm_url):
+    port = args.port + (0 if mode == 'flask' else 1)
+    env = dict(os.environ,
+               DEEPSEEK_CHAT_URL=llm_url,
+               RETRIEVAL_BACKEND='local',
+               RESPONSE_CACHE_ENABLED='false')
+    # Placeholders so the apps start without real credentials (retrieval is local)
+    env.setdefault('DEEPSEEK_API_KEY', 'load-test')
+    env.setdefault('SUPABASE_URL', 'http://127.0.0.1:9')
+    env.setdefault('SUPABASE_KEY', 'load.test.key')
+    # One client driving full concurrency: no per-client limit or answer-slot cap
+    env.setdefault('RATE_LIMIT_PER_MINUTE', '0')
+    env.setdefault('LLM_MAX_IN_FLIGHT', '0')
+
+    server = subprocess.Popen(server_command(mode, port, args.workers), cwd=BACKEND_DIR, env=env)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        wait_until_healthy(url)
+        start = time.perf_counter()
+        latencies, errors = asyncio.run(drive(url, args.concurrency, args.requests))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    return {
+        'mode': mode,
+        'rps': len(latencies) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1],
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs async serving load test")
+    parser.add_argument('--mode', choices=['flask', 'asgi', 'both'], default='both')
+    parser.add_argument('--workers', type=int, default=2, help="server worker processes")
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--llm-latency', type=float, default=1.0, help="stand-in LLM seconds per call")
+    parser.add_argument('--port', type=int, default=5100)
+    args = parser.parse_args()
+
+    llm = start_mock_server(latency=args.llm_latency)
+    llm_url = f"http://127.0.0.1:{llm.server_address[1]}/v1/chat/completions"
+
+    print("=" * 60)
+    print(f"🏋️  Load test: {args.requests} requests, concurrency {args.concurrency}, "
+          f"{args.workers} workers, LLM latency {args.llm_latency}s")
+    print("=" * 60)
+
+    modes = ['flask', 'asgi'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        result = run_mode(mode, args, llm_url)
+        print(f"{result['mode']:>6}: {result['rps']:8.1f} req/s   "
+              f"p50 {result['p50'] * 1000:8.1f} ms   p95 {result['p95'] * 1000:8.1f} ms   "
+              f"errors {result['errors']}")
+
+    llm.shutdown()
+
+
+if __name__ == '__main__':
+    main()
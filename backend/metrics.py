@@ -0,0 +1,192 @@
+"""
+In-process metrics for the chat pipeline
+Counters and latency summaries (p50/p95/p99 over a sliding window of recent
+observations) rendered in the Prometheus text exposition format. Recording
+is a lock plus a couple of array writes, cheap enough for every request
+
+Metrics are per process: with several gunicorn workers each one reports
+its own numbers, so scrape every worker or add them up in Prometheus
+"""
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Stage timings of the request being served in this thread or task (None outside one)
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name + _format_labels(self.labels, key), value) for key, value in items]
+
+
+class Summary:
+    """Latency summary: total count/sum plus quantiles over the last `window` observations"""
+
+    kind = 'summary'
+
+    def __init__(self, name, help_text, labels=(), window=2048):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.window = window
+        # label values -> [ring buffer, next slot, count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [np.empty(self.window), 0, 0, 0.0]
+            series[0][series[1]] = value
+            series[1] = (series[1] + 1) % self.window
+            series[2] += 1
+            series[3] += value
+
+    def quantiles(self, **labels):
+        """{quantile: value} over the recent window (NaN before any observation)"""
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            recent = series[0][:min(series[2], self.window)].copy() if series else None
+        if recent is None or not len(recent):
+            return {q: float('nan') for q in QUANTILES}
+        return dict(zip(QUANTILES, np.quantile(recent, QUANTILES)))
+
+    def samples(self):
+        with self._lock:
+            keys = list(self._series)
+        lines = []
+        for key in keys:
+            labels = dict(zip(self.labels, key))
+            for q, value in self.quantiles(**labels).items():
+                lines.append((self.name + _format_labels(self.labels, key, {'quantile': q}), value))
+            with self._lock:
+                _, _, count, total = self._series[key]
+            lines.append((self.name + '_count' + _format_labels(self.labels, key), count))
+            lines.append((self.name + '_sum' + _format_labels(self.labels, key), total))
+        return lines
+
+
+class Registry:
+    """Named metrics plus callbacks for values owned elsewhere (e.g. cache stats)"""
+
+    def __init__(self):
+        self._metrics = []
+        self._callbacks = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def summary(self, name, help_text, labels=(), window=2048):
+        metric = Summary(name, help_text, labels, window)
+        self._metrics.append(metric)
+        return metric
+
+    def callback(self, name, help_text, kind, fn, label=None):
+        """Expose fn() at scrape time: a number, or {label value: number} when label is set"""
+        self._callbacks.append((name, help_text, kind, fn, label))
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name} {_format_value(value)}" for name, value in metric.samples())
+        for name, help_text, kind, fn, label_name in self._callbacks:
+            value = fn()
+            if value is None:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if label_name is not None:
+                lines.extend(f"{name}{_format_labels((label_name,), (label,))} {_format_value(v)}"
+                             for label, v in value.items())
+            else:
+                lines.append(f"{name} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def timer(summary, timings=None, **labels):
+    """Time a block on the monotonic clock into summary (and timings[label] if given)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        summary.observe(elapsed, **labels)
+        if timings is not None:
+            key = next(iter(labels.values()), summary.name)
+            timings[key] = timings.get(key, 0.0) + elapsed
+
+
+def begin_timings(timings=None):
+    """Collect this request's stage timings into timings (a new dict by default)
+
+    A context variable rather than Flask's or Quart's g, so the pipeline
+    stages shared by app.py and asgi_app.py record the same way under both
+    """
+    timings = {} if timings is None else timings
+    _request_timings.set(timings)
+    return timings
+
+
+def request_timings():
+    """Stage timings of the request being served here, or None"""
+    return _request_timings.get()
+
+
+def server_timing(timings):
+    """Server-Timing header value (durations in milliseconds)"""
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
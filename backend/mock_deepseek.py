@@ -0,0 +1,140 @@
+"""
+Local stand-in for the DeepSeek chat completions API
+Serves OpenAI-style responses (plain and streaming) with configurable
+latency and failure injection so the LLM client can be exercised offline
+
+Usage:
+    python mock_deepseek.py --port 8001 --latency 0.5 --fail-rate 0.1
+    DEEPSEEK_CHAT_URL=http://127.0.0.1:8001/v1/chat/completions python app.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "Stay hydrated, sleep well and keep moving every day."
+
+
+class MockDeepSeekHandler(BaseHTTPRequestHandler):
+    """Handles POST /v1/chat/completions"""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; avoid Nagle/delayed-ACK stalls
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    def do_POST(self):
+        config = self.server.config
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        with self.server.lock:
+            self.server.request_count += 1
+
+        time.sleep(config['latency'])
+
+        if random.random() < config['fail_rate']:
+            self._send_json(config['fail_status'], {"error": {"message": "injected failure"}},
+                            headers={'Retry-After': '0'})
+            return
+
+        words = config['reply'].split(' ')
+        # Rough token counts (~4 characters per token) for usage accounting
+        prompt_tokens = sum(len(m.get('content', '')) // 4 for m in payload.get('messages', []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words)
+        }
+        if payload.get('stream'):
+            include_usage = (payload.get('stream_options') or {}).get('include_usage')
+            self._send_stream(words, config['token_delay'], usage if include_usage else None)
+        else:
+            self._send_json(200, {
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": config['reply']}}],
+                "usage": usage
+            })
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, words, token_delay, usage=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        for idx, word in enumerate(words):
+            token = word if idx == len(words) - 1 else word + ' '
+            self._write_chunk(f"data: {json.dumps({'choices': [{'delta': {'content': token}}]})}\n\n")
+            time.sleep(token_delay)
+        if usage:
+            # Like OpenAI/DeepSeek with stream_options.include_usage: empty choices
+            self._write_chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+class MockServer(ThreadingHTTPServer):
+    """Threaded server with a listen backlog deep enough for load tests"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_mock_server(host='127.0.0.1', port=0, latency=0.0, token_delay=0.0,
+                      fail_rate=0.0, fail_status=503, reply=DEFAULT_REPLY):
+    """Start the mock server in a daemon thread; returns the server (see server_address)"""
+    server = MockServer((host, port), MockDeepSeekHandler)
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.config = {
+        'latency': latency,
+        'token_delay': token_delay,
+        'fail_rate': fail_rate,
+        'fail_status': fail_status,
+        'reply': reply
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock DeepSeek chat completions server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before responding")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument('--fail-status', type=int, default=503)
+    args = parser.parse_args()
+
+    server = start_mock_server(args.host, args.port, args.latency, args.token_delay,
+                               args.fail_rate, args.fail_status)
+    print(f"🧪 Mock DeepSeek running on http://{args.host}:{server.server_address[1]}/v1/chat/completions")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Local stand-in for the Supabase (PostgREST) endpoints used by the app
+Answers match_fitness_knowledge and match_fitness_knowledge_batch from an
+in-process index over health_data.json, and keyset-paged selects of the
+fitness_knowledge table (what BM25 and the refresher read), with
+configurable latency and failure injection, so retrieval can be exercised
+without a database
+
+Usage:
+    python mock_supabase.py --port 8002 --latency 0.02
+    SUPABASE_URL=http://127.0.0.1:8002 RETRIEVAL_BACKEND=supabase python app.py
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+
+from mock_deepseek import MockServer
+from vector_index import VectorIndex
+
+DEFAULT_DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health_data.json')
+
+
+class MockSupabaseHandler(BaseHTTPRequestHandler):
+    """Handles POST /rest/v1/rpc/<function> and GET /rest/v1/fitness_knowledge"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    def do_GET(self):
+        if self._inject_failure():
+            return
+        url = urlsplit(self.path)
+        if url.path.rsplit('/', 1)[-1] != 'fitness_knowledge':
+            self._send_json(404, {"message": f"relation {url.path} not found"})
+            return
+        # Only the filters select_pages() sends: select, id=gt.<id>, order=id, limit
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        rows = sorted(self.server.index.passages(), key=lambda row: row['id'])
+        if params.get('id', '').startswith('gt.'):
+            last_id = int(params['id'][3:])
+            rows = [row for row in rows if row['id'] > last_id]
+        if 'limit' in params:
+            rows = rows[:int(params['limit'])]
+        columns = [column.strip() for column in params.get('select', '*').split(',')]
+        if columns != ['*']:
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        self._send_json(200, rows)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self._inject_failure():
+            return
+
+        index = self.server.index
+        function = self.path.rsplit('/', 1)[-1]
+        if function == 'match_fitness_knowledge':
+            rows = index.search(payload['query_embedding'], payload.get('match_threshold', 0.5),
+                                payload.get('match_count', 3))
+        elif function == 'match_fitness_knowledge_batch':
+            rows = [dict(row, query_index=i)
+                    for i, hits in enumerate(index.search_many(payload['query_embeddings'],
+                                                               payload.get('match_threshold', 0.5),
+                                                               payload.get('match_count', 3)))
+                    for row in hits]
+        else:
+            self._send_json(404, {"message": f"function {function} not found"})
+            return
+        self._send_json(200, rows)
+
+    def _inject_failure(self):
+        """Count the request, wait the configured latency and maybe fail it; True when it failed"""
+        config = self.server.config
+        with self.server.lock:
+            self.server.request_count += 1
+
+        time.sleep(config['latency'])
+
+        if random.random() < config['fail_rate']:
+            self._send_json(config['fail_status'], {"message": "injected failure"})
+            return True
+        return False
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_mock_supabase(host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0, fail_status=503,
+                        data_file=DEFAULT_DATA_FILE):
+    """Start the mock server in a daemon thread; returns the server (see server_address)"""
+    server = MockServer((host, port), MockSupabaseHandler)
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.index = VectorIndex.from_json(data_file)
+    server.config = {
+        'latency': latency,
+        'fail_rate': fail_rate,
+        'fail_status': fail_status
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Supabase RPC server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8002)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before responding")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument('--fail-status', type=int, default=503)
+    parser.add_argument('--data', default=DEFAULT_DATA_FILE, help="knowledge base JSON file")
+    args = parser.parse_args()
+
+    server = start_mock_supabase(args.host, args.port, args.latency, args.fail_rate,
+                                 args.fail_status, args.data)
+    print(f"🧪 Mock Supabase running on http://{args.host}:{server.server_address[1]} "
+          f"({len(server.index)} passages)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+Replay captured /chat traffic through the pipeline against local stand-ins
+Reads request logs written with REQUEST_LOG_DIR (rotated .jsonl.gz files, or
+directories of them), starts the Flask app under gunicorn against
+mock_deepseek.py and mock_supabase.py as benchmark.py does, and sends the
+recorded questions again in their recorded order. The turns of one
+conversation are sent one after another with the same session, so
+follow-up questions are answered with their history as before
+
+Reports latency percentiles and a per-stage breakdown next to the recorded
+ones, and how often the topic gate and retrieval still agree with the
+capture (the replaying server captures every request it answers). With
+--profile every Nth request is profiled per stage, and the hottest
+functions of each stage are added up over all of those profiles
+
+Usage:
+    python replay.py captures/ --concurrency 8 --output replay.json
+    python replay.py captures/requests-*.jsonl.gz --speed 1 --profile cprofile --profile-every 20
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import pstats
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmark import git_revision, parse_server_timing, summarize
+from llm_client import AsyncClientPool
+from load_test import BACKEND_DIR, wait_until_healthy
+from mock_deepseek import start_mock_server
+from mock_supabase import start_mock_supabase
+from request_log import log_files, read_records
+
+
+def load_conversations(paths, limit=None):
+    """Captured records grouped by conversation, each in recorded order, earliest first"""
+    records = [record for record in read_records(log_files(paths)) if record.get('query')]
+    records.sort(key=lambda record: record['ts'])
+    if limit:
+        records = records[:limit]
+
+    conversations = defaultdict(list)
+    for position, record in enumerate(records):
+        # Records without a session tag (session memory off) stand alone
+        conversations[record.get('session') or f'#{position}'].append(record)
+    return sorted(conversations.values(), key=lambda turns: turns[0]['ts']), len(records)
+
+
+async def drive(url, conversations, concurrency, speed, profile=None, profile_every=0, admin_token=None):
+    """Send every captured question to /chat; returns one result per request
+
+    speed 0 sends as fast as `concurrency` allows; otherwise questions are
+    sent at their recorded times, compressed by `speed`
+    """
+    results = []
+    slots = asyncio.Semaphore(concurrency)
+    counter = iter(range(sys.maxsize))
+    first_ts = conversations[0][0]['ts'] if conversations else 0
+    start = time.perf_counter()
+
+    pool = AsyncClientPool(min(concurrency, 50), base_url=url, timeout=120.0)
+    try:
+        async def replay(turns):
+            client = pool.next_client()
+            session_id = None
+            for record in turns:
+                if speed:
+                    delay = (record['ts'] - first_ts) / speed - (time.perf_counter() - start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                body = {'message': record['query'], 'language': record.get('language')}
+                if session_id:
+                    body['session_id'] = session_id
+                headers = {}
+                if profile and profile_every and next(counter) % profile_every == 0:
+                    headers = {'X-Profile': profile, 'X-Admin-Token': admin_token}
+
+                result = {'query': record['query'], 'recorded': record}
+                async with slots:
+                    sent = time.perf_counter()
+                    try:
+                        response = await client.post('/chat', json=body, headers=headers)
+                    except httpx.HTTPError as e:
+                        result.update(seconds=time.perf_counter() - sent, error=type(e).__name__)
+                        results.append(result)
+                        continue
+                    result['seconds'] = time.perf_counter() - sent
+
+                result['status'] = response.status_code
+                result['stages'] = parse_server_timing(response.headers.get('Server-Timing'))
+                if response.status_code == 200:
+                    session_id = response.json().get('session_id') or session_id
+                else:
+                    result['error'] = f'http_{response.status_code}'
+                results.append(result)
+
+        await asyncio.gather(*(replay(turns) for turns in conversations))
+    finally:
+        await pool.aclose()
+
+    return results, time.perf_counter() - start
+
+
+def stage_summaries(stage_lists):
+    return {name: summarize(values) for name, values in sorted(stage_lists.items())}
+
+
+def agreement(results, replayed):
+    """How often the replayed gate decisions and retrieved ids match the captured ones"""
+    by_query = defaultdict(list)
+    for record in replayed:
+        if record.get('query'):
+            by_query[record['query']].append(record)
+
+    gate = Counter()
+    retrieval = Counter()
+    overlap = []
+    for result in results:
+        matches = by_query.get(result['query'])
+        if not matches:
+            continue
+        new, old = matches.pop(0), result['recorded']
+        if 'gate' in old and 'gate' in new:
+            gate['same' if old['gate']['related'] == new['gate']['related'] else 'changed'] += 1
+        if 'retrieved' in old and 'retrieved' in new:
+            before, after = set(old['retrieved']), set(new['retrieved'])
+            retrieval['same' if old['retrieved'] == new['retrieved'] else 'changed'] += 1
+            overlap.append(len(before & after) / len(before | after) if before | after else 1.0)
+
+    return {
+        'gate': dict(gate),
+        'retrieval': dict(retrieval),
+        # Mean Jaccard overlap of the retrieved ids
+        'retrieval_overlap': round(sum(overlap) / len(overlap), 4) if overlap else None
+    }
+
+
+def profile_report(directory, top):
+    """Print the hottest functions per stage over every profile in directory"""
+    by_stage = defaultdict(list)
+    for path in glob.glob(os.path.join(directory, '*', '*.prof')):
+        by_stage[os.path.splitext(os.path.basename(path))[0]].append(path)
+    for name, paths in sorted(by_stage.items()):
+        print(f"\n--- {name}: {len(paths)} profiled requests (cumulative time) ---")
+        pstats.Stats(*paths).strip_dirs().sort_stats('cumulative').print_stats(top)
+
+    stacks = Counter()
+    for path in glob.glob(os.path.join(directory, '*', 'stacks.collapsed')):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                stacks[stack] += int(count)
+    if stacks:
+        merged = os.path.join(directory, 'stacks.collapsed')
+        with open(merged, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        # Samples per stage and innermost function
+        leaves = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            leaves[(frames[0], frames[-1])] += count
+        total = sum(stacks.values())
+        print(f"\n--- {total} samples, merged into {merged} ---")
+        for (stage, frame), count in leaves.most_common(top):
+            print(f"  {count / total:6.1%}  {stage:<10} {frame}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured /chat traffic against local stand-ins")
+    parser.add_argument('paths', nargs='+', help="request log files or directories (REQUEST_LOG_DIR)")
+    parser.add_argument('--limit', type=int, help="replay only the first N captured requests")
+    parser.add_argument('--concurrency', type=int, default=8, help="requests in flight at most")
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help="0: as fast as possible; 1: recorded pacing; 2: twice as fast")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument('--threads', type=int, default=16, help="threads per gunicorn worker")
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="stand-in LLM seconds per call")
+    parser.add_argument('--db-latency', type=float, default=0.01, help="stand-in RPC seconds per call")
+    parser.add_argument('--retrieval', choices=['supabase', 'local'], default='supabase',
+                        help="RETRIEVAL_BACKEND for the app")
+    parser.add_argument('--no-cache', action='store_true', help="disable the response cache")
+    parser.add_argument('--profile', choices=['cprofile', 'sample'], help="profile requests per stage")
+    parser.add_argument('--profile-every', type=int, default=50, help="profile every Nth request")
+    parser.add_argument('--profile-dir', default='replay_profiles',
+                        help="request profiles go to a new directory in here per run")
+    parser.add_argument('--top', type=int, default=15, help="functions listed per stage")
+    parser.add_argument('--port', type=int, default=5300)
+    parser.add_argument('--output', help="write results to this JSON file")
+    args = parser.parse_args()
+
+    conversations, total = load_conversations(args.paths, args.limit)
+    if not total:
+        sys.exit("No captured requests found")
+
+    llm = start_mock_server(latency=args.llm_latency)
+    db = start_mock_supabase(latency=args.db_latency)
+    capture_dir = tempfile.mkdtemp(prefix='replay-capture-')
+    # One directory per run, so the report only adds up this run's profiles
+    profile_dir = os.path.join(os.path.abspath(args.profile_dir), time.strftime('%Y%m%dT%H%M%S'))
+    admin_token = secrets.token_hex(16)
+
+    env = dict(os.environ,
+               DEEPSEEK_CHAT_URL=f"http://127.0.0.1:{llm.server_address[1]}/v1/chat/completions",
+               DEEPSEEK_API_KEY='replay',
+               SUPABASE_URL=f"http://127.0.0.1:{db.server_address[1]}",
+               SUPABASE_KEY='replay.key.placeholder',
+               RETRIEVAL_BACKEND=args.retrieval,
+               RESPONSE_CACHE_ENABLED='false' if args.no_cache else 'true',
+               SERVER_TIMING='true',
+               REQUEST_LOG_DIR=capture_dir,
+               REQUEST_LOG_SAMPLE_RATE='1',
+               PROFILE_DIR=profile_dir,
+               ADMIN_TOKEN=admin_token,
+               RATE_LIMIT_PER_MINUTE='0')
+    command = [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '--threads', str(args.threads),
+               '-b', f'127.0.0.1:{args.port}', '--log-level', 'warning', 'app:app']
+
+    print("=" * 60)
+    print(f"🔁 Replay: {total} requests in {len(conversations)} conversations, "
+          f"concurrency {args.concurrency}, speed {args.speed or 'max'}")
+    print("=" * 60)
+
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+    try:
+        url = f"http://127.0.0.1:{args.port}"
+        wait_until_healthy(url)
+        results, elapsed = asyncio.run(drive(url, conversations, args.concurrency, args.speed,
+                                             args.profile, args.profile_every, admin_token))
+    finally:
+        # Workers close their request logs on a graceful shutdown
+        server.terminate()
+        server.wait()
+        llm.shutdown()
+        db.shutdown()
+
+    errors = Counter(result['error'] for result in results if 'error' in result)
+    recorded_stages = defaultdict(list)
+    replayed_stages = defaultdict(list)
+    for result in results:
+        for name, seconds in result['recorded'].get('stages', {}).items():
+            recorded_stages[name].append(seconds)
+        for name, seconds in result.get('stages', {}).items():
+            replayed_stages[name].append(seconds)
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'port')},
+        'requests': len(results),
+        'seconds': round(elapsed, 3),
+        'rps': round(len(results) / elapsed, 2),
+        'error_rate': round(sum(errors.values()) / max(len(results), 1), 4),
+        'errors': dict(errors),
+        'latency_ms': summarize([result['seconds'] for result in results]),
+        'recorded_latency_ms': summarize([result['recorded']['seconds'] for result in results
+                                          if 'seconds' in result['recorded']]),
+        'stages_ms': stage_summaries(replayed_stages),
+        'recorded_stages_ms': stage_summaries(recorded_stages),
+        'agreement': agreement(results, list(read_records(log_files([capture_dir]))))
+    }
+
+    latency = report['latency_ms'] or {}
+    recorded = report['recorded_latency_ms'] or {}
+    print(f"{report['rps']:.1f} req/s   p50 {latency.get('p50', 0):.1f} ms   "
+          f"p95 {latency.get('p95', 0):.1f} ms   errors {report['error_rate']:.1%}")
+    print(f"recorded        p50 {recorded.get('p50', 0):.1f} ms   p95 {recorded.get('p95', 0):.1f} ms")
+    print("stage p50 (ms), replayed / recorded:")
+    for name, summary in report['stages_ms'].items():
+        before = report['recorded_stages_ms'].get(name)
+        print(f"  {name:<15} {summary['p50']:8.2f} / {before['p50']:.2f}" if before
+              else f"  {name:<15} {summary['p50']:8.2f} / -")
+    print(f"agreement: {json.dumps(report['agreement'])}")
+
+    if args.profile:
+        profile_report(profile_dir, args.top)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
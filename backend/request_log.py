@@ -0,0 +1,397 @@
+"""
+Request capture and per-request profiling for the chat pipeline
+A sampled share of /chat traffic is recorded as one JSON line per request
+(question, detected language, topic gate result, retrieved passage ids,
+stage timings) into rotating gzip files, to be fed back through the
+pipeline offline with replay.py. Records go through a bounded queue to a
+writer thread, so a request only pays for building a small dict; when the
+writer falls behind, records are dropped and counted instead of waiting
+
+A single request can also be profiled per stage, with cProfile (one .prof
+file per stage) or a sampling profiler (collapsed stacks for flame graphs).
+One request is profiled at a time per process: cProfile cannot run twice at
+once, and on an event loop it sees every task, not only the profiled one.
+A profile whose response is never closed is stopped after max_seconds and
+its slot handed to the next request
+"""
+
+import atexit
+import contextvars
+import cProfile
+import glob
+import gzip
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_MODES = ('cprofile', 'sample')
+
+# Capture of the request being served in this thread or task (None when it is not captured)
+_current = contextvars.ContextVar('request_capture', default=None)
+
+# Profiler of the request being profiled (None when there is none), guarded by _profiling
+_profiling = threading.Lock()
+_active = None
+
+
+def current_capture():
+    return _current.get()
+
+
+def note(**fields):
+    """Add fields to the captured record of the current request (no-op when not captured)"""
+    capture = _current.get()
+    if capture is not None:
+        capture.record.update(fields)
+
+
+class Capture:
+    """Record, stage timings and optional profiler of one captured request"""
+
+    def __init__(self, endpoint, profiler=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.record = {'ts': round(time.time(), 3), 'endpoint': endpoint}
+        self.timings = {}
+        self.profiler = profiler
+        # Streaming responses are finished when their body is closed, not after_request
+        self.deferred = False
+        self.finished = False
+        self._start = time.perf_counter()
+
+    @classmethod
+    def begin(cls, endpoint, profiler=None):
+        """Make a new capture current for this request"""
+        capture = cls(endpoint, profiler)
+        _current.set(capture)
+        return capture
+
+    @staticmethod
+    def skip():
+        """Mark this request as not captured (threads are reused across requests)"""
+        _current.set(None)
+
+    def stage(self, name, block):
+        """Run a stage's timing block inside this request's profiler section"""
+        if self.profiler is None:
+            return block
+        return _nested(self.profiler.section(name), block)
+
+    def finish(self, status):
+        """Close the capture; returns the finished record, or None when it was already finished"""
+        _current.set(None)
+        if self.finished:
+            return None
+        self.finished = True
+        self.record['status'] = status
+        self.record['seconds'] = round(time.perf_counter() - self._start, 6)
+        self.record['stages'] = {name: round(seconds, 6) for name, seconds in self.timings.items()}
+        if self.profiler is not None:
+            self.record['profile'] = self.id
+        return self.record
+
+
+@contextmanager
+def _nested(outer, inner):
+    with outer, inner:
+        yield
+
+
+class CProfileSections:
+    """One cProfile.Profile per stage; a nested stage pauses the enclosing one"""
+
+    mode = 'cprofile'
+
+    def __init__(self):
+        self.opened = time.monotonic()
+        self.profiles = {}
+        self._stack = []
+
+    @contextmanager
+    def section(self, name):
+        outer = self._stack[-1] if self._stack else None
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        if outer is not None:
+            outer.disable()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active (e.g. a debugger); leave this stage out
+            profile = None
+        self._stack.append(profile)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            if profile is not None:
+                profile.disable()
+            if outer is not None:
+                outer.enable()
+
+    def save(self, directory):
+        """Write <stage>.prof files (pstats format); returns the paths"""
+        paths = []
+        for name, profile in self.profiles.items():
+            path = os.path.join(directory, f"{name}.prof")
+            profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def close(self):
+        pass
+
+
+class SamplingSections:
+    """Samples the request's thread every `interval` seconds into per-stage collapsed stacks
+
+    Sampling stops by itself after max_seconds, should the request never close it
+    """
+
+    mode = 'sample'
+
+    def __init__(self, interval=0.001, max_seconds=120.0):
+        self.opened = time.monotonic()
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.samples = Counter()
+        self._thread_id = threading.get_ident()
+        self._stack = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+        self._thread.start()
+
+    @contextmanager
+    def section(self, name):
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if time.monotonic() - self.opened > self.max_seconds:
+                break
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stage = self._stack[-1] if self._stack else 'request'
+            self.samples[';'.join([stage] + stack[::-1])] += 1
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, directory):
+        """Write stacks.collapsed (flamegraph.pl / speedscope input); returns the paths"""
+        path = os.path.join(directory, 'stacks.collapsed')
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return [path]
+
+
+def open_profiler(mode, sample_interval=0.001, max_seconds=120.0):
+    """A profiler for one request, or None for an unknown mode or while another request is profiled
+
+    A profiler open for longer than max_seconds belongs to a response that
+    was never closed; it is stopped and replaced
+    """
+    global _active
+    if mode not in PROFILE_MODES:
+        return None
+    with _profiling:
+        if _active is not None:
+            if time.monotonic() - _active.opened < max_seconds:
+                return None
+            _active.close()
+        _active = SamplingSections(sample_interval, max_seconds) if mode == 'sample' else CProfileSections()
+        return _active
+
+
+def save_profile(profiler, directory):
+    """Stop the profiler, write its output to directory and let the next request be profiled
+
+    Returns the written paths ([] for a profiler already replaced as stale)
+    """
+    global _active
+    with _profiling:
+        if _active is not profiler:
+            return []
+    try:
+        profiler.close()
+        os.makedirs(directory, exist_ok=True)
+        return profiler.save(directory)
+    finally:
+        with _profiling:
+            if _active is profiler:
+                _active = None
+
+
+class RequestLog:
+    """Sampled request records written to rotating gzip JSON Lines files by a background thread
+
+    Each process writes its own files (the pid is in the name), so several
+    workers can share a directory. `backups` caps the files each process
+    keeps, counting those left by exited processes; the files of another
+    running process (one may still be open) are never removed
+    """
+
+    def __init__(self, directory, sample_rate=0.1, rotate_bytes=16 * 1024 * 1024, backups=20,
+                 queue_size=10000, flush_interval=5.0):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        # Uncompressed bytes per file before a new one is started
+        self.rotate_bytes = rotate_bytes
+        self.backups = backups
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._file = None
+        self._size = 0
+        self._sequence = 0
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.close)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='request-log', daemon=True)
+        self._thread.start()
+        return self
+
+    def restart(self):
+        """start() in a forked child: the parent's queue, thread and open file are not shared"""
+        self._queue = queue.Queue(self.queue_size)
+        self._file = None
+        self._size = 0
+        self._sequence = 0
+        return self.start()
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def write(self, record):
+        """Queue a record for the writer; dropped (and counted) when the queue is full"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5.0):
+        """Write what is queued and close the current file (the gzip trailer makes it complete)"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped}
+
+    def _run(self):
+        while True:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # A sync flush makes everything written so far readable while the file is open
+                if self._file is not None:
+                    self._file.flush()
+                continue
+            if record is None:
+                break
+            try:
+                self._append(record)
+            except Exception as e:
+                print(f"Error writing request log: {e}")
+                self.dropped += 1
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _append(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+        line = line.encode('utf-8')
+        if self._file is None or (self._size and self._size + len(line) > self.rotate_bytes):
+            self._rotate()
+        self._file.write(line)
+        self._size += len(line)
+        self.written += 1
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        self._sequence += 1
+        name = f"requests-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._sequence:04d}.jsonl.gz"
+        self._file = gzip.open(os.path.join(self.directory, name), 'wb', compresslevel=6)
+        self._size = 0
+        # This process's and exited processes' files, oldest first (names start with their creation time)
+        files = sorted((path for path in glob.glob(os.path.join(self.directory, 'requests-*.jsonl.gz'))
+                        if not _written_by_other_process(path)), key=os.path.basename)
+        for path in files[:max(len(files) - self.backups, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _written_by_other_process(path):
+    """Whether a log file belongs to another process that is still running"""
+    try:
+        pid = int(os.path.basename(path).split('-')[2])
+    except (IndexError, ValueError):
+        return False
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists, owned by another user
+        return True
+    return True
+
+
+def read_records(paths):
+    """Yield the records of captured files (.jsonl.gz or .jsonl) in order
+
+    Files still being written end without a gzip trailer and may end with a
+    partial line; everything before that is returned
+    """
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+            except EOFError:
+                continue
+
+
+def log_files(paths):
+    """Expand directories and globs into captured files, oldest first"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, 'requests-*.jsonl*')))
+        else:
+            files.extend(glob.glob(path) or [path])
+    return sorted(files, key=os.path.basename)
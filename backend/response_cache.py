@@ -0,0 +1,149 @@
+"""
+Two-tier response cache for /chat
+Exact tier: normalized query text + language, LRU with TTL and a byte cap
+Near-duplicate tier: cosine similarity of the query embedding against
+recently answered queries, resolved back to an exact-tier entry
+"""
+
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from embeddings import EMBEDDING_DIM
+
+_WHITESPACE = re.compile(r'\s+')
+# Trailing punctuation (including the Devanagari danda) does not change the question
+_TRAILING_PUNCTUATION = re.compile(r'[\s?!.,;:।॥]+$')
+
+
+def normalize_query(text):
+    """Canonical form used for exact-tier keys"""
+    text = unicodedata.normalize('NFC', text).casefold()
+    text = _WHITESPACE.sub(' ', text).strip()
+    return _TRAILING_PUNCTUATION.sub('', text)
+
+
+class ResponseCache:
+    """Thread-safe LRU/TTL response cache with exact and near-duplicate lookup"""
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=3600.0,
+                 similarity_threshold=0.99, max_recent=512):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+
+        # key -> (value, expires_at, size_in_bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        # Ring buffer of recent query embeddings (unit length) and their keys
+        self._recent = np.zeros((max_recent, EMBEDDING_DIM), dtype=np.float32)
+        self._recent_keys = [None] * max_recent
+        self._recent_pos = 0
+
+        self._lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_near = 0
+        self.misses = 0
+
+    def get(self, query, language, query_embedding=None):
+        """Return a cached value for the query or None"""
+        key = (normalize_query(query), language)
+        now = time.monotonic()
+
+        with self._lock:
+            value = self._lookup(key, now)
+            if value is not None:
+                self.hits_exact += 1
+                return value
+
+            if query_embedding is not None and self.similarity_threshold < 1.0:
+                near_key = self._nearest_key(query_embedding, language)
+                value = self._lookup(near_key, now) if near_key else None
+                if value is not None:
+                    self.hits_near += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, query, language, value, query_embedding=None):
+        """Cache a value (JSON-serializable) for the query"""
+        key = (normalize_query(query), language)
+        size = len(json.dumps(value, ensure_ascii=False).encode()) + len(key[0].encode())
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, size)
+            self._bytes += size
+
+            # Evict least recently used entries until we fit the byte cap
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+            if query_embedding is not None:
+                self._remember(key, query_embedding)
+
+    def invalidate(self):
+        """Drop every entry (e.g. after the knowledge base is reloaded)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._recent_keys = [None] * len(self._recent_keys)
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits_exact": self.hits_exact,
+                "hits_near": self.hits_near,
+                "misses": self.misses
+            }
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _remember(self, key, query_embedding):
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return
+        self._recent[self._recent_pos] = vector / norm
+        self._recent_keys[self._recent_pos] = key
+        self._recent_pos = (self._recent_pos + 1) % len(self._recent_keys)
+
+    def _nearest_key(self, query_embedding, language):
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+
+        similarities = self._recent @ (vector / norm)
+        for idx in np.argsort(-similarities):
+            if similarities[idx] < self.similarity_threshold:
+                return None
+            key = self._recent_keys[idx]
+            if key is not None and key[1] == language:
+                return key
+        return None
@@ -0,0 +1,178 @@
+"""
+Server-side conversation memory for /chat
+Each session keeps a small ring buffer of recent turns. Turns that fall out
+of the buffer are folded into a short extractive summary (the questions the
+user asked), and the history sent to DeepSeek is cut to a fixed token
+budget, so follow-ups keep their context while prompt size stays bounded
+however long the conversation runs. Sessions are evicted least recently
+used under a session count and byte cap, and expire after a TTL
+"""
+
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+from chunking import estimate_tokens, split_sentences
+
+# Client-supplied session ids are opaque tokens; anything else gets a new id
+_SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{8,128}$')
+
+# Fixed per-session bookkeeping, on top of the stored text
+_SESSION_OVERHEAD = 512
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Leading whole sentences of text within max_tokens (at least a cut of the first one)"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept = []
+    used = 0
+    for sentence in split_sentences(text):
+        cost = estimate_tokens(sentence)
+        if used + cost > max_tokens:
+            break
+        kept.append(sentence)
+        used += cost
+    if kept:
+        return ' '.join(kept)
+    # One very long sentence: cut by the same ratio the estimate uses
+    return text[:max(1, len(text) * max_tokens // estimate_tokens(text))]
+
+
+class Session:
+    """Recent turns as (user, assistant, tokens) plus a summary of older questions"""
+
+    __slots__ = ('turns', 'summary', 'expires_at', 'size')
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.summary = deque()
+        self.expires_at = 0.0
+        self.size = _SESSION_OVERHEAD
+
+
+class SessionStore:
+    """Thread-safe LRU/TTL store of conversation sessions"""
+
+    def __init__(self, max_sessions=10000, max_bytes=32 * 1024 * 1024, ttl=3600.0,
+                 max_turns=6, token_budget=600, turn_tokens=250, summary_tokens=120):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_turns = max_turns
+        # Prompt tokens allowed for history (recent turns + summary) per request
+        self.token_budget = token_budget
+        # Longest answer kept per turn; long answers are cut to their first sentences
+        self.turn_tokens = turn_tokens
+        self.summary_tokens = summary_tokens
+
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(16)
+
+    @staticmethod
+    def valid_id(session_id):
+        return isinstance(session_id, str) and bool(_SESSION_ID.match(session_id))
+
+    def history(self, session_id):
+        """Chat messages (oldest first) for the session that fit the token budget"""
+        with self._lock:
+            session = self._lookup(session_id, time.monotonic())
+            if session is None:
+                return []
+            turns = list(session.turns)
+            summary = list(session.summary)
+
+        budget = self.token_budget
+        messages = []
+        dropped = []
+        for i in range(len(turns) - 1, -1, -1):
+            user, assistant, tokens = turns[i]
+            if tokens > budget:
+                # Older turns that do not fit are summarized like evicted ones
+                dropped = [turn[0] for turn in turns[:i + 1]]
+                break
+            messages[:0] = [{"role": "user", "content": user},
+                            {"role": "assistant", "content": assistant}]
+            budget -= tokens
+
+        # Keep the most recent questions: drop the oldest until the note fits
+        questions = summary + [truncate_to_tokens(question, 40) for question in dropped]
+        while questions:
+            note = "Earlier in this conversation the user asked:\n" + "\n".join(
+                f"- {question}" for question in questions)
+            if estimate_tokens(note) <= budget:
+                messages.insert(0, {"role": "system", "content": note})
+                break
+            questions.pop(0)
+        return messages
+
+    def record(self, session_id, user_message, assistant_message):
+        """Append a completed turn; the oldest turn moves into the summary when the buffer is full"""
+        assistant_message = truncate_to_tokens(assistant_message, self.turn_tokens)
+        tokens = estimate_tokens(user_message) + estimate_tokens(assistant_message)
+        now = time.monotonic()
+
+        with self._lock:
+            session = self._lookup(session_id, now)
+            if session is None:
+                session = self._sessions[session_id] = Session(self.max_turns)
+                self._bytes += session.size
+
+            if len(session.turns) == self.max_turns:
+                old_user, old_assistant, _ = session.turns.popleft()
+                self._resize(session, -self._turn_size(old_user, old_assistant))
+                question = truncate_to_tokens(old_user, 40)
+                session.summary.append(question)
+                self._resize(session, len(question.encode()))
+                # Keep only the most recent questions within the summary budget
+                while len(session.summary) > 1 and \
+                        sum(estimate_tokens(q) for q in session.summary) > self.summary_tokens:
+                    self._resize(session, -len(session.summary.popleft().encode()))
+
+            session.turns.append((user_message, assistant_message, tokens))
+            self._resize(session, self._turn_size(user_message, assistant_message))
+            session.expires_at = now + self.ttl
+
+            # Evict least recently used sessions until both caps hold
+            while len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes:
+                oldest = next(iter(self._sessions))
+                if oldest == session_id and len(self._sessions) == 1:
+                    break
+                self._remove(oldest)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "bytes": self._bytes,
+                    "evictions": self.evictions}
+
+    def _lookup(self, session_id, now):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if session.expires_at < now:
+            self._remove(session_id)
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.size
+
+    def _resize(self, session, delta):
+        session.size += delta
+        self._bytes += delta
+
+    @staticmethod
+    def _turn_size(user, assistant):
+        return len(user.encode()) + len(assistant.encode())
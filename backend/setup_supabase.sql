@@ -12,10 +12,22 @@ CREATE TABLE IF NOT EXISTS fitness_knowledge (
     id BIGSERIAL PRIMARY KEY,
     title TEXT NOT NULL,
     content TEXT NOT NULL,
+    content_hash TEXT,
+    parent_id TEXT,
+    chunk_index INT NOT NULL DEFAULT 0,
     embedding vector(1536),
     created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW())
 );
 
+-- SHA-256 of title + content, used by incremental sync (data_loader.py --sync)
+-- Also run on tables created before this column existed
+ALTER TABLE fitness_knowledge ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- Long documents are stored as overlapping passages: parent_id groups the
+-- passages of one document and chunk_index orders them
+ALTER TABLE fitness_knowledge ADD COLUMN IF NOT EXISTS parent_id TEXT;
+ALTER TABLE fitness_knowledge ADD COLUMN IF NOT EXISTS chunk_index INT NOT NULL DEFAULT 0;
+
 -- Step 3: Create index for faster similarity search
 -- This uses IVFFlat algorithm for approximate nearest neighbor search
 CREATE INDEX IF NOT EXISTS fitness_knowledge_embedding_idx 
@@ -24,7 +36,9 @@ USING ivfflat (embedding vector_cosine_ops)
 WITH (lists = 100);
 
 -- Step 4: Create function for similarity search
--- This function returns the most similar documents based on cosine similarity
+-- This function returns the most similar passages based on cosine similarity
+-- (dropped first because its return columns changed when chunking was added)
+DROP FUNCTION IF EXISTS match_fitness_knowledge(vector, float, int);
 CREATE OR REPLACE FUNCTION match_fitness_knowledge(
     query_embedding vector(1536),
     match_threshold float DEFAULT 0.5,
@@ -34,6 +48,8 @@ RETURNS TABLE (
     id bigint,
     title text,
     content text,
+    parent_id text,
+    chunk_index int,
     similarity float
 )
 LANGUAGE sql STABLE
@@ -42,6 +58,8 @@ AS $$
         fitness_knowledge.id,
         fitness_knowledge.title,
         fitness_knowledge.content,
+        fitness_knowledge.parent_id,
+        fitness_knowledge.chunk_index,
         1 - (fitness_knowledge.embedding <=> query_embedding) AS similarity
     FROM fitness_knowledge
     WHERE 1 - (fitness_knowledge.embedding <=> query_embedding) > match_threshold
@@ -49,6 +67,47 @@ AS $$
     LIMIT match_count;
 $$;
 
+-- Step 4b: Batched similarity search used by /chat/batch
+-- query_embeddings is a JSON array of embeddings; rows are tagged with the
+-- position of the query they answer
+CREATE OR REPLACE FUNCTION match_fitness_knowledge_batch(
+    query_embeddings jsonb,
+    match_threshold float DEFAULT 0.5,
+    match_count int DEFAULT 3
+)
+RETURNS TABLE (
+    query_index int,
+    id bigint,
+    title text,
+    content text,
+    parent_id text,
+    chunk_index int,
+    similarity float
+)
+LANGUAGE sql STABLE
+AS $$
+    WITH queries AS (
+        SELECT (q.idx - 1)::int AS query_index, (q.embedding::text)::vector(1536) AS embedding
+        FROM jsonb_array_elements(query_embeddings) WITH ORDINALITY AS q(embedding, idx)
+    )
+    SELECT queries.query_index, matches.*
+    FROM queries
+    CROSS JOIN LATERAL (
+        SELECT
+            fitness_knowledge.id,
+            fitness_knowledge.title,
+            fitness_knowledge.content,
+            fitness_knowledge.parent_id,
+            fitness_knowledge.chunk_index,
+            1 - (fitness_knowledge.embedding <=> queries.embedding) AS similarity
+        FROM fitness_knowledge
+        WHERE 1 - (fitness_knowledge.embedding <=> queries.embedding) > match_threshold
+        ORDER BY fitness_knowledge.embedding <=> queries.embedding
+        LIMIT match_count
+    ) AS matches
+    ORDER BY queries.query_index, matches.similarity DESC;
+$$;
+
 -- Step 5: Verify setup
 -- Run this to check if everything is set up correctly
 SELECT 
@@ -68,6 +127,12 @@ SELECT
     'match_fitness_knowledge function' as component,
     CASE WHEN EXISTS (
         SELECT 1 FROM pg_proc WHERE proname = 'match_fitness_knowledge'
+    ) THEN '✅ Created' ELSE '❌ Not created' END as status
+UNION ALL
+SELECT 
+    'match_fitness_knowledge_batch function' as component,
+    CASE WHEN EXISTS (
+        SELECT 1 FROM pg_proc WHERE proname = 'match_fitness_knowledge_batch'
     ) THEN '✅ Created' ELSE '❌ Not created' END as status;
 
 -- ============================================
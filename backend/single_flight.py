@@ -0,0 +1,243 @@
+"""
+Request coalescing (single-flight) for identical concurrent questions
+When many users ask the same question at once, only the first request runs
+the pipeline; the others wait for that computation and share its result
+(or its exception). Nothing is stored once the computation finishes, so
+coalescing never serves a stale answer; the response cache does that job
+
+Streams are shared the same way: the answer is generated once in the
+background and every waiting request replays its tokens as they arrive.
+The background producer runs in a copy of the first request's context, so
+its stage timings and request capture follow it there
+"""
+
+import asyncio
+import contextvars
+import threading
+from contextlib import nullcontext
+
+
+class Broadcast:
+    """Items produced once and replayed to any number of readers"""
+
+    def __init__(self):
+        self.items = []
+        self.closed = False
+        self.error = None
+        self._condition = threading.Condition()
+
+    def publish(self, item):
+        with self._condition:
+            self.items.append(item)
+            self._condition.notify_all()
+
+    def close(self, error=None):
+        with self._condition:
+            self.closed = True
+            self.error = error
+            self._condition.notify_all()
+
+    def read(self, timeout):
+        """Yield every item from the start; TimeoutError when none arrives within timeout"""
+        position = 0
+        while True:
+            with self._condition:
+                if not self._condition.wait_for(
+                        lambda: position < len(self.items) or self.closed, timeout):
+                    raise TimeoutError("Timed out waiting for a coalesced stream")
+                items = self.items[position:]
+                closed, error = self.closed, self.error
+            yield from items
+            position += len(items)
+            if closed and position == len(self.items):
+                if error is not None:
+                    raise error
+                return
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key (threads)"""
+
+    def __init__(self, timeout=90.0):
+        # Longest a waiting request follows another request's computation
+        self.timeout = timeout
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn, wait=None):
+        """fn() once for all concurrent callers with this key; returns (result, shared)
+
+        wait() is an optional context manager around a follower's wait (e.g.
+        a stage timer); the leader's time is fn()'s own
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            with wait() if wait is not None else nullcontext():
+                finished = call.done.wait(self.timeout)
+            if not finished:
+                raise TimeoutError("Timed out waiting for a coalesced request")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stream(self, key, fn):
+        """Iterate fn()'s items, generated once in a background thread per key
+
+        A request that disconnects does not cut the stream short for the others
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            if broadcast is None:
+                broadcast = self._streams[key] = Broadcast()
+                context = contextvars.copy_context()
+                threading.Thread(target=context.run, args=(self._produce, key, broadcast, fn),
+                                 daemon=True).start()
+            else:
+                self.coalesced += 1
+        return broadcast.read(self.timeout)
+
+    def _produce(self, key, broadcast, fn):
+        error = None
+        try:
+            for item in fn():
+                broadcast.publish(item)
+        except Exception as e:
+            error = e
+        finally:
+            with self._lock:
+                del self._streams[key]
+            broadcast.close(error)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls) + len(self._streams)
+
+
+class AsyncBroadcast:
+    """Broadcast for one event loop"""
+
+    def __init__(self):
+        self.items = []
+        self.closed = False
+        self.error = None
+        self.producer = None
+        self._changed = asyncio.Event()
+
+    def publish(self, item):
+        self.items.append(item)
+        self._wake()
+
+    def close(self, error=None):
+        self.closed = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def read(self, timeout):
+        position = 0
+        while True:
+            if position == len(self.items) and not self.closed:
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    raise TimeoutError("Timed out waiting for a coalesced stream") from None
+                continue
+            while position < len(self.items):
+                position += 1
+                yield self.items[position - 1]
+            if self.closed and position == len(self.items):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class AsyncSingleFlight:
+    """Coalesces concurrent calls with the same key (one event loop)
+
+    The computation runs as its own task, so a cancelled request does not
+    cancel it for the requests waiting on it
+    """
+
+    def __init__(self, timeout=90.0):
+        self.timeout = timeout
+        self._tasks = {}
+        self._streams = {}
+        self.coalesced = 0
+
+    async def do(self, key, fn, wait=None):
+        """await fn() once for all concurrent callers with this key; returns (result, shared)
+
+        wait() is timed around a follower's wait only, as in SingleFlight.do
+        """
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+        try:
+            with wait() if shared and wait is not None else nullcontext():
+                result = await asyncio.wait_for(asyncio.shield(task), self.timeout)
+            return result, shared
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timed out waiting for a coalesced request") from None
+
+    def stream(self, key, fn):
+        """Async-iterate fn()'s items, generated once in a background task per key"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = self._streams[key] = AsyncBroadcast()
+            # Held on the broadcast so the producer task is not garbage collected
+            broadcast.producer = asyncio.ensure_future(self._produce(key, broadcast, fn))
+        else:
+            self.coalesced += 1
+        return broadcast.read(self.timeout)
+
+    async def _produce(self, key, broadcast, fn):
+        error = None
+        try:
+            async for item in fn():
+                broadcast.publish(item)
+        except Exception as e:
+            error = e
+        finally:
+            self._streams.pop(key, None)
+            broadcast.close(error)
+
+    def in_flight(self):
+        return len(self._tasks) + len(self._streams)
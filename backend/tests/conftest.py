@@ -0,0 +1,61 @@
+"""
+Shared setup for the backend tests
+The backend modules import each other by bare name (they run from the
+backend directory), so that directory goes on sys.path first
+
+Run from backend/:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from mock_deepseek import start_mock_server  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def llm():
+    """Local DeepSeek stand-in shared by the tests"""
+    server = start_mock_server()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(scope='session')
+def pipeline(llm, tmp_path_factory):
+    """app.py imported against the stand-in LLM and the in-process index
+
+    app.py reads its configuration at import time, so it is imported once;
+    tests change its module globals with monkeypatch
+    """
+    os.environ.update(
+        DEEPSEEK_CHAT_URL=f"http://127.0.0.1:{llm.server_address[1]}/v1/chat/completions",
+        DEEPSEEK_API_KEY='test',
+        RETRIEVAL_BACKEND='local',
+        ADMIN_TOKEN='test-admin',
+        PROFILE_DIR=str(tmp_path_factory.mktemp('profiles')),
+        TTS_CACHE_PATH=str(tmp_path_factory.mktemp('tts_cache'))
+    )
+    import app
+    return app
+
+
+@pytest.fixture
+def client(pipeline):
+    return pipeline.app.test_client()
+
+
+@pytest.fixture
+def asgi(pipeline, monkeypatch):
+    """asgi_app.py; importing it swaps the threaded limiters in app.py for its
+    event-loop ones, so the threaded ones are put back after the test"""
+    monkeypatch.setattr(pipeline, 'flights', pipeline.flights)
+    monkeypatch.setattr(pipeline, 'llm_gate', pipeline.llm_gate)
+    import asgi_app
+    return asgi_app
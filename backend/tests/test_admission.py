@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import BATCH, INTERACTIVE, AsyncConcurrencyLimiter, ConcurrencyLimiter, Overloaded, RateLimiter
+
+
+def test_rate_limiter_allows_a_burst_then_asks_to_wait():
+    limiter = RateLimiter(rate=1.0, burst=3)
+    assert [limiter.take('a') for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = limiter.take('a')
+    assert 0 < wait <= 1.0
+    # Other clients have buckets of their own
+    assert limiter.take('b') == 0.0
+
+
+def test_rate_limiter_charges_the_cost():
+    limiter = RateLimiter(rate=1.0, burst=5)
+    assert limiter.take('a', cost=5) == 0.0
+    assert limiter.take('a') > 0
+    # A refused request spends nothing
+    assert limiter.take('b', cost=6) > 0
+    assert limiter.take('b', cost=5) == 0.0
+
+
+def test_rate_limiter_forgets_least_recent_clients():
+    limiter = RateLimiter(rate=1.0, burst=1, max_clients=2)
+    for key in 'abc':
+        limiter.take(key)
+    assert limiter.clients() == 2
+    # 'a' was evicted, so it starts with a full bucket again
+    assert limiter.take('a') == 0.0
+
+
+def test_concurrency_limiter_rejects_when_the_queue_is_full():
+    limiter = ConcurrencyLimiter(limit=1, queue_size=0, timeout=0.1)
+    limiter.acquire()
+    with pytest.raises(Overloaded) as error:
+        limiter.acquire()
+    assert error.value.reason == 'queue_full' and error.value.retry_after > 0
+    limiter.release()
+    limiter.acquire()
+    assert limiter.stats()['in_flight'] == 1
+
+
+def test_concurrency_limiter_times_out_waiting():
+    limiter = ConcurrencyLimiter(limit=1, queue_size=1, timeout=0.05)
+    limiter.acquire()
+    with pytest.raises(Overloaded) as error:
+        limiter.acquire()
+    assert error.value.reason == 'queue_timeout'
+    assert limiter.stats()['waiting'] == 0
+
+
+def test_concurrency_limiter_serves_interactive_before_batch():
+    limiter = ConcurrencyLimiter(limit=1, queue_size=4, timeout=5)
+    limiter.acquire()
+    order = []
+
+    def wait(lane, name):
+        limiter.acquire(lane)
+        order.append(name)
+        limiter.release()
+
+    batch = threading.Thread(target=wait, args=(BATCH, 'batch'))
+    batch.start()
+    while limiter.stats()['waiting'] < 1:
+        time.sleep(0.001)
+    chat = threading.Thread(target=wait, args=(INTERACTIVE, 'chat'))
+    chat.start()
+    while limiter.stats()['waiting'] < 2:
+        time.sleep(0.001)
+    limiter.release()
+    batch.join()
+    chat.join()
+    assert order == ['chat', 'batch']
+
+
+def test_batch_items_fill_only_half_the_queue():
+    limiter = ConcurrencyLimiter(limit=1, queue_size=2, timeout=5)
+    limiter.acquire()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(BATCH), limiter.release()))
+    waiter.start()
+    while limiter.stats()['waiting'] < 1:
+        time.sleep(0.001)
+    with pytest.raises(Overloaded):
+        limiter.acquire(BATCH)
+    limiter.release()
+    waiter.join()
+
+
+def test_async_limiter_hands_over_slots():
+    async def run():
+        limiter = AsyncConcurrencyLimiter(limit=1, queue_size=2, timeout=1)
+        held = []
+
+        async def use(name):
+            async with limiter.slot():
+                held.append(name)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(use('a'), use('b'), use('c'))
+        return held, limiter.stats()
+
+    held, stats = asyncio.run(run())
+    assert held == ['a', 'b', 'c']
+    assert stats['in_flight'] == 0 and stats['waiting'] == 0
+
+
+def test_batch_is_charged_one_token_per_message(pipeline, client, monkeypatch):
+    monkeypatch.setattr(pipeline, 'rate_limiter', RateLimiter(rate=0.001, burst=3))
+    response = client.post('/chat/batch', json={'messages': ['hello', 'hi']})
+    assert response.status_code == 200
+    # One token left: a two-message batch is refused, a single chat is not
+    response = client.post('/chat/batch', json={'messages': ['hello', 'hi']})
+    assert response.status_code == 429 and 'Retry-After' in response.headers
+    assert client.post('/chat', json={'message': 'hello'}).status_code == 200
+
+
+def test_batch_larger_than_the_burst_is_rejected(pipeline, client, monkeypatch):
+    monkeypatch.setattr(pipeline, 'rate_limiter', RateLimiter(rate=1.0, burst=3))
+    response = client.post('/chat/batch', json={'messages': ['a', 'b', 'c', 'd']})
+    assert response.status_code == 413
+
+
+def test_rate_limit_is_off_by_default(pipeline):
+    assert pipeline.RATE_LIMIT_PER_MINUTE == 0 and pipeline.rate_limiter is None
@@ -0,0 +1,81 @@
+"""ASGI serving mode: same contracts as app.py"""
+
+import asyncio
+import json
+
+from mock_deepseek import DEFAULT_REPLY
+from test_streaming import read_events
+
+
+def serve(asgi, requests):
+    """Run (method, path, json) requests against a started asgi_app; returns the responses"""
+    async def run():
+        async with asgi.app.test_app() as test_app:
+            client = test_app.test_client()
+            responses = []
+            for method, path, body in requests:
+                response = await client.open(path, method=method, json=body)
+                responses.append((response.status_code, await response.get_data()))
+            return responses
+    return asyncio.run(run())
+
+
+def test_chat_answers_like_the_flask_app(asgi, pipeline, client, monkeypatch):
+    monkeypatch.setattr(pipeline, 'response_cache', None)
+    question = {"message": "what are the benefits of strength training"}
+    [(status, body)] = serve(asgi, [('POST', '/chat', question)])
+    assert status == 200
+    answer = json.loads(body)
+    # app.py's own coalescer was swapped for the event-loop one by the import
+    monkeypatch.setattr(pipeline, 'flights', None)
+    monkeypatch.setattr(pipeline, 'llm_gate', None)
+    expected = client.post('/chat', json=question).get_json()
+    assert answer['response'] == expected['response'] == DEFAULT_REPLY
+    assert answer['sources'] == expected['sources']
+
+
+def test_stream_and_off_topic(asgi, pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, 'response_cache', None)
+    (status, stream), (_, off_topic) = serve(asgi, [
+        ('POST', '/chat/stream', {"message": "how much water should I drink"}),
+        ('POST', '/chat', {"message": "recommend a movie"}),
+    ])
+    events = read_events(stream)
+    assert status == 200 and events[-1][0] == 'done'
+    assert "".join(data['token'] for kind, data in events if kind == 'token') == DEFAULT_REPLY
+    assert json.loads(off_topic)['response'] == pipeline.OFF_TOPIC_MESSAGE
+
+
+def test_missing_message_is_rejected(asgi):
+    assert serve(asgi, [('POST', '/chat', {})])[0][0] == 400
+
+
+def test_server_timing_includes_the_shared_pipeline_stages(asgi, pipeline, monkeypatch):
+    """'gate' is timed inside app.py, 'generate' inside asgi_app.py"""
+    monkeypatch.setattr(pipeline, 'SERVER_TIMING', True)
+    monkeypatch.setattr(pipeline, 'response_cache', None)
+
+    async def run():
+        async with asgi.app.test_app() as test_app:
+            response = await test_app.test_client().post(
+                '/chat', json={"message": "how many hours of sleep do I need"})
+            return response.status_code, response.headers.get('Server-Timing', '')
+
+    status, header = asyncio.run(run())
+    stages = {part.split(';')[0].strip() for part in header.split(',')}
+    assert status == 200 and {'gate', 'embed', 'generate'} <= stages
+
+
+def test_admin_reload_swaps_in_a_new_generation(asgi, pipeline):
+    generation = pipeline.knowledge_base.generation
+
+    async def run():
+        async with asgi.app.test_app() as test_app:
+            client = test_app.test_client()
+            forbidden = await client.post('/admin/reload')
+            response = await client.post('/admin/reload', headers={'X-Admin-Token': 'test-admin'})
+            return forbidden.status_code, response.status_code, await response.get_json()
+
+    forbidden, status, body = asyncio.run(run())
+    assert forbidden == 403 and status == 200
+    assert body['knowledge_base']['generation'] == generation + 1
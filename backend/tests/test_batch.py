@@ -0,0 +1,39 @@
+"""/chat/batch"""
+
+from mock_deepseek import DEFAULT_REPLY
+
+
+def test_results_keep_the_input_order(client, pipeline, monkeypatch, llm):
+    monkeypatch.setattr(pipeline, 'response_cache', None)
+    before = llm.request_count
+    messages = [
+        "How much protein should I eat?",
+        {"message": "recommend a movie"},
+        {"message": ""},
+        "how much PROTEIN should I eat",
+        {"message": "मुझे रोज कितना पानी पीना चाहिए?", "language": "hi"},
+    ]
+    response = client.post('/chat/batch', json={"messages": messages})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert len(results) == 5
+    assert results[0]['response'] == DEFAULT_REPLY and results[0]['sources']
+    assert results[1]['response'] == pipeline.OFF_TOPIC_MESSAGE
+    assert results[2] == {"error": "Message is required"}
+    assert results[3] == results[0]
+    assert results[4]['response'] == DEFAULT_REPLY
+    # The repeated question is answered once
+    assert llm.request_count - before == 2
+
+
+def test_cached_answers_skip_the_llm(client, pipeline, llm):
+    messages = ["what are the benefits of yoga"]
+    first = client.post('/chat/batch', json={"messages": messages}).get_json()
+    before = llm.request_count
+    second = client.post('/chat/batch', json={"messages": messages}).get_json()
+    assert second == first and llm.request_count == before
+
+
+def test_messages_must_be_a_list(client):
+    assert client.post('/chat/batch', json={"messages": "protein"}).status_code == 400
+    assert client.post('/chat/batch', json={}).status_code == 400
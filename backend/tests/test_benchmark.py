@@ -0,0 +1,81 @@
+"""Benchmark harness: Server-Timing parsing, summaries, the Supabase stand-in and a short run"""
+
+import threading
+
+import httpx
+import pytest
+from werkzeug.serving import make_server
+
+from benchmark import compare, parse_server_timing, run_level, summarize
+from mock_supabase import start_mock_supabase
+
+
+@pytest.fixture(scope='module')
+def supabase():
+    server = start_mock_supabase()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def served(pipeline):
+    """app.py on a real socket, as the benchmark drives it"""
+    server = make_server('127.0.0.1', 0, pipeline.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_parse_server_timing():
+    timings = parse_server_timing('embed;dur=1.50, retrieve;desc="x";dur=20, cache')
+    assert timings == {'embed': 0.0015, 'retrieve': 0.02}
+    assert parse_server_timing(None) == {}
+
+
+def test_summarize_reports_milliseconds():
+    summary = summarize([0.001 * i for i in range(1, 101)])
+    assert summary['p50'] == pytest.approx(50.5) and summary['max'] == pytest.approx(100.0)
+    assert summarize([]) is None
+
+
+def test_mock_supabase_answers_rpc_and_table_pages(supabase):
+    url = f"http://127.0.0.1:{supabase.server_address[1]}/rest/v1"
+    first = supabase.index.passages()[0]
+    query = supabase.index.embeddings()[0].tolist()
+    rows = httpx.post(f"{url}/rpc/match_fitness_knowledge",
+                      json={'query_embedding': query, 'match_threshold': 0.0, 'match_count': 2}).json()
+    assert len(rows) == 2 and rows[0]['id'] == first['id']
+
+    page = httpx.get(f"{url}/fitness_knowledge", params={'select': 'id,title', 'id': 'gt.0', 'limit': 3}).json()
+    assert [set(row) for row in page] == [{'id', 'title'}] * 3
+    assert all(row['id'] > 0 for row in page)
+
+
+def test_mock_supabase_injects_failures():
+    server = start_mock_supabase(fail_rate=1.0, fail_status=500)
+    try:
+        response = httpx.post(f"http://127.0.0.1:{server.server_address[1]}/rest/v1/rpc/match_fitness_knowledge",
+                              json={'query_embedding': []})
+        assert response.status_code == 500 and server.request_count == 1
+    finally:
+        server.shutdown()
+
+
+def test_run_level_drives_the_app(served, llm, pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, 'SERVER_TIMING', True)
+    level = run_level(served, concurrency=2, total=4, offset=0, upstreams={'deepseek': llm})
+    assert level['requests'] == 4 and level['error_rate'] == 0
+    assert level['upstream_calls']['deepseek'] == 1
+    assert {'embed', 'retrieve', 'generate'} <= set(level['stages_ms'])
+
+
+def test_compare_prints_changes(tmp_path, capsys):
+    def level(rps, p95):
+        return {'concurrency': 8, 'rps': rps, 'latency_ms': {'p95': p95}}
+
+    baseline = tmp_path / 'before.json'
+    baseline.write_text('{"revision": "abc123", "levels": [%s]}' % str(level(100.0, 200.0)).replace("'", '"'))
+    compare({'levels': [level(125.0, 150.0), dict(level(1, 1), concurrency=1)]}, str(baseline))
+    output = capsys.readouterr().out
+    assert 'abc123' in output and '(+25.0%)' in output and '(-25.0%)' in output
+    assert 'c=1    not in the baseline' in output
@@ -0,0 +1,74 @@
+"""BM25 lexical index and reciprocal rank fusion"""
+
+import math
+
+import pytest
+
+from bm25_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+PASSAGES = [
+    {"id": 1, "title": "Protein Intake", "content": "Eat protein with every meal to build muscle."},
+    {"id": 2, "title": "Hydration", "content": "Drink water through the day, more when training."},
+    {"id": 3, "title": "Sleep", "content": "Sleep helps muscles recover after training sessions."},
+    {"id": 4, "title": "पानी", "content": "रोज आठ गिलास पानी पिएं।"},
+]
+
+
+def test_tokenize_drops_stopwords_and_stems():
+    assert tokenize("How do I build Muscles?") == ["build", "muscle"]
+    assert tokenize("stretches stretch exercises exercise") == ["stretch", "stretch", "exercise", "exercise"]
+    assert tokenize("पाण्याची गरज") == tokenize("पाण्याला गरज") == ["पाण्य", "गरज"]
+
+
+def test_search_matches_the_bm25_formula():
+    index = BM25Index(PASSAGES, k1=1.5, b=0.75, title_weight=1, languages=['en'] * 4)
+    docs = [tokenize(p['title']) + tokenize(p['content']) for p in PASSAGES]
+    average = sum(map(len, docs)) / len(docs)
+
+    def score(doc, term):
+        tf = doc.count(term)
+        n = sum(term in d for d in docs)
+        idf = math.log(1 + (len(docs) - n + 0.5) / (n + 0.5))
+        return idf * tf * 2.5 / (tf + 1.5 * (0.25 + 0.75 * len(doc) / average))
+
+    hits = index.search("muscle training", match_count=4)
+    expected = sorted(((sum(score(doc, t) for t in ["muscle", "train"]), i + 1)
+                       for i, doc in enumerate(docs)), reverse=True)
+    expected = [(s, id_) for s, id_ in expected if s > 0]
+    assert [hit['id'] for hit in hits] == [id_ for _, id_ in expected]
+    assert [hit['bm25'] for hit in hits] == pytest.approx([s for s, _ in expected], rel=1e-5)
+
+
+def test_title_matches_rank_first():
+    hits = BM25Index(PASSAGES).search("protein")
+    assert hits[0]['title'] == "Protein Intake"
+
+
+def test_no_matching_term_finds_nothing():
+    index = BM25Index(PASSAGES)
+    assert index.search("cryptocurrency prices") == []
+    assert index.search("protein", match_count=0) == []
+
+
+def test_devanagari_query():
+    assert [hit['id'] for hit in BM25Index(PASSAGES).search("कितना पानी")] == [4]
+
+
+def test_rank_fusion_prefers_passages_both_rankings_agree_on():
+    lexical = [{"title": "A", "bm25": 3.0}, {"title": "B", "bm25": 2.0}]
+    vector = [{"title": "B", "similarity": 0.9, "id": 7}, {"title": "C", "similarity": 0.8}]
+    fused = reciprocal_rank_fusion([lexical, vector], top_k=3)
+    assert [doc['title'] for doc in fused] == ["B", "A", "C"]
+    # Fields from both sources are kept
+    assert fused[0]['bm25'] == 2.0 and fused[0]['id'] == 7
+    # A zero weight leaves the vector ranking as a tie-breaker only
+    assert reciprocal_rank_fusion([lexical, vector], 3, weights=[1.0, 0.0])[0]['title'] == "A"
+
+
+def test_vector_search_runs_when_bm25_cannot_fill_top_k(pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, 'HYBRID_VECTOR_WEIGHT', 0.0)
+    assert pipeline.needs_vector_search(None, 3)
+    assert pipeline.needs_vector_search([{}], 3)
+    assert not pipeline.needs_vector_search([{}, {}, {}], 3)
+    monkeypatch.setattr(pipeline, 'HYBRID_VECTOR_WEIGHT', 0.5)
+    assert pipeline.needs_vector_search([{}, {}, {}], 3)
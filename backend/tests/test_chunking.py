@@ -0,0 +1,59 @@
+"""Passage chunking and context assembly"""
+
+from chunking import (assemble_context, chunk_record, chunk_text, estimate_tokens, parent_id_for,
+                      split_sentences)
+
+TEXT = " ".join(f"Sentence number {i} is about protein and recovery." for i in range(40))
+
+
+def test_passages_respect_the_budget_and_overlap():
+    chunks = chunk_text(TEXT, max_tokens=50, overlap_tokens=15)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 50 for chunk in chunks)
+    for previous, following in zip(chunks, chunks[1:]):
+        # Each passage starts with the last sentence of the one before
+        assert following.startswith(split_sentences(previous)[-1])
+    assert set(split_sentences(TEXT)) == {s for chunk in chunks for s in split_sentences(chunk)}
+
+
+def test_devanagari_sentences_split_on_the_danda():
+    assert split_sentences("पानी पिएं। अच्छी नींद लें।") == ["पानी पिएं।", "अच्छी नींद लें।"]
+
+
+def test_overlong_sentence_is_split_on_words():
+    sentence = " ".join(["word"] * 400)
+    chunks = chunk_text(sentence, max_tokens=50, overlap_tokens=0)
+    assert len(chunks) > 1 and all(estimate_tokens(chunk) <= 50 for chunk in chunks)
+    assert " ".join(chunks) == sentence
+
+
+def test_records_keep_their_parent_and_order():
+    passages = chunk_record({"title": "Protein", "content": TEXT}, max_tokens=50, overlap_tokens=0)
+    assert [p['chunk_index'] for p in passages] == list(range(len(passages)))
+    assert {p['parent_id'] for p in passages} == {parent_id_for({"title": "Protein", "content": TEXT})}
+    assert chunk_record({"title": "Empty"})[0]['content'] == ''
+
+
+def test_records_sharing_a_title_are_separate_documents():
+    first, second = (chunk_record({"title": "Protein", "content": content})[0]
+                     for content in ("Eat eggs.", "Eat lentils."))
+    assert first['parent_id'] != second['parent_id']
+    assert (parent_id_for({"id": 7, "title": "Protein", "content": "Eat eggs."})
+            == parent_id_for({"id": 7, "title": "Protein", "content": "Eat more eggs."}))
+
+
+def test_adjacent_hits_are_merged_without_repeating_the_overlap():
+    chunks = chunk_text(TEXT, max_tokens=50, overlap_tokens=15)
+    hits = [{"title": "Protein", "content": chunks[i], "parent_id": "p", "chunk_index": i,
+             "similarity": 0.9} for i in (0, 1)]
+    context, titles = assemble_context(hits, token_budget=1000)
+    assert titles == ["Protein"]
+    assert context.count(split_sentences(chunks[0])[-1]) == 1
+
+
+def test_context_fits_the_budget_best_document_first():
+    hits = [{"title": "Low", "content": TEXT, "id": 1, "similarity": 0.6},
+            {"title": "High", "content": TEXT, "id": 2, "similarity": 0.9}]
+    context, titles = assemble_context(hits, token_budget=500)
+    assert titles[0] == "High"
+    assert estimate_tokens(context) <= 510
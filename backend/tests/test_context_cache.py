@@ -0,0 +1,52 @@
+"""Cache of rendered prompt context"""
+
+from chunking import assemble_context
+from context_cache import ContextCache
+
+HITS = [
+    {"id": 1, "title": "Protein", "content": "Eat protein with every meal.", "similarity": 0.9},
+    {"id": 2, "title": "Sleep", "content": "Sleep seven to nine hours.", "similarity": 0.8},
+    {"id": 3, "title": "Water", "content": "Drink water through the day.", "similarity": 0.7},
+]
+
+
+def test_cached_context_equals_assembled_context():
+    cache = ContextCache()
+    expected = assemble_context(HITS, 500)
+    assert cache.assemble(HITS, 500, 'v1') == expected
+    assert cache.assemble(HITS, 500, 'v1') == expected
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_documents_are_rendered_once_across_result_sets():
+    cache = ContextCache()
+    cache.assemble(HITS[:2], 500, 'v1')
+    context, titles = cache.assemble(HITS[1:], 500, 'v1')
+    assert (context, titles) == assemble_context(HITS[1:], 500)
+    assert cache.stats()['block_hits'] == 1
+
+
+def test_a_new_knowledge_base_version_drops_the_cache():
+    cache = ContextCache()
+    cache.assemble(HITS, 500, 'v1')
+    edited = [dict(HITS[0], content="Spread protein over four meals.")] + HITS[1:]
+    context, _ = cache.assemble(edited, 500, 'v2')
+    assert "four meals" in context
+    assert cache.stats()['version'] == 'v2' and cache.stats()['hits'] == 0
+
+
+def test_entries_are_evicted_least_recently_used():
+    cache = ContextCache(max_entries=2)
+    for hit in HITS:
+        cache.assemble([hit], 500, 'v1')
+    assert cache.stats()['contexts'] == 2 and cache.stats()['blocks'] == 2
+    cache.assemble([HITS[0]], 500, 'v1')
+    assert cache.stats()['hits'] == 0
+
+
+def test_system_prompt_prefix_is_stable(pipeline):
+    """Prompts for one language share everything before the retrieved context"""
+    first, second = (pipeline.build_chat_payload(question, context, language='hi')['messages'][0]['content']
+                     for question, context in (("प्रोटीन?", "A"), ("नींद?", "B")))
+    prefix = pipeline.SYSTEM_PROMPT_PREFIXES['hi']
+    assert first == prefix + "A\n" and second == prefix + "B\n"
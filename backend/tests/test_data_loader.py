@@ -0,0 +1,215 @@
+"""Knowledge-base ingestion: streaming reader, batched upload and incremental sync"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import data_loader
+from data_loader import (AdaptiveRateLimiter, iter_batches, iter_records, plan_sync, record_hash,
+                         sync_data, upload_records)
+
+RECORDS = [
+    {"id": 1, "title": "Protein [basics]", "content": "Eat 1.6 g/kg, spread over meals, e.g. 20-40 g"},
+    {"id": 2, "title": "व्यायाम", "content": "Nested {\"quoted\": [1, 2]} text", "score": 12.5},
+    {"id": 3, "tags": ["sleep", "recovery"], "weight": -0.000123, "ok": True, "note": None},
+]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 1 << 20])
+def test_json_array_streams_the_same_records_as_json_load(tmp_path, chunk_size):
+    path = tmp_path / 'kb.json'
+    path.write_text(json.dumps(RECORDS, ensure_ascii=False, indent=2), encoding='utf-8')
+    assert list(iter_records(str(path), chunk_size)) == RECORDS
+
+
+def test_number_split_across_reads_is_not_cut_short(tmp_path):
+    path = tmp_path / 'numbers.json'
+    path.write_text('[12.5, 1000000, 3]', encoding='utf-8')
+    assert list(iter_records(str(path), chunk_size=2)) == [12.5, 1000000, 3]
+
+
+def test_jsonl_skips_blank_lines(tmp_path):
+    path = tmp_path / 'kb.jsonl'
+    path.write_text('\n'.join(json.dumps(record) for record in RECORDS) + '\n\n', encoding='utf-8')
+    assert list(iter_records(str(path))) == RECORDS
+
+
+def test_empty_array(tmp_path):
+    path = tmp_path / 'empty.json'
+    path.write_text(' [ ] ', encoding='utf-8')
+    assert list(iter_records(str(path), chunk_size=1)) == []
+
+
+def test_truncated_array_is_an_error(tmp_path):
+    path = tmp_path / 'truncated.json'
+    path.write_text(json.dumps(RECORDS)[:-20], encoding='utf-8')
+    with pytest.raises(ValueError):
+        list(iter_records(str(path), chunk_size=16))
+
+
+class FakePostgrest(ThreadingHTTPServer):
+    """The fitness_knowledge endpoints the loader uses: bulk insert/upsert, keyset select, delete"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakePostgrestHandler)
+        self.rows = {}
+        self.next_id = 1
+        self.writes = []
+        # Respond 429 to this many requests first
+        self.throttle = 0
+        self.lock = threading.Lock()
+
+
+class FakePostgrestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self):
+        return {key: values[-1] for key, values in parse_qs(urlsplit(self.path).query).items()}
+
+    def _reply(self, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _throttled(self):
+        with self.server.lock:
+            if self.server.throttle:
+                self.server.throttle -= 1
+                self._reply(429, headers={'Retry-After': '0'})
+                return True
+        return False
+
+    def do_POST(self):
+        rows = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self._throttled():
+            return
+        with self.server.lock:
+            self.server.writes.append(len(rows))
+            for row in rows:
+                if 'id' not in row:
+                    row = dict(row, id=self.server.next_id)
+                    self.server.next_id += 1
+                self.server.rows[row['id']] = row
+        self._reply(201)
+
+    def do_GET(self):
+        if self._throttled():
+            return
+        params = self._params()
+        last_id = int(params['id'][len('gt.'):])
+        with self.server.lock:
+            rows = [row for id_, row in sorted(self.server.rows.items()) if id_ > last_id]
+        columns = params['select'].split(',')
+        self._reply(200, [{column: row.get(column) for column in columns}
+                          for row in rows[:int(params['limit'])]])
+
+    def do_DELETE(self):
+        if self._throttled():
+            return
+        ids = self._params()['id'][len('in.('):-1].split(',')
+        with self.server.lock:
+            for id_ in ids:
+                self.server.rows.pop(int(id_), None)
+        self._reply(204)
+
+
+@pytest.fixture
+def postgrest(monkeypatch):
+    server = FakePostgrest()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(data_loader, 'SUPABASE_URL', f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(data_loader, 'SUPABASE_KEY', 'test')
+    yield server
+    server.shutdown()
+
+
+def documents(count, prefix="Topic"):
+    return [{"title": f"{prefix} {i}", "content": f"Short note number {i} about training."}
+            for i in range(count)]
+
+
+def test_iter_batches():
+    assert list(iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_batches([], 2)) == []
+
+
+def test_records_are_embedded_and_uploaded_in_batches(postgrest):
+    limiter = AdaptiveRateLimiter()
+    assert upload_records(documents(5), limiter, batch_size=2, workers=2) == (5, 0)
+    assert sorted(postgrest.writes) == [1, 2, 2]
+    stored = list(postgrest.rows.values())
+    assert {row['title'] for row in stored} == {f"Topic {i}" for i in range(5)}
+    assert all(len(row['embedding']) == 1536 and row['content_hash'] for row in stored)
+
+
+def test_throttled_uploads_back_off_and_retry(postgrest):
+    postgrest.throttle = 2
+    limiter = AdaptiveRateLimiter()
+    assert upload_records(documents(3), limiter, batch_size=3, workers=1) == (3, 0)
+    assert limiter.throttled == 2 and limiter.delay == 0.0
+
+
+def test_rate_limiter_doubles_then_recovers():
+    limiter = AdaptiveRateLimiter(max_delay=2.0)
+    limiter.on_throttled()
+    assert limiter.delay == 0.5
+    limiter.on_throttled()
+    limiter.on_throttled()
+    limiter.on_throttled()
+    assert limiter.delay == 2.0
+    limiter.on_throttled(retry_after='1')
+    assert limiter.delay == 2.0
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.delay == 0.0
+
+
+def test_plan_sync_diffs_by_title_and_hash():
+    existing = [
+        {"id": 1, "title": "Kept", "content_hash": record_hash("Kept", "same"), "chunk_index": 0},
+        {"id": 2, "title": "Edited", "content_hash": record_hash("Edited", "old"), "chunk_index": 0},
+        {"id": 3, "title": "Edited", "content_hash": record_hash("Edited", "old"), "chunk_index": 1},
+        {"id": 4, "title": "Gone", "content_hash": "x", "chunk_index": 0},
+        {"id": 5, "title": "Kept", "content_hash": record_hash("Kept", "same"), "chunk_index": 0},
+    ]
+    records = [{"title": "Kept", "content": "same"}, {"title": "Edited", "content": "new"},
+               {"title": "Added", "content": "text"}]
+    plan = plan_sync(records, existing)
+    assert plan['new'] == {"Added": record_hash("Added", "text")}
+    assert plan['changed'] == {"Edited": ([2, 3], record_hash("Edited", "new"))}
+    assert sorted(plan['removed']) == [4, 5] and plan['duplicates'] == 1
+    assert plan['unchanged'] == 1
+
+
+def test_sync_writes_only_what_changed(postgrest, tmp_path):
+    path = tmp_path / 'kb.json'
+    records = documents(4)
+    path.write_text(json.dumps(records), encoding='utf-8')
+    sync_data(str(path), batch_size=2, workers=1)
+    ids = {row['title']: row['id'] for row in postgrest.rows.values()}
+    assert len(ids) == 4
+
+    # Running it again writes nothing
+    postgrest.writes.clear()
+    plan = sync_data(str(path), batch_size=2, workers=1)
+    assert plan['unchanged'] == 4 and postgrest.writes == []
+
+    # An edit is rewritten under the same id, a dropped record is deleted
+    records[1]['content'] = "Rewritten note about recovery."
+    path.write_text(json.dumps(records[:3]), encoding='utf-8')
+    sync_data(str(path), batch_size=2, workers=1)
+    stored = {row['title']: row for row in postgrest.rows.values()}
+    assert set(stored) == {"Topic 0", "Topic 1", "Topic 2"}
+    assert stored["Topic 1"]['id'] == ids["Topic 1"]
+    assert stored["Topic 1"]['content'] == "Rewritten note about recovery."
+    assert postgrest.writes == [1]
@@ -0,0 +1,37 @@
+"""Batched hash embeddings"""
+
+import hashlib
+
+import numpy as np
+import pytest
+
+from embeddings import EMBEDDING_DIM, embed_many, get_embedding
+
+
+def reference_embedding(text):
+    """The original per-element loop the engine replaced"""
+    digest = hashlib.sha256(text.encode()).digest()
+    return [(digest[i % len(digest)] / 255.0 + i / 1536) / 2.0 for i in range(1536)]
+
+
+@pytest.mark.parametrize('text', ["", "protein", "कितना पानी पीना चाहिए?"])
+def test_matches_the_original_embedding(text):
+    assert np.allclose(embed_many([text])[0], reference_embedding(text), atol=1e-6)
+
+
+def test_batch_rows_equal_single_embeddings():
+    texts = ["sleep", "stress", "sleep"]
+    matrix = embed_many(texts)
+    assert matrix.shape == (3, EMBEDDING_DIM) and matrix.dtype == np.float32
+    assert all(np.array_equal(row, get_embedding(text)) for row, text in zip(matrix, texts))
+
+
+def test_empty_batch():
+    assert embed_many([]).shape == (0, EMBEDDING_DIM)
+
+
+def test_cached_embedding_is_read_only():
+    embedding = get_embedding("how much water")
+    assert get_embedding("how much water") is embedding
+    with pytest.raises(ValueError):
+        embedding[0] = 0.0
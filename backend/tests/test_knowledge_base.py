@@ -0,0 +1,124 @@
+"""Knowledge-base snapshots, keyset paging and the background refresher"""
+
+import threading
+
+from knowledge_base import KnowledgeBase, Refresher, fingerprint, select_pages
+
+
+class PagedTable:
+    """Records the keyset filters select_pages() sends"""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.requests = []
+
+    def table(self, name):
+        return self
+
+    def select(self, columns):
+        self.columns, self.after, self.count = columns, None, None
+        return self
+
+    def gt(self, column, value):
+        self.after = value
+        return self
+
+    def order(self, column):
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def execute(self):
+        self.requests.append(self.after)
+        rows = [{'id': i} for i in self.ids if self.after is None or i > self.after][:self.count]
+        return type('Result', (), {'data': rows})()
+
+
+def test_pages_are_read_by_keyset():
+    table = PagedTable(list(range(1, 8)))
+    pages = list(select_pages(table, 'content_hash', page_size=3))
+    assert [[row['id'] for row in page] for page in pages] == [[1, 2, 3], [4, 5, 6], [7]]
+    assert table.requests == [None, 3, 6] and table.columns == 'id, content_hash'
+    # A full last page costs one more (empty) request
+    table = PagedTable([1, 2, 3])
+    assert len(list(select_pages(table, 'id', page_size=3))) == 1 and table.requests == [None, 3]
+
+
+def test_fingerprint_follows_content_and_order():
+    assert fingerprint(['1:a', '2:b']) == fingerprint(['1:a', '2:b'])
+    assert fingerprint(['1:a', '2:b']) != fingerprint(['2:b', '1:a'])
+    assert fingerprint(['1:a', '2:b']) != fingerprint(['1:a', '2:c'])
+
+
+class Source:
+    def __init__(self):
+        self.version = 'v1'
+        self.builds = 0
+        self.fail = False
+        self.live = None
+
+    def build(self, version, generation):
+        self.builds += 1
+        if self.fail:
+            raise ConnectionError("source unreachable")
+        return KnowledgeBase(version=version, generation=generation)
+
+    def swap(self, kb):
+        self.live = kb
+
+
+def test_refresh_rebuilds_only_when_the_source_changed():
+    source = Source()
+    refresher = Refresher(lambda: source.version, source.build, source.swap)
+    assert refresher.refresh() and source.live.generation == 1
+    assert not refresher.refresh() and source.builds == 1
+    source.version = 'v2'
+    assert refresher.refresh() and source.live.version == 'v2' and source.live.generation == 2
+    assert refresher.refresh(force=True) and source.live.generation == 3
+
+
+def test_notify_rebuilds_in_the_background_and_survives_failures():
+    source = Source()
+    refresher = Refresher(lambda: source.version, source.build, source.swap).start()
+    assert refresher.wait(refresher.notify(), timeout=5) and source.live.version == 'v1'
+
+    source.fail = True
+    before = source.live
+    assert refresher.wait(refresher.notify(force=True), timeout=5)
+    assert source.live is before and refresher.failures == 1
+    assert refresher.last_error == 'ConnectionError'
+
+    source.fail = False
+    assert refresher.wait(refresher.notify(force=True), timeout=5)
+    assert source.live.generation == 2 and refresher.last_error is None
+
+
+def test_requests_keep_the_snapshot_they_started_with():
+    source = Source()
+    release = threading.Event()
+
+    def slow_build(version, generation):
+        release.wait(5)
+        return KnowledgeBase(version=version, generation=generation)
+
+    refresher = Refresher(lambda: source.version, slow_build, source.swap)
+    source.live = KnowledgeBase(version='v0', generation=0)
+    worker = threading.Thread(target=refresher.refresh)
+    worker.start()
+    # The build is in progress; readers still see the old snapshot
+    assert source.live.version == 'v0'
+    release.set()
+    worker.join()
+    assert source.live.version == 'v1'
+
+
+def test_admin_reload_swaps_in_a_new_generation(pipeline, client):
+    assert client.post('/admin/reload').status_code == 403
+    generation = pipeline.knowledge_base.generation
+    response = client.post('/admin/reload', headers={'X-Admin-Token': 'test-admin'})
+    assert response.status_code == 200
+    assert response.get_json()['knowledge_base']['generation'] == generation + 1
+    assert pipeline.knowledge_base.ready and pipeline.knowledge_base.passages() > 0
+
@@ -0,0 +1,54 @@
+"""Language detection and per-language partitions"""
+
+import numpy as np
+import pytest
+
+from embeddings import get_embedding
+from language import Partitions, detect_language, language_codes, normalize_language
+from vector_index import VectorIndex
+
+
+@pytest.mark.parametrize('text, language', [
+    ("How much water should I drink?", 'en'),
+    ("मुझे रोज कितना पानी पीना चाहिए?", 'hi'),
+    ("मला रोज किती पाणी प्यायला पाहिजे?", 'mr'),
+    ("व्यायामाचे फायदे सांगा", 'mr'),
+    ("झोपेसाठी काय करावे?", 'mr'),
+    ("व्यायाम योग", 'hi'),
+    ("Is योग good for back pain?", 'en'),
+])
+def test_detect_language(text, language):
+    assert detect_language(text) == language
+
+
+def test_a_supported_client_hint_wins():
+    assert detect_language("How much water?", 'mr-IN') == 'mr'
+    assert detect_language("How much water?", 'fr') == 'en'
+    assert normalize_language('hi_IN') == 'hi' and normalize_language(None) is None
+
+
+def test_rows_are_coded_by_their_language_or_text():
+    rows = [{"title": "Water", "content": "Drink water."},
+            {"title": "पानी", "content": "रोज पानी पीना चाहिए।", "language": "mr"},
+            {"title": "पानी", "content": "रोज पानी पीना चाहिए।"}]
+    assert language_codes(rows).tolist() == [0, 2, 1]
+
+
+def test_small_or_complete_partitions_search_every_row():
+    codes = np.array([0] * 60 + [1] * 40 + [2] * 10, dtype=np.uint8)
+    partitions = Partitions(codes, min_rows=20)
+    assert partitions.rows('hi').tolist() == list(range(60, 100))
+    assert partitions.rows('mr') is None and partitions.rows('xx') is None
+    assert Partitions(np.zeros(5, dtype=np.uint8), min_rows=1).rows('en') is None
+
+
+def test_search_stays_within_a_minority_language():
+    rows = ([{"id": i, "title": f"Tip {i}", "content": f"Drink water after training, tip {i}."}
+             for i in range(1, 9)]
+            + [{"id": 9, "title": "पानी", "content": "व्यायाम के बाद पानी पीना चाहिए।"},
+               {"id": 10, "title": "नींद", "content": "अच्छी नींद के लिए रोज़ सोने का समय तय करें।"}])
+    index = VectorIndex.from_records(rows)
+    index.partitions = Partitions(index.partitions.codes, min_rows=1)
+    hits = index.search(get_embedding("drink water after training"), 0.0, 3, language='hi')
+    assert {hit['id'] for hit in hits} <= {9, 10}
+    assert len(index.search(get_embedding("drink water after training"), 0.0, 3)) == 3
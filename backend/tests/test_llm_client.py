@@ -0,0 +1,131 @@
+"""DeepSeek client: retries, backoff and circuit breaker"""
+
+import asyncio
+import time
+
+import pytest
+import requests
+
+from llm_client import (AsyncLLMClient, CircuitBreaker, CircuitOpenError, LLMClient, UpstreamError,
+                        backoff_delay)
+from mock_deepseek import DEFAULT_REPLY, start_mock_server
+
+
+@pytest.fixture
+def failing_llm():
+    server = start_mock_server(fail_rate=1.0)
+    yield server
+    server.shutdown()
+
+
+def client_for(server, **kwargs):
+    return LLMClient(f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions", 'test',
+                     backoff_base=0.001, backoff_cap=0.01, **kwargs)
+
+
+PAYLOAD = {"messages": [{"role": "user", "content": "hi"}]}
+
+
+def test_complete_returns_the_message(llm):
+    assert client_for(llm).complete(PAYLOAD) == DEFAULT_REPLY
+
+
+def test_failures_are_retried_then_raised(failing_llm):
+    client = client_for(failing_llm, max_retries=2)
+    with pytest.raises(UpstreamError):
+        client.complete(PAYLOAD)
+    assert failing_llm.request_count == 3
+
+
+def test_breaker_opens_and_fails_fast(failing_llm):
+    client = client_for(failing_llm, max_retries=0, breaker=CircuitBreaker(failure_threshold=2))
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            client.complete(PAYLOAD)
+    with pytest.raises(CircuitOpenError):
+        client.complete(PAYLOAD)
+    assert failing_llm.request_count == 2 and client.breaker.state == 'open'
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    assert not breaker.allow_request()
+    time.sleep(0.02)
+    assert breaker.state == 'half-open'
+    assert breaker.allow_request() and not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.01)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    return breaker
+
+
+def test_probe_ending_in_an_unexpected_error_frees_the_half_open_slot(llm, monkeypatch):
+    client = client_for(llm, breaker=half_open_breaker())
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("bug in the request path")
+
+    monkeypatch.setattr(client.session, 'post', broken)
+    with pytest.raises(RuntimeError):
+        client.complete(PAYLOAD)
+    assert client.breaker.state == 'half-open'
+    monkeypatch.undo()
+    assert client.complete(PAYLOAD) == DEFAULT_REPLY
+    assert client.breaker.state == 'closed'
+
+
+def test_probe_cut_off_mid_body_reopens_the_breaker(llm, monkeypatch):
+    client = client_for(llm, breaker=half_open_breaker())
+
+    def cut_off(*args, **kwargs):
+        raise requests.exceptions.ChunkedEncodingError("connection broken")
+
+    monkeypatch.setattr(client.session, 'post', cut_off)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        client.complete(PAYLOAD)
+    assert client.breaker.state == 'open'
+
+
+def test_cancelled_async_probe_frees_the_half_open_slot():
+    slow_llm = start_mock_server(latency=0.3)
+
+    async def run():
+        client = AsyncLLMClient(f"http://127.0.0.1:{slow_llm.server_address[1]}/v1/chat/completions", 'test',
+                                breaker=half_open_breaker())
+        task = asyncio.create_task(client.complete(PAYLOAD))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert client.breaker.state == 'half-open'
+        assert await client.complete(PAYLOAD) == DEFAULT_REPLY
+        assert client.breaker.state == 'closed'
+        await client.aclose()
+
+    try:
+        asyncio.run(run())
+    finally:
+        slow_llm.shutdown()
+
+
+def test_backoff_is_capped_and_honors_retry_after():
+    assert all(0 <= backoff_delay(attempt, 0.25, 4.0) <= 4.0 for attempt in range(10))
+    assert backoff_delay(0, 0.001, 4.0, retry_after='2') == 2.0
+    assert backoff_delay(0, 0.001, 4.0, retry_after='60') == 4.0
+    assert backoff_delay(0, 0.001, 4.0, retry_after='soon') <= 0.001
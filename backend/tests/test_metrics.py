@@ -0,0 +1,65 @@
+"""Per-stage latency metrics and the /metrics endpoint"""
+
+import math
+import threading
+
+import pytest
+
+from metrics import Registry, server_timing, timer
+
+
+def test_counter_is_exact_under_concurrency():
+    counter = Registry().counter('requests_total', "Requests", labels=('status',))
+
+    def work():
+        for _ in range(1000):
+            counter.inc(status='200')
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.value(status='200') == 8000 and counter.value(status='500') == 0
+
+
+def test_summary_quantiles_cover_the_recent_window():
+    summary = Registry().summary('stage_seconds', "Stage latency", labels=('stage',), window=100)
+    assert all(math.isnan(v) for v in summary.quantiles(stage='embed').values())
+    for value in range(1000):
+        summary.observe(value, stage='embed')
+    quantiles = summary.quantiles(stage='embed')
+    # Only the last 100 observations (900..999) count
+    assert quantiles[0.5] == pytest.approx(949.5)
+    assert 900 <= quantiles[0.95] <= 999
+
+
+def test_render_is_prometheus_text():
+    registry = Registry()
+    registry.counter('hits_total', "Hits", labels=('path',)).inc(path='/a"b')
+    registry.summary('latency_seconds', "Latency").observe(0.5)
+    registry.callback('cache_entries', "Entries", 'gauge', lambda: 3)
+    registry.callback('skipped', "Never shown", 'gauge', lambda: None)
+    text = registry.render()
+    assert '# TYPE hits_total counter' in text
+    assert 'hits_total{path="/a\\"b"} 1' in text
+    assert 'latency_seconds{quantile="0.5"} 0.5' in text and 'latency_seconds_count 1' in text
+    assert 'cache_entries 3' in text and 'skipped' not in text
+
+
+def test_timer_adds_to_the_request_timings():
+    summary = Registry().summary('stage_seconds', "Stage latency", labels=('stage',))
+    timings = {}
+    for _ in range(2):
+        with timer(summary, timings, stage='retrieve'):
+            pass
+    assert list(timings) == ['retrieve']
+    assert summary.samples()[-2] == ('stage_seconds_count{stage="retrieve"}', 2)
+    assert server_timing({'embed': 0.0015}) == 'embed;dur=1.50'
+
+
+def test_metrics_endpoint_reports_stage_latency(client):
+    client.post('/chat', json={"message": "how much water should I drink"})
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    assert 'stage="embed"' in response.get_data(as_text=True)
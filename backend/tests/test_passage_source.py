@@ -0,0 +1,104 @@
+"""Which passages the BM25 index ranks for each retrieval backend"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROWS = [{"id": i, "title": f"Row {i}", "content": f"table passage {i} about protein",
+         "parent_id": i, "chunk_index": 0, "content_hash": f"h{i}"} for i in range(1, 6)]
+
+
+class FakeQuery:
+    def __init__(self, rows, fail):
+        self.rows = rows
+        self.fail = fail
+        self.selected = []
+
+    def select(self, columns):
+        self.selected = [column.strip() for column in columns.split(',')]
+        return self
+
+    def gt(self, column, value):
+        self.rows = [row for row in self.rows if row[column] > value]
+        return self
+
+    def order(self, column):
+        self.rows = sorted(self.rows, key=lambda row: row[column])
+        return self
+
+    def limit(self, count):
+        self.rows = self.rows[:count]
+        return self
+
+    def execute(self):
+        if self.fail:
+            raise ConnectionError("database unreachable")
+        return type('Result', (), {'data': [{c: row[c] for c in self.selected} for row in self.rows]})()
+
+
+class FakeSupabase:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def table(self, name):
+        assert name == 'fitness_knowledge'
+        return FakeQuery(ROWS, self.fail)
+
+
+@pytest.fixture
+def supabase_backend(pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, 'RETRIEVAL_BACKEND', 'supabase')
+    monkeypatch.setattr(pipeline, 'LOCAL_INDEX_SOURCE', 'json')
+    monkeypatch.setattr(pipeline, 'KB_PAGE_SIZE', 2)
+    monkeypatch.setattr(pipeline, 'KB_REFRESH_INTERVAL', 60)
+    monkeypatch.setattr(pipeline, 'get_supabase', lambda: FakeSupabase())
+    return pipeline
+
+
+def test_supabase_backend_indexes_the_table_not_the_json_file(supabase_backend):
+    assert supabase_backend.passage_source() == 'supabase'
+    passages = supabase_backend.load_passages()
+    assert [row['id'] for row in passages] == [1, 2, 3, 4, 5]
+    assert len(supabase_backend.load_lexical_index()) == 5
+    assert supabase_backend.source_version().startswith('supabase:')
+
+
+def test_table_is_not_fingerprinted_without_polling(supabase_backend, monkeypatch):
+    monkeypatch.setattr(supabase_backend, 'KB_REFRESH_INTERVAL', 0)
+    monkeypatch.setattr(supabase_backend, 'get_supabase', lambda: FakeSupabase(fail=True))
+    assert supabase_backend.source_version() == 'supabase'
+
+
+def test_import_does_not_wait_for_the_table(llm):
+    """The default configuration starts at once and indexes the table in the background"""
+    env = dict(os.environ, RETRIEVAL_BACKEND='supabase', HYBRID_RETRIEVAL='true', SUPABASE_URL='',
+               SUPABASE_KEY='', DEEPSEEK_API_KEY='test')
+    env.pop('KB_BACKGROUND_WARMUP', None)
+    probe = ("import app\n"
+             "print(app.KB_BACKGROUND_WARMUP, app.refresher.running(),\n"
+             "      app.app.test_client().get('/health').status_code)")
+    result = subprocess.run([sys.executable, '-c', probe], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.stdout.splitlines()[-1] == 'True True 200', result.stderr
+
+
+def test_unreadable_table_leaves_retrieval_to_the_rpc(supabase_backend, monkeypatch):
+    monkeypatch.setattr(supabase_backend, 'get_supabase', lambda: FakeSupabase(fail=True))
+    assert supabase_backend.load_passages() is None
+    assert supabase_backend.load_lexical_index() is None
+    assert supabase_backend.needs_vector_search(None, 3)
+
+
+def test_snapshot_stays_an_explicit_opt_in(supabase_backend, monkeypatch):
+    monkeypatch.setattr(supabase_backend, 'LOCAL_INDEX_SOURCE', 'snapshot')
+    assert supabase_backend.passage_source() == 'snapshot'
+
+
+def test_local_backend_keeps_the_json_file(pipeline):
+    assert pipeline.RETRIEVAL_BACKEND == 'local'
+    assert pipeline.passage_source() == 'json'
+    assert pipeline.source_version().startswith('json:')
@@ -0,0 +1,67 @@
+"""Memory-mapped float32 / int8 embedding store"""
+
+import os
+
+import numpy as np
+import pytest
+
+import vector_index
+from data_loader import iter_records, write_snapshot
+from embeddings import get_embedding
+from vector_index import EMBEDDING_DIM, SnapshotWriter, VectorIndex, quantize_rows
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'health_data.json')
+
+
+@pytest.fixture(scope='module')
+def stores(tmp_path_factory):
+    """The knowledge base as a float32 and an int8 snapshot"""
+    paths = {}
+    for dtype in ('float32', 'int8'):
+        paths[dtype] = str(tmp_path_factory.mktemp(dtype))
+        write_snapshot(iter_records(DATA_FILE), paths[dtype], dtype)
+    return {dtype: VectorIndex.from_snapshot(path) for dtype, path in paths.items()}
+
+
+def test_quantization_error_is_bounded():
+    matrix = vector_index.normalize_rows(np.random.default_rng(0).normal(size=(50, EMBEDDING_DIM)))
+    quantized, scales = quantize_rows(matrix)
+    assert quantized.dtype == np.int8 and np.abs(quantized).max() == 127
+    error = np.abs(quantized * scales[:, None] - matrix)
+    assert (error <= scales[:, None] / 2 + 1e-7).all()
+
+
+def test_stores_are_memory_mapped(stores):
+    assert isinstance(stores['float32'].matrix, np.memmap) and stores['float32'].scales is None
+    assert stores['int8'].matrix.dtype == np.int8 and isinstance(stores['int8'].scales, np.memmap)
+    table = stores['int8'].passages()
+    assert table[-1] == table[len(table) - 1] and set(table[0]) >= {'id', 'title', 'content'}
+    with pytest.raises(IndexError):
+        table[len(table)]
+
+
+@pytest.mark.parametrize('question', ["how much protein", "benefits of sleep", "पानी कितना पीना चाहिए"])
+def test_int8_store_ranks_like_float32(stores, question):
+    query = get_embedding(question)
+    exact, quantized = (stores[dtype].search(query, 0.0, 5) for dtype in ('float32', 'int8'))
+    assert [row['id'] for row in quantized] == [row['id'] for row in exact]
+    assert [row['similarity'] for row in quantized] == pytest.approx(
+        [row['similarity'] for row in exact], abs=0.01)
+
+
+def test_int8_search_is_blockwise(tmp_path, monkeypatch):
+    """Blocks of dequantized rows give the same similarities as one dense matrix"""
+    monkeypatch.setattr(vector_index, 'QUANTIZED_BLOCK_ROWS', 16)
+    embeddings = np.random.default_rng(1).normal(size=(100, EMBEDDING_DIM))
+    rows = [{'id': i + 1, 'title': f"t{i}", 'content': f"c{i}"} for i in range(100)]
+    with SnapshotWriter(str(tmp_path), 'int8') as writer:
+        # Several batches, as data_loader streams them
+        for start in range(0, 100, 30):
+            writer.add(rows[start:start + 30], embeddings[start:start + 30])
+    index = VectorIndex.from_snapshot(str(tmp_path))
+
+    queries = embeddings[:3] + np.random.default_rng(2).normal(scale=0.1, size=(3, EMBEDDING_DIM))
+    dense = index.embeddings() @ (queries / np.linalg.norm(queries, axis=1, keepdims=True)).T
+    for i, hits in enumerate(index.search_many(queries, 0.0, 5)):
+        assert hits[0]['id'] == i + 1
+        assert [hit['similarity'] for hit in hits] == pytest.approx(np.sort(dense[:, i])[::-1][:5], abs=1e-5)
@@ -0,0 +1,72 @@
+"""Replaying captured /chat traffic"""
+
+import asyncio
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from replay import agreement, drive, load_conversations
+from request_log import RequestLog
+
+
+def captured(directory, records):
+    log = RequestLog(str(directory), sample_rate=1).start()
+    for record in records:
+        log.write(record)
+    log.close()
+
+
+RECORDS = [
+    {'ts': 3.0, 'query': "and how many sets?", 'session': 'a', 'language': 'en'},
+    {'ts': 1.0, 'query': "How many squats for leg strength?", 'session': 'a', 'language': 'en'},
+    {'ts': 2.0, 'query': "How much water should I drink?", 'language': 'en'},
+    {'ts': 2.5, 'endpoint': '/voice'},
+]
+
+
+def test_conversations_keep_their_turns_in_order(tmp_path):
+    captured(tmp_path, RECORDS)
+    conversations, count = load_conversations([str(tmp_path)])
+    assert count == 3
+    assert [[turn['query'] for turn in turns] for turns in conversations] == [
+        ["How many squats for leg strength?", "and how many sets?"],
+        ["How much water should I drink?"],
+    ]
+    assert load_conversations([str(tmp_path)], limit=1)[1] == 1
+
+
+def test_agreement_compares_gate_and_retrieval():
+    results = [{'query': 'q1', 'recorded': {'gate': {'related': True}, 'retrieved': [1, 2]}},
+               {'query': 'q2', 'recorded': {'gate': {'related': True}, 'retrieved': [3, 4]}}]
+    replayed = [{'query': 'q1', 'gate': {'related': True}, 'retrieved': [1, 2]},
+                {'query': 'q2', 'gate': {'related': False}, 'retrieved': [3, 5]}]
+    assert agreement(results, replayed) == {
+        'gate': {'same': 1, 'changed': 1},
+        'retrieval': {'same': 1, 'changed': 1},
+        'retrieval_overlap': pytest.approx((1 + 1 / 3) / 2, abs=1e-4),
+    }
+
+
+@pytest.fixture
+def served(pipeline):
+    server = make_server('127.0.0.1', 0, pipeline.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_follow_ups_are_replayed_in_their_session(served, tmp_path, pipeline, monkeypatch):
+    sessions = []
+    open_session = pipeline.open_session
+
+    def spy(data, headers):
+        sessions.append(data.get('session_id'))
+        return open_session(data, headers)
+
+    monkeypatch.setattr(pipeline, 'open_session', spy)
+    captured(tmp_path, RECORDS)
+    conversations, _ = load_conversations([str(tmp_path)])
+    results, _ = asyncio.run(drive(served, conversations[:1], concurrency=2, speed=0))
+    assert [result['status'] for result in results] == [200, 200]
+    assert sessions[0] is None and sessions[1]
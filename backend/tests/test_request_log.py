@@ -0,0 +1,184 @@
+"""Request capture, per-request profiling and the rotating request log"""
+
+import asyncio
+import glob
+import gzip
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import request_log
+from request_log import Capture, RequestLog, log_files, open_profiler, read_records, save_profile
+
+PROFILE = {"X-Profile": "sample", "X-Admin-Token": "test-admin"}
+
+
+@pytest.fixture(autouse=True)
+def no_profile_left_open():
+    yield
+    if request_log._active is not None:
+        request_log._active.close()
+        request_log._active = None
+
+
+def test_one_request_is_profiled_at_a_time(tmp_path):
+    profiler = open_profiler('cprofile')
+    assert profiler is not None
+    assert open_profiler('sample') is None
+    with profiler.section('embed'):
+        sum(range(1000))
+    assert [path.endswith('embed.prof') for path in save_profile(profiler, str(tmp_path))] == [True]
+    again = open_profiler('cprofile')
+    assert again is not None
+    save_profile(again, str(tmp_path))
+
+
+def test_unknown_mode_is_not_profiled():
+    assert open_profiler('perf') is None
+    assert request_log._active is None
+
+
+def test_a_stale_profile_is_stopped_and_replaced(tmp_path):
+    stale = open_profiler('sample', max_seconds=0.05)
+    time.sleep(0.1)
+    fresh = open_profiler('sample', max_seconds=0.05)
+    assert fresh is not None and fresh is not stale
+    assert not stale._thread.is_alive()
+    # The stale owner's late save must not free the new profile's slot
+    assert save_profile(stale, str(tmp_path)) == []
+    assert request_log._active is fresh
+    save_profile(fresh, str(tmp_path))
+
+
+def test_sampler_stops_by_itself_after_max_seconds():
+    profiler = open_profiler('sample', sample_interval=0.001, max_seconds=0.05)
+    profiler._thread.join(2)
+    assert not profiler._thread.is_alive()
+
+
+def test_capture_finishes_once():
+    capture = Capture.begin('chat')
+    assert capture.finish(200)['status'] == 200
+    assert capture.finish(500) is None
+    assert request_log.current_capture() is None
+
+
+def test_stream_closed_before_its_body_releases_the_profile(client):
+    response = client.post('/chat/stream', json={"message": "what is the capital of france"},
+                           headers=PROFILE, buffered=False)
+    assert response.status_code == 200
+    assert response.headers['X-Profile-Id']
+    profiler = request_log._active
+    assert profiler is not None
+    # The client goes away before a single event is read
+    response.close()
+    assert request_log._active is None
+    assert not profiler._thread.is_alive()
+
+
+def test_streamed_response_is_profiled_to_the_end(client, pipeline):
+    response = client.post('/chat/stream', json={"message": "what is the capital of france"},
+                           headers=PROFILE)
+    assert b'event: done' in response.data
+    profile_id = response.headers['X-Profile-Id']
+    response.close()
+    assert request_log._active is None
+    assert os.path.exists(os.path.join(pipeline.PROFILE_DIR, profile_id, 'stacks.collapsed'))
+
+
+def test_async_stream_body_closed_unread_releases_the_profile(asgi):
+    async def events():
+        yield "event: token\n\n"
+
+    capture = Capture('chat_stream', open_profiler('sample'))
+    body = asgi.CapturedBody(events(), capture)
+    asyncio.run(body.aclose())
+    assert capture.finished
+    assert request_log._active is None
+
+
+def log_file(directory, pid, sequence, stamp='20260101T000000'):
+    path = directory / f"requests-{stamp}-{pid}-{sequence:04d}.jsonl.gz"
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({"pid": pid}) + '\n')
+    return path
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_records_round_trip_through_rotated_files(tmp_path):
+    log = RequestLog(str(tmp_path), rotate_bytes=200, flush_interval=0.01).start()
+    for i in range(20):
+        log.write({"i": i, "query": "how much protein"})
+    log.close()
+    files = log_files([str(tmp_path)])
+    assert len(files) > 1
+    assert [record["i"] for record in read_records(files)] == list(range(20))
+    assert log.stats() == {"written": 20, "dropped": 0}
+
+
+def test_full_queue_drops_and_counts(tmp_path):
+    log = RequestLog(str(tmp_path), queue_size=2)
+    for i in range(5):
+        log.write({"i": i})
+    assert log.dropped == 3
+
+
+def test_a_file_still_being_written_is_read_up_to_its_end(tmp_path):
+    path = tmp_path / 'requests-20260101T000000-1-0001.jsonl.gz'
+    with gzip.open(path, 'wb') as f:
+        f.write(b'{"i": 0}\n{"i": 1}\n{"i"')
+    data = path.read_bytes()
+    # No gzip trailer yet
+    path.write_bytes(data[:-8])
+    assert [record["i"] for record in read_records([str(path)])] == [0, 1]
+
+
+def test_rotation_prunes_only_this_process_and_exited_ones(tmp_path):
+    running = os.getppid()
+    exited = exited_pid()
+    others = [log_file(tmp_path, running, i) for i in range(1, 4)]
+    leftovers = [log_file(tmp_path, exited, i) for i in range(1, 4)]
+    log = RequestLog(str(tmp_path), rotate_bytes=100, backups=2, flush_interval=0.01).start()
+    for i in range(20):
+        log.write({"i": i, "query": "how much protein"})
+    log.close()
+    assert all(path.exists() for path in others)
+    assert not any(path.exists() for path in leftovers)
+    mine = glob.glob(str(tmp_path / f'requests-*-{os.getpid()}-*.jsonl.gz'))
+    assert len(mine) == 2
+
+
+class MemoryLog:
+    def __init__(self):
+        self.records = []
+
+    def sampled(self):
+        return True
+
+    def write(self, record):
+        self.records.append(record)
+
+
+@pytest.mark.parametrize('coalesce', [True, False])
+def test_stream_capture_has_the_pipeline_stages(client, pipeline, monkeypatch, coalesce):
+    log = MemoryLog()
+    monkeypatch.setattr(pipeline, 'request_log', log)
+    monkeypatch.setattr(pipeline, 'response_cache', None)
+    if not coalesce:
+        monkeypatch.setattr(pipeline, 'flights', None)
+    response = client.post('/chat/stream', json={"message": "how much protein should I eat daily"})
+    assert b'event: done' in response.data
+    response.close()
+    [record] = log.records
+    assert {'embed', 'retrieve', 'context', 'generate'} <= set(record['stages'])
+    assert record['retrieved'] and all(isinstance(hit, int) for hit in record['retrieved'])
+    assert record['status'] == 200
@@ -0,0 +1,62 @@
+"""Exact and near-duplicate response cache"""
+
+import json
+import time
+
+import numpy as np
+
+from response_cache import ResponseCache, normalize_query
+
+ANSWER = {"response": "Drink about two litres a day.", "sources": []}
+
+
+def test_normalized_questions_share_an_entry():
+    assert normalize_query("  How MUCH   water?? ") == "how much water"
+    assert normalize_query("कितना पानी।") == "कितना पानी"
+    cache = ResponseCache()
+    cache.put("How much water?", 'en', ANSWER)
+    assert cache.get("how much   WATER", 'en') == ANSWER
+    assert cache.get("how much water", 'hi') is None
+
+
+def test_entries_expire():
+    cache = ResponseCache(ttl=0.01)
+    cache.put("sleep", 'en', ANSWER)
+    time.sleep(0.02)
+    assert cache.get("sleep", 'en') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_byte_cap_evicts_least_recently_used():
+    # Room for two entries
+    entry = len(json.dumps(ANSWER).encode()) + len("second")
+    cache = ResponseCache(max_bytes=2 * entry)
+    cache.put("first", 'en', ANSWER)
+    cache.put("second", 'en', ANSWER)
+    cache.get("first", 'en')
+    cache.put("third", 'en', ANSWER)
+    assert cache.get("second", 'en') is None
+    assert cache.get("first", 'en') == ANSWER and cache.get("third", 'en') == ANSWER
+    assert cache.stats()['bytes'] <= 2 * entry
+
+
+def test_near_duplicate_embedding_hits_in_the_same_language():
+    cache = ResponseCache(similarity_threshold=0.99)
+    embedding = np.ones(1536, dtype=np.float32)
+    cache.put("how much water should I drink", 'en', ANSWER, embedding)
+    nearby = embedding.copy()
+    nearby[0] = 1.1
+    assert cache.get("how much water do I need", 'en', nearby) == ANSWER
+    assert cache.get("how much water do I need", 'hi', nearby) is None
+    other = np.zeros(1536, dtype=np.float32)
+    other[0] = 1.0
+    assert cache.get("what about protein", 'en', other) is None
+    assert cache.stats()['hits_near'] == 1
+
+
+def test_invalidate_drops_everything():
+    cache = ResponseCache()
+    embedding = np.ones(1536, dtype=np.float32)
+    cache.put("sleep", 'en', ANSWER, embedding)
+    cache.invalidate()
+    assert cache.get("sleep", 'en', embedding) is None
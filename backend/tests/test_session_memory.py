@@ -0,0 +1,86 @@
+"""Server-side conversation memory"""
+
+import pytest
+
+from chunking import estimate_tokens
+from session_memory import SessionStore, truncate_to_tokens
+
+SESSION = 'session-0001'
+
+
+def test_history_replays_recent_turns_in_order():
+    store = SessionStore()
+    store.record(SESSION, "How much protein do I need?", "About 1.6 g per kg.")
+    store.record(SESSION, "And on rest days?", "The same.")
+    assert store.history(SESSION) == [
+        {"role": "user", "content": "How much protein do I need?"},
+        {"role": "assistant", "content": "About 1.6 g per kg."},
+        {"role": "user", "content": "And on rest days?"},
+        {"role": "assistant", "content": "The same."},
+    ]
+    assert store.history('unknown-session') == []
+
+
+def test_history_stays_within_the_token_budget():
+    store = SessionStore(max_turns=4, token_budget=260)
+    for i in range(50):
+        store.record(SESSION, f"Question number {i} about training volume?", "Answer. " * 20)
+    history = store.history(SESSION)
+    assert sum(estimate_tokens(message["content"]) for message in history) <= 260
+    # Older questions survive as a summary note, newest last
+    assert history[0]["role"] == "system" and "Question number" in history[0]["content"]
+    assert history[-2]["content"] == "Question number 49 about training volume?"
+
+
+def test_long_answers_are_cut_to_whole_sentences():
+    text = "First sentence here. Second sentence follows. " * 20
+    cut = truncate_to_tokens(text, 10)
+    assert estimate_tokens(cut) <= 10 and cut.endswith('.')
+    assert truncate_to_tokens("short", 10) == "short"
+
+
+def test_sessions_are_evicted_least_recently_used():
+    store = SessionStore(max_sessions=2)
+    for name in ('session-aaaa', 'session-bbbb'):
+        store.record(name, "q", "a")
+    store.history('session-aaaa')
+    store.record('session-cccc', "q", "a")
+    assert store.history('session-bbbb') == [] and store.history('session-aaaa')
+    assert store.stats()['evictions'] == 1
+
+
+def test_byte_cap_and_expiry(monkeypatch):
+    store = SessionStore(max_bytes=4096, ttl=60)
+    for i in range(20):
+        store.record(f"session-{i:04d}", "q" * 100, "a" * 100)
+    assert store.stats()['bytes'] <= 4096 and store.stats()['sessions'] < 20
+
+    now = [1000.0]
+    monkeypatch.setattr('session_memory.time.monotonic', lambda: now[0])
+    store.record(SESSION, "q", "a")
+    now[0] += 61
+    assert store.history(SESSION) == []
+
+
+@pytest.mark.parametrize('session_id, valid', [
+    ("abcdEFGH_-12", True), ("short", False), ("has space in it", False), (None, False),
+])
+def test_valid_id(session_id, valid):
+    assert SessionStore.valid_id(session_id) is valid
+
+
+def test_follow_up_is_answered_with_the_earlier_turn(pipeline, client, monkeypatch):
+    histories = []
+    generate = pipeline.generate_response
+
+    def spy(user_query, context, history=None, language='en'):
+        histories.append(history)
+        return generate(user_query, context, history, language)
+
+    monkeypatch.setattr(pipeline, 'generate_response', spy)
+    first = client.post('/chat', json={"message": "How many squats should I do for leg strength?"}).get_json()
+    follow_up = client.post('/chat', json={"message": "and how many sets?",
+                                           "session_id": first["session_id"]}).get_json()
+    assert follow_up["session_id"] == first["session_id"]
+    assert follow_up["response"] != pipeline.OFF_TOPIC_MESSAGE
+    assert histories[-1][0] == {"role": "user", "content": "How many squats should I do for leg strength?"}
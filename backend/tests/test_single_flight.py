@@ -0,0 +1,180 @@
+"""Request coalescing for identical concurrent questions"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from single_flight import AsyncSingleFlight, Broadcast, SingleFlight
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+
+    def worker(i):
+        results[i] = target()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_callers_share_one_call():
+    flights = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def answer():
+        calls.append(1)
+        release.wait(5)
+        return "answer"
+
+    threading.Timer(0.1, release.set).start()
+    results = run_concurrently(5, lambda: flights.do('q', answer))
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert {result for result, _ in results} == {"answer"}
+    assert flights.coalesced == 4 and flights.in_flight() == 0
+
+
+def test_nothing_is_kept_once_the_call_finishes():
+    flights = SingleFlight()
+    assert flights.do('q', lambda: 1) == (1, False)
+    assert flights.do('q', lambda: 2) == (2, False)
+
+
+def test_followers_get_the_leaders_error():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ValueError("upstream down")
+
+    def call():
+        try:
+            flights.do('q', fail)
+        except ValueError as e:
+            return str(e)
+
+    threading.Timer(0.1, release.set).start()
+    assert run_concurrently(3, call) == ["upstream down"] * 3
+
+
+def test_only_a_followers_wait_is_timed():
+    flights = SingleFlight()
+    waits = []
+    release = threading.Event()
+
+    @contextmanager
+    def wait():
+        waits.append(threading.get_ident())
+        yield
+
+    threading.Timer(0.1, release.set).start()
+    run_concurrently(3, lambda: flights.do('q', lambda: release.wait(5), wait=wait))
+    assert len(waits) == 2
+
+
+def test_follower_times_out():
+    flights = SingleFlight(timeout=0.05)
+    release = threading.Event()
+    leader = threading.Thread(target=flights.do, args=('q', lambda: release.wait(5)))
+    leader.start()
+    while not flights.in_flight():
+        time.sleep(0.001)
+    with pytest.raises(TimeoutError):
+        flights.do('q', lambda: None)
+    release.set()
+    leader.join(5)
+
+
+def test_broadcast_replays_from_the_start():
+    broadcast = Broadcast()
+    broadcast.publish(1)
+    early = broadcast.read(1)
+    assert next(early) == 1
+    broadcast.publish(2)
+    broadcast.close()
+    assert list(early) == [2]
+    assert list(broadcast.read(1)) == [1, 2]
+
+
+def test_stream_is_produced_once_in_the_callers_context():
+    flights = SingleFlight()
+    request_id = contextvars.ContextVar('request_id', default=None)
+    release = threading.Event()
+    produced = []
+
+    def tokens():
+        produced.append(request_id.get())
+        release.wait(5)
+        yield from ["a", "b"]
+
+    request_id.set('leader')
+    first = flights.stream('q', tokens)
+    second = flights.stream('q', tokens)
+    release.set()
+    assert list(first) == list(second) == ["a", "b"]
+    assert produced == ['leader'] and flights.coalesced == 1
+
+
+def test_async_followers_share_the_task_and_time_their_wait():
+    async def scenario():
+        flights = AsyncSingleFlight()
+        calls = []
+        waits = []
+
+        async def answer():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        @contextmanager
+        def wait():
+            waits.append(1)
+            yield
+
+        results = await asyncio.gather(*[flights.do('q', answer, wait=wait) for _ in range(4)])
+        return calls, waits, results, flights
+
+    calls, waits, results, flights = asyncio.run(scenario())
+    assert len(calls) == 1 and len(waits) == 3
+    assert [shared for _, shared in results] == [False, True, True, True]
+    assert flights.in_flight() == 0
+
+
+def test_async_stream_is_shared():
+    async def scenario():
+        flights = AsyncSingleFlight()
+        calls = []
+
+        async def tokens():
+            calls.append(1)
+            for token in ["a", "b"]:
+                await asyncio.sleep(0.01)
+                yield token
+
+        async def read(events):
+            return [item async for item in events]
+
+        results = await asyncio.gather(read(flights.stream('q', tokens)), read(flights.stream('q', tokens)))
+        return calls, results
+
+    calls, results = asyncio.run(scenario())
+    assert calls == [1] and results == [["a", "b"], ["a", "b"]]
+
+
+def test_leader_server_timing_has_no_coalesce_stage(pipeline, client, monkeypatch):
+    monkeypatch.setattr(pipeline, 'SERVER_TIMING', True)
+    monkeypatch.setattr(pipeline, 'response_cache', None)
+    response = client.post('/chat', json={"message": "how many hours of sleep do I need"})
+    assert response.status_code == 200
+    stages = {part.split(';')[0].strip() for part in response.headers['Server-Timing'].split(',')}
+    assert 'generate' in stages and 'coalesce' not in stages
@@ -0,0 +1,106 @@
+"""Cold start: the memory-mapped index snapshot and lazy Supabase client"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from bm25_index import SNAPSHOT_TERMS, BM25Index
+from data_loader import iter_records, write_snapshot
+from embeddings import get_embedding
+from vector_index import SNAPSHOT_MANIFEST, VectorIndex, read_manifest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FILE = os.path.join(BACKEND_DIR, 'health_data.json')
+QUESTIONS = ["how much protein", "benefits of sleep", "पानी कितना पीना चाहिए"]
+
+
+@pytest.fixture(scope='module')
+def snapshot(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('snapshot'))
+    write_snapshot(iter_records(DATA_FILE), path)
+    return path
+
+
+def test_snapshot_searches_like_the_json_index(snapshot):
+    loaded, mapped = VectorIndex.from_json(DATA_FILE), VectorIndex.from_snapshot(snapshot)
+    assert len(mapped) == len(loaded)
+    for question in QUESTIONS:
+        query = get_embedding(question)
+        assert ([(row['title'], row['content']) for row in mapped.search(query, 0.0, 5)]
+                == [(row['title'], row['content']) for row in loaded.search(query, 0.0, 5)])
+
+
+def test_bm25_snapshot_searches_like_a_fresh_index(snapshot):
+    passages = VectorIndex.from_snapshot(snapshot).passages()
+    built, mapped = BM25Index(passages), BM25Index.from_snapshot(snapshot, passages)
+    for question in QUESTIONS:
+        assert mapped.search(question, 5) == built.search(question, 5)
+
+
+def test_outdated_snapshots_are_refused(snapshot, tmp_path):
+    manifest = read_manifest(snapshot)
+    copy = tmp_path / 'copy'
+    copy.mkdir()
+    for name in os.listdir(snapshot):
+        (copy / name).write_bytes(open(os.path.join(snapshot, name), 'rb').read())
+    passages = VectorIndex.from_snapshot(snapshot).passages()
+
+    terms_file = copy / manifest['files'][SNAPSHOT_TERMS]
+    terms = json.loads(terms_file.read_text(encoding='utf-8'))
+    terms_file.write_text(json.dumps(dict(terms, tokenizer=1)), encoding='utf-8')
+    with pytest.raises(ValueError, match='tokenizer'):
+        BM25Index.from_snapshot(str(copy), passages)
+
+    terms_file.write_text(json.dumps(dict(terms, kb_version='other')), encoding='utf-8')
+    with pytest.raises(ValueError, match='different set of passages'):
+        BM25Index.from_snapshot(str(copy), passages)
+
+    (copy / SNAPSHOT_MANIFEST).write_text(json.dumps(dict(manifest, version=0)), encoding='utf-8')
+    with pytest.raises(ValueError, match='rebuild'):
+        VectorIndex.from_snapshot(str(copy))
+
+
+def test_publishing_a_snapshot_replaces_the_previous_one_whole(tmp_path):
+    path = str(tmp_path / 'published')
+    write_snapshot(iter_records(DATA_FILE), path)
+    before = read_manifest(path)
+    reader = VectorIndex.from_snapshot(path)
+    passages = reader.passages()
+
+    records = list(iter_records(DATA_FILE))[:3]
+    write_snapshot(records, path)
+    after = read_manifest(path)
+    assert after['kb_version'] != before['kb_version']
+    # Only the files the new manifest names are left, and they open together
+    assert sorted(os.listdir(path)) == sorted([SNAPSHOT_MANIFEST] + list(after['files'].values()))
+    assert len(VectorIndex.from_snapshot(path)) < len(reader)
+    assert len(BM25Index.from_snapshot(path, VectorIndex.from_snapshot(path).passages())) < len(passages)
+    # An index opened before the publish keeps answering from its own files...
+    assert reader.search(get_embedding(QUESTIONS[0]), 0.0, 5)
+    # ...and its passages are not paired with the new snapshot's postings
+    with pytest.raises(ValueError, match='different set of passages'):
+        BM25Index.from_snapshot(path, passages)
+
+
+def test_app_starts_from_a_snapshot_without_supabase(snapshot, llm):
+    """A fresh interpreter, as on a serverless cold start: the Supabase SDK is never imported"""
+    env = dict(os.environ, RETRIEVAL_BACKEND='local', LOCAL_INDEX_SOURCE='snapshot',
+               INDEX_SNAPSHOT_PATH=snapshot, SUPABASE_URL='', SUPABASE_KEY='', DEEPSEEK_API_KEY='test',
+               DEEPSEEK_CHAT_URL=f"http://127.0.0.1:{llm.server_address[1]}/v1/chat/completions")
+    probe = ("import sys, app\n"
+             "response = app.app.test_client().post('/chat', json={'message': 'how much protein'})\n"
+             "print(response.status_code, 'supabase' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', probe], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.stdout.splitlines()[-1] == '200 False', result.stderr
+    assert f"from {snapshot}" in result.stdout
+
+
+def test_supabase_client_needs_its_settings(pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, '_supabase', None)
+    monkeypatch.setattr(pipeline, 'SUPABASE_URL', None)
+    with pytest.raises(RuntimeError, match='SUPABASE_URL'):
+        pipeline.get_supabase()
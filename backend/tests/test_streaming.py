@@ -0,0 +1,47 @@
+"""Server-Sent Events from /chat/stream"""
+
+import json
+
+from llm_client import LLMClient
+from mock_deepseek import DEFAULT_REPLY
+
+
+def read_events(body):
+    """(event, data) pairs of an SSE body"""
+    events = []
+    for block in body.decode('utf-8').split('\n\n'):
+        if not block.strip():
+            continue
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields.get('event'), json.loads(fields['data'])))
+    return events
+
+
+def test_stream_forwards_tokens_then_sources(client, pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, 'response_cache', None)
+    response = client.post('/chat/stream', json={"message": "how much water should I drink"})
+    assert response.mimetype == 'text/event-stream'
+    events = read_events(response.data)
+    kinds = [kind for kind, _ in events]
+    assert kinds[-1] == 'done' and set(kinds[:-1]) == {'token'} and len(kinds) > 2
+    assert "".join(data['token'] for kind, data in events[:-1]) == DEFAULT_REPLY
+    assert events[-1][1]['sources']
+
+
+def test_off_topic_question_is_one_event(client):
+    events = read_events(client.post('/chat/stream', json={"message": "recommend a movie"}).data)
+    assert [kind for kind, _ in events] == ['token', 'done']
+    assert events[1][1]['sources'] == []
+
+
+def test_empty_message_is_rejected(client):
+    assert client.post('/chat/stream', json={"message": "  "}).status_code == 400
+
+
+def test_client_yields_deltas_and_reports_usage(llm):
+    usage = []
+    client = LLMClient(f"http://127.0.0.1:{llm.server_address[1]}/v1/chat/completions", 'test',
+                       on_usage=usage.append)
+    tokens = list(client.stream({"messages": [{"role": "user", "content": "hi"}]}))
+    assert len(tokens) > 1 and "".join(tokens) == DEFAULT_REPLY
+    assert usage and usage[0]['completion_tokens'] == len(DEFAULT_REPLY.split(' '))
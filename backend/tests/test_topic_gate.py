@@ -0,0 +1,78 @@
+from bench_topic_gate import CORPUS, legacy_is_health_fitness_related
+from topic_gate import TopicGate
+
+gate = TopicGate()
+
+
+def test_english_keywords_with_inflections():
+    assert gate.classify("Any good workouts for beginners?").related
+    assert gate.classify("How do I stop stretching wrong?", language='en').related
+    assert not gate.classify("Who won the cricket match?", language='en').related
+
+
+def test_devanagari_keywords_with_case_endings():
+    assert gate.classify("व्यायामाने काय फायदे होतात?", language='mr').related
+    assert gate.classify("मुझे रोज कितना पानी पीना चाहिए?", language='hi').related
+
+
+def test_keyword_inside_another_word_is_not_a_match():
+    # जिम must not match the start of जिम्मेदारी
+    assert not gate.classify("यह मेरी जिम्मेदारी है", language='hi').related
+    assert not gate.classify("bodybuilding", language='en').related
+
+
+def test_marathi_detected_as_hindi_still_matches_marathi_keywords():
+    # A tie between Hindi and Marathi markers is detected as Hindi
+    for query in ("धावणे चांगले का", "कॅलरी"):
+        assert gate.classify(query).related
+        assert gate.classify(query, language='hi').related
+
+
+def test_misdetected_language_falls_back_to_every_keyword():
+    assert gate.classify("what is व्यायाम", language='en').related
+
+
+def test_more_keywords_raise_the_score():
+    one = gate.classify("protein", language='en')
+    two = gate.classify("protein and sleep", language='en')
+    assert one.method == 'keyword' and two.score > one.score
+
+
+def test_embedding_fallback_only_without_keywords():
+    calls = []
+
+    def embed(query):
+        calls.append(query)
+        return [1.0, 0.0]
+
+    fallback = TopicGate(centroids=[[1.0, 0.0]], centroid_threshold=0.8)
+    assert fallback.classify("exercise", embed=embed).method == 'keyword'
+    assert calls == []
+    match = fallback.classify("unrelated words", embed=embed)
+    assert match.related and match.method == 'embedding'
+
+
+def test_benchmark_corpus_is_classified_correctly():
+    assert [gate.classify(query).related for query, _ in CORPUS] == [label for _, label in CORPUS]
+    # The substring scan it replaced gets some of them wrong
+    assert any(legacy_is_health_fitness_related(query) != label for query, label in CORPUS)
+
+
+def test_app_fallback_follows_the_live_knowledge_base(pipeline, monkeypatch):
+    from knowledge_base import KnowledgeBase
+    from vector_index import VectorIndex
+
+    monkeypatch.setattr(pipeline, 'TOPIC_EMBEDDING_FALLBACK', True)
+    monkeypatch.setattr(pipeline, 'topic_gate', TopicGate())
+    monkeypatch.setattr(pipeline, '_topic_source', None)
+    # Still warming up: only keywords are checked
+    monkeypatch.setattr(pipeline, 'knowledge_base', KnowledgeBase())
+    assert pipeline.classify_topic("an unrelated question").method == 'keyword'
+    assert pipeline.topic_gate.centroids is None
+
+    records = [{"title": "Quiet", "content": "an unrelated question"}]
+    monkeypatch.setattr(pipeline, 'knowledge_base',
+                        KnowledgeBase(VectorIndex.from_records(records), version='v1', generation=1))
+    match = pipeline.classify_topic("an unrelated question")
+    assert match.method == 'embedding' and match.score > 0
+    assert len(pipeline.topic_gate.centroids) == 1
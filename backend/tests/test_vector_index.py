@@ -0,0 +1,62 @@
+"""In-process cosine-similarity index"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from embeddings import embed_many, get_embedding
+from vector_index import VectorIndex
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'health_data.json')
+
+
+@pytest.fixture(scope='module')
+def index():
+    return VectorIndex.from_json(DATA_FILE)
+
+
+def brute_force(index, query, threshold, count):
+    matrix = np.asarray(index.embeddings(), dtype=np.float64)
+    query = np.asarray(query, dtype=np.float64)
+    similarities = matrix @ (query / np.linalg.norm(query))
+    order = [i for i in np.argsort(-similarities, kind='stable') if similarities[i] > threshold]
+    return [index.rows[i]['id'] for i in order[:count]]
+
+
+@pytest.mark.parametrize('question', ["how much protein", "benefits of sleep", "पानी"])
+def test_search_matches_brute_force(index, question):
+    query = get_embedding(question)
+    hits = index.search(query, match_threshold=0.0, match_count=5)
+    assert [hit['id'] for hit in hits] == brute_force(index, query, 0.0, 5)
+    similarities = [hit['similarity'] for hit in hits]
+    assert similarities == sorted(similarities, reverse=True)
+
+
+def test_threshold_and_count_limit_the_hits(index):
+    query = get_embedding("workout")
+    assert len(index.search(query, match_threshold=0.0, match_count=2)) == 2
+    assert index.search(query, match_threshold=1.01, match_count=5) == []
+    assert index.search(query, match_count=0) == []
+
+
+def test_zero_query_finds_nothing(index):
+    assert index.search(np.zeros(1536)) == []
+    assert index.search_many(np.zeros((1, 1536))) == [[]]
+
+
+def test_search_many_equals_search_per_query(index):
+    queries = embed_many(["protein", "sleep", "stress"])
+    for batched, single in zip(index.search_many(queries, 0.0, 4), [index.search(q, 0.0, 4) for q in queries]):
+        assert [hit['id'] for hit in batched] == [hit['id'] for hit in single]
+        assert [hit['similarity'] for hit in batched] == pytest.approx([hit['similarity'] for hit in single])
+
+
+def test_rows_with_stored_embeddings_are_used_as_is():
+    embeddings = np.eye(3, 1536, dtype=np.float32)
+    records = [{"id": 10 + i, "title": f"t{i}", "content": "c", "embedding": json.dumps(row.tolist())}
+               for i, row in enumerate(embeddings)]
+    index = VectorIndex.from_records(records)
+    [hit] = index.search(embeddings[1], match_threshold=0.5, match_count=3)
+    assert hit['id'] == 11 and hit['similarity'] == pytest.approx(1.0)
@@ -0,0 +1,168 @@
+"""Server-side speech: sentence chunking, the audio cache and /voice"""
+
+import asyncio
+import io
+import threading
+import wave
+
+import pytest
+
+from admission import RateLimiter
+from tts import (AudioCache, SpeechPipeline, ToneEngine, TTSEngine, WavJoiner, read_wav, split_for_speech,
+                 valid_key)
+
+
+class FlakyEngine(ToneEngine):
+    """Fails on sentences mentioning 'fail' and blocks on 'stall' until released"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def synthesize(self, text, voice):
+        if 'fail' in text:
+            raise RuntimeError("engine crashed")
+        if 'stall' in text:
+            self.release.wait(5)
+        return super().synthesize(text, voice)
+
+
+class CountingEngine(ToneEngine):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def synthesize(self, text, voice):
+        self.calls += 1
+        return super().synthesize(text, voice)
+
+
+@pytest.fixture
+def speech(tmp_path):
+    return SpeechPipeline(CountingEngine(), AudioCache(str(tmp_path)))
+
+
+def test_text_is_split_into_spoken_sentences():
+    assert split_for_speech("**Drink water.** Ok. Sleep eight hours every night! 💪") == [
+        "Drink water. Ok. Sleep eight hours every night!"]
+    assert split_for_speech("पानी पिएं और रोज़ व्यायाम करें। नींद पूरी लें और आराम करें।") == [
+        "पानी पिएं और रोज़ व्यायाम करें।", "नींद पूरी लें और आराम करें।"]
+
+
+def test_repeated_sentences_are_synthesized_once(speech):
+    chunks = speech.chunks("Drink water through the day. Sleep eight hours every night.", 'en')
+    assert all(valid_key(key) for _, key, _ in chunks)
+    first = b''.join(speech.stream(chunks))
+    second = b''.join(speech.stream(chunks))
+    assert first == second and speech.engine.calls == 2
+    assert (speech.cache.hits, speech.cache.misses) == (2, 2)
+
+
+def test_fetching_prefetched_audio_counts_one_lookup(speech):
+    [(_, key, _)] = chunks = speech.chunks("Drink water through the day.", 'en')
+    speech.prefetch(chunks)[0].result()
+    speech.prefetch(chunks)
+    assert speech.audio_path(key) == speech.cache.file_for(key)
+    assert (speech.cache.hits, speech.cache.misses) == (1, 1)
+
+
+def test_stream_skips_failed_sentences_and_ends_at_a_timeout(tmp_path):
+    engine = FlakyEngine()
+    speech = SpeechPipeline(engine, AudioCache(str(tmp_path)), timeout=0.2)
+    chunks = speech.chunks("Drink water through the day. This one will fail to speak. "
+                           "Sleep eight hours every night. Then this one will stall forever. "
+                           "Never reached after the stall.", 'en')
+    stream = b''.join(speech.stream(chunks))
+    engine.release.set()
+    expected = b''.join(read_wav(engine.synthesize(sentence, None))[1]
+                        for sentence in ("Drink water through the day.", "Sleep eight hours every night."))
+    assert stream[:4] == b'RIFF' and stream.endswith(expected)
+    assert len(stream) == 44 + len(expected)
+
+
+def test_async_stream_skips_failed_sentences_and_ends_at_a_timeout(tmp_path):
+    engine = FlakyEngine()
+    speech = SpeechPipeline(engine, AudioCache(str(tmp_path)), timeout=0.2)
+    chunks = speech.chunks("Drink water through the day. This one will fail to speak. "
+                           "Then this one will stall forever. Never reached after the stall.", 'en')
+
+    async def read():
+        return b''.join([part async for part in speech.astream(chunks)])
+
+    stream = asyncio.run(read())
+    engine.release.set()
+    expected = read_wav(engine.synthesize("Drink water through the day.", None))[1]
+    assert stream[:4] == b'RIFF' and len(stream) == 44 + len(expected)
+
+
+def test_a_full_synthesis_queue_turns_requests_away(tmp_path, pipeline, client, monkeypatch):
+    engine = FlakyEngine()
+    speech = SpeechPipeline(engine, AudioCache(str(tmp_path)), workers=1, max_queued=1)
+    monkeypatch.setattr(pipeline, 'speech', speech)
+    try:
+        assert client.post('/voice', json={"text": "Let this sentence stall for a while."}).status_code == 200
+        response = client.post('/voice', json={"text": "Drink water through the day."},
+                               headers={"Accept": "audio/wav"})
+        assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+        # Audio already cached (or being synthesized) is still served
+        assert client.post('/voice', json={"text": "Let this sentence stall for a while."}).status_code == 200
+    finally:
+        engine.release.set()
+
+
+def test_engines_must_implement_synthesize():
+    with pytest.raises(TypeError):
+        TTSEngine()
+
+
+def test_joined_stream_is_one_wav(tmp_path):
+    engine = ToneEngine()
+    paths = []
+    for i, text in enumerate(("one", "two words")):
+        paths.append(tmp_path / f"{i}.wav")
+        paths[-1].write_bytes(engine.synthesize(text, None))
+    joiner = WavJoiner()
+    stream = b''.join(joiner.append(str(path)) for path in paths)
+    frames = b''.join(read_wav(path.read_bytes())[1] for path in paths)
+    assert stream.endswith(frames) and stream[:4] == b'RIFF'
+    assert wave.open(io.BytesIO(stream)).getframerate() == engine.framerate
+
+
+def test_cache_drops_least_recently_used_audio(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=250)
+    keys = [AudioCache.key('tone', 'v', 'en', str(i)) for i in range(3)]
+    for key in keys:
+        cache.put(key, b'x' * 100)
+    assert cache.get(keys[0]) is None and cache.get(keys[2]) is not None
+    assert cache.stats()['bytes'] <= 250
+
+
+def test_voice_rejects_text_over_the_limit(pipeline, client):
+    text = "a" * (pipeline.VOICE_MAX_CHARS + 1)
+    response = client.post('/voice', json={"text": text})
+    assert response.status_code == 413
+    assert client.post('/voice', json={"text": text[:-1]}).status_code == 200
+
+
+def test_voice_is_rate_limited(pipeline, client, monkeypatch):
+    monkeypatch.setattr(pipeline, 'rate_limiter', RateLimiter(rate=0.001, burst=2))
+    assert [client.post('/voice', json={"text": "Drink water"}).status_code
+            for _ in range(3)] == [200, 200, 429]
+
+
+def test_voice_serves_sentence_audio(pipeline, client, speech, monkeypatch):
+    monkeypatch.setattr(pipeline, 'speech', speech)
+    body = client.post('/voice', json={"text": "Drink water through the day. Sleep eight hours."}).get_json()
+    assert [chunk["text"] for chunk in body["chunks"]] == ["Drink water through the day.", "Sleep eight hours."]
+    audio = client.get(body["chunks"][0]["url"])
+    assert audio.status_code == 200 and audio.mimetype == 'audio/wav'
+    audio.close()
+    assert client.get('/voice/audio/not-a-key.wav').status_code == 404
+
+
+def test_voice_streams_one_wav(pipeline, client, speech, monkeypatch):
+    monkeypatch.setattr(pipeline, 'speech', speech)
+    response = client.post('/voice', json={"text": "Drink water. Sleep eight hours every night."},
+                           headers={"Accept": "audio/wav"})
+    assert response.mimetype == 'audio/wav' and response.get_data()[:4] == b'RIFF'
+    response.close()
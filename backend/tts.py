@@ -0,0 +1,396 @@
+"""
+Server-side text-to-speech for /voice
+Responses are split into sentences, each sentence is synthesized by a local
+engine (espeak-ng, any stdin-to-WAV command such as piper, or a test tone)
+and stored in a content-addressed on-disk cache keyed by engine, voice,
+language and text, so a repeated answer costs no synthesis at all.
+
+Audio is served either as one WAV file per sentence (cache files, with HTTP
+range support) or as a single WAV stream that starts with the first
+sentence while the later ones are still being synthesized
+"""
+
+import abc
+import asyncio
+import hashlib
+import io
+import math
+import os
+import re
+import shlex
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from admission import Overloaded
+from chunking import split_sentences
+from language import detect_language
+
+# Voices are passed to engines on the command line; keep them to plain names
+_VOICE = re.compile(r'^[A-Za-z0-9_.+-]{1,64}$')
+_AUDIO_KEY = re.compile(r'^[0-9a-f]{64}$')
+# Markdown and emoji the browser-side cleanTextForSpeech() also drops
+_NOT_SPOKEN = re.compile(r'[*_#`>|~]|[\U0001F300-\U0001FAFF☀-➿]')
+_WHITESPACE = re.compile(r'\s+')
+_SPACE_BEFORE_PUNCTUATION = re.compile(r'\s+(?=[.,!?;:।])')
+_LANGUAGE = re.compile(r'^[a-z]{2,3}$')
+
+# Sentences shorter than this are spoken together with the next one
+MIN_CHUNK_CHARS = 24
+
+
+def valid_voice(voice):
+    return isinstance(voice, str) and bool(_VOICE.match(voice))
+
+
+def valid_key(key):
+    return bool(_AUDIO_KEY.match(key))
+
+
+def speech_language(text, requested=None):
+    """Two-letter language for synthesis: the client's choice, else detected from the text"""
+    language = requested.split('-')[0].lower() if isinstance(requested, str) else ''
+    if _LANGUAGE.match(language):
+        return language
+    return detect_language(text)
+
+
+def split_for_speech(text):
+    """Sentences to synthesize one at a time, with markup removed"""
+    text = _WHITESPACE.sub(' ', _NOT_SPOKEN.sub('', text)).strip()
+    text = _SPACE_BEFORE_PUNCTUATION.sub('', text)
+    chunks = []
+    for sentence in split_sentences(text):
+        if chunks and len(chunks[-1]) < MIN_CHUNK_CHARS:
+            chunks[-1] += ' ' + sentence
+        else:
+            chunks.append(sentence)
+    return chunks
+
+
+def read_wav(data):
+    """(channels, sample width, frame rate) and the PCM frames of a WAV file"""
+    with wave.open(io.BytesIO(data), 'rb') as f:
+        return (f.getnchannels(), f.getsampwidth(), f.getframerate()), f.readframes(f.getnframes())
+
+
+def streaming_wav_header(channels, sampwidth, framerate):
+    """WAV header for audio of unknown length (sizes set to the maximum)"""
+    size = 0xFFFFFFFF
+    return (b'RIFF' + struct.pack('<I', size) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, framerate,
+                                    framerate * channels * sampwidth, channels * sampwidth,
+                                    sampwidth * 8)
+            + b'data' + struct.pack('<I', size - 36))
+
+
+class WavJoiner:
+    """Turns per-sentence WAV files into the parts of one WAV stream"""
+
+    def __init__(self):
+        self.params = None
+
+    def append(self, path):
+        """Bytes to send for the next file: header and frames for the first, frames after"""
+        with open(path, 'rb') as f:
+            params, frames = read_wav(f.read())
+        if self.params is None:
+            self.params = params
+            return streaming_wav_header(*params) + frames
+        if params != self.params:
+            # Engines use one format; a mismatched chunk cannot be appended
+            print(f"Skipping TTS chunk with format {params}, stream is {self.params}")
+            return b''
+        return frames
+
+
+class TTSEngine(abc.ABC):
+    """Synthesizes one sentence into WAV bytes"""
+
+    name = None
+    # Default voice per language
+    voices = {}
+
+    def default_voice(self, language):
+        return self.voices.get(language, language)
+
+    @abc.abstractmethod
+    def synthesize(self, text, voice):
+        """WAV bytes for one sentence"""
+
+
+class EspeakEngine(TTSEngine):
+    """espeak-ng (or espeak): small, offline, speaks English, Hindi and Marathi"""
+
+    name = 'espeak'
+    voices = {'en': 'en-us', 'hi': 'hi', 'mr': 'mr'}
+
+    def __init__(self, speed=160):
+        self.binary = shutil.which('espeak-ng') or shutil.which('espeak')
+        if self.binary is None:
+            raise RuntimeError("TTS_ENGINE=espeak needs espeak-ng on the PATH")
+        self.speed = speed
+
+    def synthesize(self, text, voice):
+        return subprocess.run([self.binary, '--stdout', '-s', str(self.speed), '-v', voice],
+                              input=text.encode(), capture_output=True, check=True,
+                              timeout=60).stdout
+
+
+class CommandEngine(TTSEngine):
+    """Any local command that reads text on stdin and writes a WAV file to stdout
+
+    {voice} in the command is replaced with the voice, e.g. for piper:
+    TTS_COMMAND='piper --model voices/{voice}.onnx --output_file /dev/stdout'
+    """
+
+    name = 'command'
+
+    def __init__(self, command):
+        if not command:
+            raise RuntimeError("TTS_ENGINE=command needs TTS_COMMAND")
+        self.args = shlex.split(command)
+
+    def synthesize(self, text, voice):
+        args = [arg.replace('{voice}', voice) for arg in self.args]
+        return subprocess.run(args, input=text.encode(), capture_output=True, check=True,
+                              timeout=60).stdout
+
+
+class ToneEngine(TTSEngine):
+    """Offline stand-in: a short beep per word, for tests and benchmarks"""
+
+    name = 'tone'
+
+    def __init__(self, framerate=16000, delay=0.0):
+        self.framerate = framerate
+        # Simulated synthesis time per sentence
+        self.delay = delay
+
+    def synthesize(self, text, voice):
+        time.sleep(self.delay)
+        beep = [int(8000 * math.sin(2 * math.pi * 440 * i / self.framerate))
+                for i in range(self.framerate // 10)]
+        gap = [0] * (self.framerate // 20)
+        samples = (beep + gap) * max(1, len(text.split()))
+        output = io.BytesIO()
+        with wave.open(output, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self.framerate)
+            f.writeframes(struct.pack(f'<{len(samples)}h', *samples))
+        return output.getvalue()
+
+
+def load_engine(name, command=None):
+    """Engine for TTS_ENGINE, or None when server-side speech is off"""
+    if not name:
+        return None
+    if name == 'espeak':
+        return EspeakEngine()
+    if name == 'command':
+        return CommandEngine(command)
+    if name == 'tone':
+        return ToneEngine()
+    raise ValueError(f"Unknown TTS_ENGINE {name!r} (expected espeak, command or tone)")
+
+
+class AudioCache:
+    """Content-addressed WAV files under one directory, oldest dropped past a byte cap"""
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+        self._bytes = sum(os.path.getsize(file) for file, _ in self._files())
+
+    @staticmethod
+    def key(engine, voice, language, text):
+        return hashlib.sha256('\0'.join((engine, voice, language, text)).encode()).hexdigest()
+
+    def file_for(self, key):
+        return os.path.join(self.path, key[:2], key + '.wav')
+
+    def get(self, key, count=True):
+        """Path of the cached audio or None; count=False leaves the hit/miss counters alone"""
+        path = self.file_for(key)
+        try:
+            # Recently played audio is kept longest
+            os.utime(path)
+        except FileNotFoundError:
+            path = None
+        if count:
+            with self._lock:
+                if path is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        return path
+
+    def put(self, key, data):
+        path = self.file_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._bytes += len(data)
+            over = self._bytes > self.max_bytes
+        if over:
+            self._prune()
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._bytes}
+
+    def _files(self):
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                if name.endswith('.wav'):
+                    file = os.path.join(directory, name)
+                    yield file, os.path.getmtime(file)
+
+    def _prune(self):
+        """Delete least recently used files until the cache is at 90% of its cap"""
+        files = sorted(self._files(), key=lambda item: item[1])
+        total = sum(os.path.getsize(file) for file, _ in files)
+        for file, _ in files:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                size = os.path.getsize(file)
+                os.remove(file)
+                total -= size
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._bytes = total
+
+
+class SpeechPipeline:
+    """Sentence chunking, synthesis on a small worker pool and the audio cache
+
+    Each sentence of a /voice request is looked up in the cache once, by
+    prefetch(); fetching its audio afterwards is not counted again. A request
+    arriving while max_queued sentences already wait for synthesis is turned
+    away with Overloaded, and a stream gives up on a sentence still not
+    synthesized after timeout seconds
+    """
+
+    def __init__(self, engine, cache, workers=2, max_queued=64, timeout=60):
+        self.engine = engine
+        self.cache = cache
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tts')
+        # Audio being synthesized: key -> future, so concurrent requests share it
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def chunks(self, text, language, voice=None):
+        """[(sentence, audio key, voice)] for a response"""
+        voice = voice or self.engine.default_voice(language)
+        return [(sentence, self.cache.key(self.engine.name, voice, language, sentence), voice)
+                for sentence in split_for_speech(text)]
+
+    def prefetch(self, chunks):
+        """Start synthesizing every chunk not in the cache; returns their futures in order
+
+        Raises Overloaded, before starting anything, when the synthesis queue is full
+        """
+        cached = {key: self.cache.get(key) for _, key, _ in chunks}
+        with self._lock:
+            if (any(path is None and key not in self._pending for key, path in cached.items())
+                    and len(self._pending) >= self.max_queued):
+                raise Overloaded("Too many sentences are waiting for speech synthesis",
+                                 1.0, 'tts_queue')
+            return [self._submit(key, sentence, voice, cached[key]) for sentence, key, voice in chunks]
+
+    def audio_path(self, key, timeout=None):
+        """Cached file for a key, waiting for it if it is still being synthesized"""
+        path = self.cache.get(key, count=False)
+        if path is not None:
+            return path
+        with self._lock:
+            future = self._pending.get(key)
+        return future.result(timeout or self.timeout) if future is not None else None
+
+    def stream(self, chunks):
+        """One WAV stream for all chunks, yielded sentence by sentence as audio is ready
+
+        A sentence whose synthesis fails is left out; one that times out ends
+        the stream. Every part sent is whole, and the header leaves the length
+        open, so what was sent plays as a complete file. Raises Overloaded
+        (from prefetch) before the first byte
+        """
+        futures = self.prefetch(chunks)
+
+        def parts():
+            joiner = WavJoiner()
+            for future in futures:
+                try:
+                    path = future.result(self.timeout)
+                except FutureTimeout:
+                    print("TTS timed out, ending the audio stream")
+                    return
+                except Exception as e:
+                    print(f"Skipping TTS chunk that failed: {e}")
+                    continue
+                yield joiner.append(path)
+
+        return parts()
+
+    def astream(self, chunks):
+        """stream() for an event loop: waits for each sentence without blocking it"""
+        futures = self.prefetch(chunks)
+
+        async def parts():
+            joiner = WavJoiner()
+            for future in futures:
+                try:
+                    # shield: the synthesis may be shared with other requests, so it is not cancelled
+                    path = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                                  self.timeout)
+                except asyncio.TimeoutError:
+                    print("TTS timed out, ending the audio stream")
+                    return
+                except Exception as e:
+                    print(f"Skipping TTS chunk that failed: {e}")
+                    continue
+                yield joiner.append(path)
+
+        return parts()
+
+    def _submit(self, key, sentence, voice, path=None):
+        """Future for a sentence's audio; the caller holds self._lock"""
+        future = self._pending.get(key)
+        if future is None and path is not None:
+            future = Future()
+            future.set_result(path)
+        elif future is None:
+            future = self._pending[key] = self._executor.submit(self._synthesize, key, sentence, voice)
+        return future
+
+    def _synthesize(self, key, sentence, voice):
+        try:
+            # Another process may have written it since prefetch() looked
+            path = self.cache.get(key, count=False)
+            if path is None:
+                path = self.cache.put(key, self.engine.synthesize(sentence, voice))
+            return path
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
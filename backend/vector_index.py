@@ -0,0 +1,503 @@
+"""
+In-process vector index for the fitness knowledge base
+Keeps every knowledge-base embedding in one contiguous float32 matrix so
+/chat retrieval is a single matrix-vector product instead of a Supabase RPC
+
+An index can be saved as a snapshot directory and reopened with mmap:
+- embeddings.npy: normalized rows, float32 or int8 (with scales.npy, one
+  float per row, for the int8 form: 4x smaller)
+- ids.npy / offsets.npy: row -> passage id, and row -> byte range of its
+  JSON-encoded title/content/metadata in passages.bin
+- languages.npy: row -> language code, for per-language partitions
+- manifest.json: format version, dtype, row count, a content version and
+  the stored name of every file above
+
+Files are stored under a name carrying a digest of their content
+(embeddings.<digest>.npy) and never rewritten in place, so publishing a new
+snapshot is one rename of manifest.json: a reader sees the old set of files
+or the new one, never a mix
+
+Nothing is parsed or copied at startup; every gunicorn worker maps the same
+files, so the pages live once in the OS page cache however many workers run
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+
+from chunking import chunk_record
+from embeddings import EMBEDDING_DIM, embed_many
+from knowledge_base import PAGE_SIZE, select_pages
+from language import Partitions, language_codes
+
+
+SNAPSHOT_VERSION = 3
+SNAPSHOT_MANIFEST = 'manifest.json'
+SNAPSHOT_MATRIX = 'embeddings.npy'
+SNAPSHOT_SCALES = 'scales.npy'
+SNAPSHOT_IDS = 'ids.npy'
+SNAPSHOT_OFFSETS = 'offsets.npy'
+SNAPSHOT_PASSAGES = 'passages.bin'
+SNAPSHOT_LANGUAGES = 'languages.npy'
+SNAPSHOT_DTYPES = ('float32', 'int8')
+# Times a reader rereads the manifest when a concurrent publish pruned the files it named
+SNAPSHOT_OPEN_ATTEMPTS = 3
+# <stem>.<first 16 hex digits of the content's sha256>.<suffix>
+_STORED_NAME = re.compile(r'^\w+\.[0-9a-f]{16}\.\w+$')
+
+# Rows dequantized at a time when searching an int8 matrix (bounds the temporary)
+QUANTIZED_BLOCK_ROWS = 4096
+
+
+def normalize_rows(matrix):
+    """Scale rows to unit length (zero rows stay zero)"""
+    matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def quantize_rows(matrix):
+    """Symmetric per-row int8 quantization: row ~= int8 row * scale"""
+    peaks = np.abs(matrix).max(axis=1) if len(matrix) else np.empty(0, dtype=np.float32)
+    scales = np.where(peaks > 0, peaks / 127.0, 1.0).astype(np.float32)
+    return np.rint(matrix / scales[:, None]).astype(np.int8), scales
+
+
+class PassageTable:
+    """Read-only sequence of passage rows decoded on access from a mapped blob
+
+    Only the rows a search returns are ever decoded, so the knowledge-base
+    text is not duplicated into every worker's heap
+    """
+
+    def __init__(self, ids, offsets, blob, version=None):
+        self.ids = ids
+        self.offsets = offsets
+        self.blob = blob
+        # Content version of the snapshot the rows were mapped from
+        self.version = version
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        i %= len(self)
+        row = json.loads(bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]))
+        row['id'] = int(self.ids[i])
+        return row
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class VectorIndex:
+    """Cosine-similarity index mirroring the match_fitness_knowledge RPC"""
+
+    def __init__(self, ids, titles, contents, embeddings, parent_ids=None, chunk_indexes=None):
+        # Passage rows; rows stored before chunking are their own parent
+        parent_ids = parent_ids if parent_ids is not None else [None] * len(ids)
+        chunk_indexes = chunk_indexes if chunk_indexes is not None else [0] * len(ids)
+        self.rows = [
+            {'id': int(id_), 'title': title, 'content': content,
+             'parent_id': parent_id, 'chunk_index': int(chunk_index or 0)}
+            for id_, title, content, parent_id, chunk_index
+            in zip(ids, titles, contents, parent_ids, chunk_indexes)
+        ]
+        # Normalize rows once so a query only needs one dot product per row
+        self.matrix = normalize_rows(embeddings)
+        # Per-row int8 scales when the matrix is quantized (snapshots only)
+        self.scales = None
+        # Content version of the snapshot this index was opened from
+        self.version = None
+        self.partitions = Partitions(language_codes(self.rows))
+        self._partition_matrices = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_records(cls, records):
+        """Build an index from stored passage rows or from raw title/content documents
+
+        Rows that already carry an embedding are used as they are; raw
+        documents are split into passages the same way the data loader does
+        """
+        records = list(records)
+        if not (records and all(item.get('embedding') is not None for item in records)):
+            records = [passage for item in records for passage in chunk_record(item)]
+            embeddings = None
+        else:
+            embeddings = [_parse_embedding(item['embedding']) for item in records]
+
+        titles = [item.get('title', '') for item in records]
+        contents = [item.get('content', '') for item in records]
+        ids = [item.get('id', idx) for idx, item in enumerate(records, 1)]
+
+        if embeddings is None:
+            # Same text the data loader embeds for each row
+            embeddings = embed_many(f"{t}\n{c}" for t, c in zip(titles, contents))
+
+        return cls(ids, titles, contents, embeddings,
+                   parent_ids=[item.get('parent_id') for item in records],
+                   chunk_indexes=[item.get('chunk_index') or 0 for item in records])
+
+    @classmethod
+    def from_json(cls, file_path):
+        """Build an index from a health_data.json style file"""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return cls.from_records(json.load(f))
+
+    @classmethod
+    def from_supabase(cls, client, page_size=PAGE_SIZE):
+        """Build an index from a snapshot of the fitness_knowledge table, read page by page"""
+        return cls.from_records(row for page in select_pages(
+            client, 'id, title, content, parent_id, chunk_index, embedding', page_size
+        ) for row in page)
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """Open a snapshot directory; the matrix, tables and texts are memory-mapped"""
+        return open_snapshot(path, lambda manifest: cls._open_snapshot(path, manifest))
+
+    @classmethod
+    def _open_snapshot(cls, path, manifest):
+        if manifest.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot format {manifest.get('version')} is not "
+                             f"{SNAPSHOT_VERSION}; rebuild it")
+
+        def mapped(name):
+            return np.load(snapshot_file(path, manifest, name), mmap_mode='r')
+
+        rows = manifest['rows']
+        matrix = mapped(SNAPSHOT_MATRIX)
+        ids = mapped(SNAPSHOT_IDS)
+        offsets = mapped(SNAPSHOT_OFFSETS)
+        if matrix.shape != (rows, EMBEDDING_DIM) or len(ids) != rows or len(offsets) != rows + 1:
+            raise ValueError(f"Snapshot files in {path} do not match its manifest")
+        # An empty file cannot be mapped
+        blob = (np.memmap(snapshot_file(path, manifest, SNAPSHOT_PASSAGES), dtype=np.uint8, mode='r')
+                if offsets[-1] else b'')
+
+        index = cls.__new__(cls)
+        index.rows = PassageTable(ids, offsets, blob, manifest['kb_version'])
+        index.matrix = matrix
+        index.scales = mapped(SNAPSHOT_SCALES) if manifest['dtype'] == 'int8' else None
+        index.version = manifest['kb_version']
+        index.partitions = Partitions(mapped(SNAPSHOT_LANGUAGES))
+        index._partition_matrices = {}
+        return index
+
+    def save_snapshot(self, path, dtype='float32'):
+        """Write this index as a snapshot directory (see SnapshotWriter)"""
+        with SnapshotWriter(path, dtype) as writer:
+            for start in range(0, len(self), QUANTIZED_BLOCK_ROWS):
+                end = start + QUANTIZED_BLOCK_ROWS
+                writer.add([self.rows[i] for i in range(start, min(end, len(self)))],
+                           self._dense(start, end))
+
+    def passages(self):
+        """Rows without embeddings (read-only), e.g. to build a lexical index over the same passages"""
+        return self.rows
+
+    def embeddings(self):
+        """Normalized float32 matrix; dequantizes (and so copies) an int8 snapshot"""
+        return self._dense(0, len(self))
+
+    def _dense(self, start, end):
+        block = self.matrix[start:end]
+        if self.scales is None:
+            return block
+        return block.astype(np.float32) * self.scales[start:end, None]
+
+    def _similarities(self, queries):
+        """(m, n) cosine similarities for m normalized queries"""
+        if self.scales is None:
+            return queries @ self.matrix.T
+        # int8 rows: convert one block at a time so the float copy stays small
+        similarities = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), QUANTIZED_BLOCK_ROWS):
+            end = start + QUANTIZED_BLOCK_ROWS
+            similarities[:, start:end] = ((queries @ self.matrix[start:end].T.astype(np.float32))
+                                          * self.scales[start:end])
+        return similarities
+
+    def search(self, query_embedding, match_threshold=0.5, match_count=3, language=None):
+        """Return the top match_count rows with similarity above match_threshold
+
+        With a language, only that language's partition is scored (when it
+        is large enough to be used, see language.Partitions)
+        """
+        if not len(self) or match_count <= 0:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return []
+        query = query / query_norm
+
+        rows = self.partitions.rows(language)
+        if rows is not None and len(rows) * 2 <= len(self):
+            # A minority language: score its own contiguous copy of the rows
+            similarities = self._partition_matrix(language, rows) @ query
+            return self._top_rows(similarities, match_threshold, match_count, rows)
+
+        if self.scales is None:
+            similarities = self.matrix @ query
+        else:
+            similarities = self._similarities(query[None, :])[0]
+        if rows is not None:
+            # Most rows are in the partition: score all and pick among its rows
+            return self._top_rows(similarities[rows], match_threshold, match_count, rows)
+        return self._top_rows(similarities, match_threshold, match_count)
+
+    def search_many(self, query_embeddings, match_threshold=0.5, match_count=3, languages=None):
+        """search() for a batch of queries with one matrix-matrix product"""
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        if not len(self) or match_count <= 0:
+            return [[] for _ in range(len(queries))]
+
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        zero = norms[:, 0] == 0
+        norms[zero] = 1.0
+        similarities = self._similarities(queries / norms)
+        partitions = [self.partitions.rows(language) for language in languages or [None] * len(queries)]
+        return [
+            [] if zero[row] else
+            self._top_rows(similarities[row], match_threshold, match_count) if rows is None else
+            self._top_rows(similarities[row][rows], match_threshold, match_count, rows)
+            for row, rows in enumerate(partitions)
+        ]
+
+    def _partition_matrix(self, language, rows):
+        matrix = self._partition_matrices.get(language)
+        if matrix is None:
+            matrix = self._partition_matrices[language] = np.ascontiguousarray(
+                np.concatenate([self._dense(start, start + QUANTIZED_BLOCK_ROWS)[
+                    rows[(rows >= start) & (rows < start + QUANTIZED_BLOCK_ROWS)] - start]
+                    for start in range(0, len(self), QUANTIZED_BLOCK_ROWS)]))
+        return matrix
+
+    def _top_rows(self, similarities, match_threshold, match_count, rows=None):
+        """Best rows by similarity; similarities[j] belongs to row rows[j] when rows is given"""
+        if not len(similarities):
+            return []
+        # argpartition finds the top k in O(n); only those k get sorted
+        k = min(match_count, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        top = top[similarities[top] > match_threshold]
+
+        return [dict(self.rows[i if rows is None else int(rows[i])], similarity=float(similarities[i]))
+                for i in top]
+
+
+class SnapshotWriter:
+    """Streams passage rows and their embeddings into a snapshot directory
+
+    Memory stays bounded by one batch: rows are appended to temporary files
+    and stored under their digests by close(), which then publishes them by
+    replacing the manifest, so readers never see a half-written snapshot.
+    Run one writer per directory at a time: publishing deletes the files of
+    any snapshot other than the new one
+
+        with SnapshotWriter('index_snapshot', dtype='int8') as writer:
+            writer.add(rows, embeddings)
+    """
+
+    def __init__(self, path, dtype='float32'):
+        if dtype not in SNAPSHOT_DTYPES:
+            raise ValueError(f"dtype must be one of {SNAPSHOT_DTYPES}")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dtype = dtype
+        self.count = 0
+        self._matrix = tempfile.TemporaryFile(dir=path)
+        self._passages = tempfile.NamedTemporaryFile(dir=path, prefix=SNAPSHOT_PASSAGES + '.',
+                                                     delete=False)
+        self._ids = []
+        self._offsets = [0]
+        self._scales = []
+        self._languages = []
+        self._digest = hashlib.sha256()
+
+    def add(self, rows, embeddings):
+        """Append passage rows (id, title, content, parent_id, chunk_index) and their vectors"""
+        matrix = normalize_rows(embeddings)
+        if len(matrix) != len(rows):
+            raise ValueError("rows and embeddings differ in length")
+        if self.dtype == 'int8':
+            matrix, scales = quantize_rows(matrix)
+            self._scales.append(scales)
+        self._matrix.write(matrix.tobytes())
+        self._languages.append(language_codes(rows))
+
+        for row in rows:
+            self.count += 1
+            self._ids.append(row.get('id', self.count))
+            data = json.dumps({'title': row.get('title', ''), 'content': row.get('content', ''),
+                               'parent_id': row.get('parent_id'),
+                               'chunk_index': row.get('chunk_index') or 0},
+                              ensure_ascii=False).encode()
+            self._passages.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+            self._digest.update(data)
+
+    def close(self):
+        """Publish the snapshot; returns its manifest"""
+        self._passages.close()
+        os.chmod(self._passages.name, 0o644)
+        digest = self._digest.hexdigest()
+        files = {SNAPSHOT_PASSAGES: stored_name(SNAPSHOT_PASSAGES, digest)}
+        os.replace(self._passages.name, os.path.join(self.path, files[SNAPSHOT_PASSAGES]))
+
+        def write_matrix(f):
+            # .npy header, then the rows streamed from the temporary file
+            np.lib.format.write_array_header_1_0(f, {
+                'descr': np.lib.format.dtype_to_descr(np.dtype(self.dtype)),
+                'fortran_order': False,
+                'shape': (self.count, EMBEDDING_DIM)
+            })
+            self._matrix.seek(0)
+            shutil.copyfileobj(self._matrix, f, 1 << 20)
+
+        files[SNAPSHOT_MATRIX] = write_snapshot_file(self.path, SNAPSHOT_MATRIX, write_matrix)
+        self._matrix.close()
+        if self.dtype == 'int8':
+            scales = np.concatenate(self._scales) if self._scales else np.empty(0, np.float32)
+            files[SNAPSHOT_SCALES] = write_snapshot_file(self.path, SNAPSHOT_SCALES,
+                                                         lambda f: np.save(f, scales))
+        files[SNAPSHOT_IDS] = write_snapshot_file(
+            self.path, SNAPSHOT_IDS, lambda f: np.save(f, np.asarray(self._ids, dtype=np.int64)))
+        files[SNAPSHOT_OFFSETS] = write_snapshot_file(
+            self.path, SNAPSHOT_OFFSETS, lambda f: np.save(f, np.asarray(self._offsets, dtype=np.int64)))
+        languages = np.concatenate(self._languages) if self._languages else np.empty(0, np.uint8)
+        files[SNAPSHOT_LANGUAGES] = write_snapshot_file(self.path, SNAPSHOT_LANGUAGES,
+                                                        lambda f: np.save(f, languages))
+
+        manifest = {
+            'version': SNAPSHOT_VERSION,
+            'dtype': self.dtype,
+            'rows': self.count,
+            'dim': EMBEDDING_DIM,
+            'kb_version': digest[:16],
+            'files': files
+        }
+        publish_manifest(self.path, manifest)
+        return manifest
+
+    def abort(self):
+        self._matrix.close()
+        self._passages.close()
+        os.unlink(self._passages.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def read_manifest(path):
+    """The manifest.json of a snapshot directory"""
+    with open(os.path.join(path, SNAPSHOT_MANIFEST), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def open_snapshot(path, open_files):
+    """Return open_files(manifest) for the current manifest of path
+
+    A snapshot published between reading the manifest and opening its files
+    has deleted them; the new manifest is read and opened instead
+    """
+    for attempt in range(SNAPSHOT_OPEN_ATTEMPTS):
+        try:
+            return open_files(read_manifest(path))
+        except FileNotFoundError:
+            if attempt == SNAPSHOT_OPEN_ATTEMPTS - 1:
+                raise
+
+
+def snapshot_file(path, manifest, name):
+    """Path of the file stored for name (e.g. SNAPSHOT_MATRIX) in a snapshot"""
+    try:
+        return os.path.join(path, manifest['files'][name])
+    except KeyError:
+        raise ValueError(f"Snapshot in {path} has no {name}") from None
+
+
+def stored_name(name, digest):
+    """embeddings.npy -> embeddings.<digest>.npy"""
+    stem, suffix = os.path.splitext(name)
+    return f"{stem}.{digest[:16]}{suffix}"
+
+
+def write_snapshot_file(path, name, write):
+    """Call write(f) on a temporary file and store it under a name carrying its digest
+
+    Returns the stored name, for the manifest. An existing file is never
+    rewritten in place, so readers of the previous manifest keep their files
+    """
+    tmp, digest = _write_temporary(path, name, write)
+    stored = stored_name(name, digest)
+    os.replace(tmp, os.path.join(path, stored))
+    return stored
+
+
+def publish_manifest(path, manifest):
+    """Replace the manifest of path atomically, then delete files it no longer names"""
+    tmp, _ = _write_temporary(path, SNAPSHOT_MANIFEST,
+                              lambda f: f.write(json.dumps(manifest, indent=2).encode()))
+    os.replace(tmp, os.path.join(path, SNAPSHOT_MANIFEST))
+    # Readers that already mapped a deleted file keep it until they unmap it
+    current = set(manifest['files'].values())
+    for name in os.listdir(path):
+        if _STORED_NAME.match(name) and name not in current:
+            try:
+                os.unlink(os.path.join(path, name))
+            except FileNotFoundError:
+                pass
+
+
+class _HashingFile:
+    """Write-only file wrapper that hashes everything written through it"""
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.f.write(data)
+
+
+def _write_temporary(path, name, write):
+    """Call write(f) on a new temporary file next to name; returns its path and sha256"""
+    fd, tmp = tempfile.mkstemp(dir=path, prefix=name + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            hashing = _HashingFile(f)
+            write(hashing)
+        os.chmod(tmp, 0o644)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return tmp, hashing.digest.hexdigest()
+
+
+def _parse_embedding(value):
+    """PostgREST returns pgvector columns as '[0.1,0.2,...]' strings"""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
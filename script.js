@@ -11,6 +11,8 @@ let currentUtterance = null;
 let isPaused = false;
 let speechQueue = [];
 let recognitionLanguage = 'en-US'; // Default recognition language
+let sessionId = null; // Conversation id issued by the backend, so follow-ups keep context
+let serverAudio = null; // Sentence currently played from backend-synthesized audio
 
 // DOM Elements
 const chatContainer = document.getElementById('chatContainer');
@@ -126,16 +128,81 @@ function cleanTextForSpeech(text) {
     return cleaned;
 }
 
+// Language to speak a response in: Devanagari text follows the recognition language
+function speechLanguage(text) {
+    if (!/[\u0900-\u097F]/.test(text)) return 'en';
+    return recognitionLanguage.startsWith('mr') ? 'mr' : 'hi';
+}
+
+function hasBrowserVoice(language) {
+    if (!('speechSynthesis' in window)) return false;
+    if (selectedVoice && selectedVoice.lang.startsWith(language)) return true;
+    return window.speechSynthesis.getVoices().some(voice => voice.lang.startsWith(language));
+}
+
+function stopServerAudio() {
+    if (serverAudio) {
+        serverAudio.onended = null;
+        serverAudio.pause();
+        serverAudio = null;
+    }
+}
+
+// Play audio synthesized by the backend, one sentence after another.
+// Returns false when the backend has no TTS engine configured
+async function speakWithServer(text, language) {
+    const response = await fetch(`${API_URL}/voice`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ text, language })
+    });
+    if (!response.ok) return false;
+    
+    const { chunks } = await response.json();
+    if (!chunks || !chunks.length) return false;
+    
+    stopServerAudio();
+    const queue = chunks.map(chunk => `${API_URL}${chunk.url}`);
+    const playNext = () => {
+        const url = queue.shift();
+        if (!url) {
+            serverAudio = null;
+            return;
+        }
+        serverAudio = new Audio(url);
+        serverAudio.onended = playNext;
+        serverAudio.play().catch(error => console.error('Audio playback error:', error));
+    };
+    playNext();
+    return true;
+}
+
 // Text-to-Speech with female voice and pause/resume support
 function speak(text) {
     if (!isVoiceEnabled) return;
     
+    // Clean the text before speaking
+    const cleanedText = cleanTextForSpeech(text);
+    if (!cleanedText) return; // Don't speak if nothing left after cleaning
+    stopServerAudio();
+    
+    // No browser voice for this language (common for Hindi/Marathi): use the backend's
+    const language = speechLanguage(cleanedText);
+    if (!hasBrowserVoice(language)) {
+        speakWithServer(cleanedText, language)
+            .then(played => {
+                // Backend TTS is off: let the browser try its default voice
+                if (!played) speakInBrowser(cleanedText);
+            })
+            .catch(error => console.error('Server speech error:', error));
+        return;
+    }
+    
+    speakInBrowser(cleanedText);
+}
+
+function speakInBrowser(cleanedText) {
     if ('speechSynthesis' in window) {
-        // Clean the text before speaking
-        const cleanedText = cleanTextForSpeech(text);
-        
-        if (!cleanedText) return; // Don't speak if nothing left after cleaning
-        
         // Cancel any ongoing speech
         window.speechSynthesis.cancel();
         isPaused = false;
@@ -496,6 +563,55 @@ function showStatus(message, type = 'info') {
     }, 3000);
 }
 
+// Append the sources list to an assistant message bubble
+function addSources(bubbleDiv, sources) {
+    if (!sources || sources.length === 0) return;
+    
+    const sourcesDiv = document.createElement('div');
+    sourcesDiv.className = 'sources';
+    sourcesDiv.innerHTML = '<strong>📚 Sources:</strong>';
+    
+    sources.forEach(source => {
+        const sourceTag = document.createElement('span');
+        sourceTag.className = 'source-tag';
+        sourceTag.textContent = source;
+        sourcesDiv.appendChild(sourceTag);
+    });
+    
+    bubbleDiv.appendChild(sourcesDiv);
+}
+
+// Create an assistant message that is filled in as streamed tokens arrive
+function addStreamingMessage() {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message assistant';
+    
+    const bubbleDiv = document.createElement('div');
+    bubbleDiv.className = 'message-bubble';
+    
+    const contentDiv = document.createElement('div');
+    contentDiv.className = 'message-content';
+    
+    bubbleDiv.appendChild(contentDiv);
+    messageDiv.appendChild(bubbleDiv);
+    chatContainer.appendChild(messageDiv);
+    
+    let text = '';
+    
+    return {
+        append(token) {
+            text += token;
+            contentDiv.innerHTML = formatTextResponse(text).replace(/\n/g, '<br>');
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        },
+        finish(sources) {
+            addSources(bubbleDiv, sources);
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+            speak(text);
+        }
+    };
+}
+
 // Add message to chat
 function addMessage(content, isUser = false, sources = []) {
     const messageDiv = document.createElement('div');
@@ -518,19 +634,8 @@ function addMessage(content, isUser = false, sources = []) {
     bubbleDiv.appendChild(contentDiv);
     
     // Add sources if available
-    if (!isUser && sources && sources.length > 0) {
-        const sourcesDiv = document.createElement('div');
-        sourcesDiv.className = 'sources';
-        sourcesDiv.innerHTML = '<strong>📚 Sources:</strong>';
-        
-        sources.forEach(source => {
-            const sourceTag = document.createElement('span');
-            sourceTag.className = 'source-tag';
-            sourceTag.textContent = source;
-            sourcesDiv.appendChild(sourceTag);
-        });
-        
-        bubbleDiv.appendChild(sourcesDiv);
+    if (!isUser) {
+        addSources(bubbleDiv, sources);
     }
     
     messageDiv.appendChild(bubbleDiv);
@@ -606,6 +711,55 @@ function removeTypingIndicator() {
     }
 }
 
+// Read Server-Sent Events from /chat/stream into a streaming message
+async function readChatStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let streamingMessage = null;
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Events are separated by a blank line
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        
+        for (const rawEvent of events) {
+            let eventType = 'message';
+            let data = '';
+            
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventType = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            
+            if (!data) continue;
+            const payload = JSON.parse(data);
+            
+            if (!streamingMessage) {
+                // First event: swap the typing indicator for the message bubble
+                removeTypingIndicator();
+                streamingMessage = addStreamingMessage();
+            }
+            
+            if (eventType === 'token') {
+                streamingMessage.append(payload.token);
+            } else if (eventType === 'done') {
+                if (payload.session_id) sessionId = payload.session_id;
+                streamingMessage.finish(payload.sources || []);
+            }
+        }
+    }
+    
+    if (!streamingMessage) {
+        throw new Error('Empty response stream');
+    }
+}
+
 // Send message to backend
 async function sendMessage() {
     const message = messageInput.value.trim();
@@ -628,25 +782,21 @@ async function sendMessage() {
     addTypingIndicator();
     
     try {
-        const response = await fetch(`${API_URL}/chat`, {
+        // Stream the response so text appears as soon as the first token arrives
+        const response = await fetch(`${API_URL}/chat/stream`, {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
             },
-            body: JSON.stringify({ message })
+            body: JSON.stringify({ message, session_id: sessionId })
         });
         
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         
-        const data = await response.json();
-        
-        // Remove typing indicator
-        removeTypingIndicator();
-        
-        // Add assistant response
-        addMessage(data.response, false, data.sources || []);
+        await readChatStream(response);
         
     } catch (error) {
         console.error('Error sending message:', error);
@@ -736,6 +886,7 @@ voiceToggle.addEventListener('click', () => {
             voiceIcon.textContent = '🔇';
             voiceToggle.classList.add('disabled');
             window.speechSynthesis.cancel(); // Stop any ongoing speech
+            stopServerAudio();
             showStatus('Voice mode disabled', 'info');
         }
     }
@@ -860,6 +1011,7 @@ window.addEventListener('load', () => {
 document.addEventListener('visibilitychange', () => {
     if (document.hidden) {
         window.speechSynthesis.cancel();
+        stopServerAudio();
     }
 });
 